@@ -0,0 +1,209 @@
+"""Download statistics over time.
+
+Every flush of the download counter (counters.py) also appends the flushed
+counts to ``download_event``. `roll_up` moves those events into
+``download_rollup``: per hour, per day and for all time, for each note or paper,
+the subject and course it belongs to, and the whole site. The analytics page only
+reads rollups, which grow with the number of things downloaded per period rather
+than with the number of downloads. Hourly rows are dropped after
+``ANALYTICS_HOURLY_RETENTION_DAYS``; daily and all-time rows are kept.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select
+
+from app import db
+from database import upsert
+from models import Course, DownloadEvent, DownloadRollup, Note, QuestionPaper, Subject
+
+# All-time rows are stored as one period starting here.
+ALL_TIME = datetime(1970, 1, 1)
+SITE = 0
+RESOURCES = {'note': Note, 'paper': QuestionPaper}
+SCOPES = dict(RESOURCES, subject=Subject, course=Course)
+
+# Windows offered on the analytics page: (rollup period, length, trend bucket).
+WINDOWS = {
+    '24h': ('hour', timedelta(hours=24), 'hour'),
+    '7d': ('day', timedelta(days=7), 'day'),
+    '30d': ('day', timedelta(days=30), 'day'),
+    'all': ('all', None, 'month'),
+}
+
+Ranked = namedtuple('Ranked', ['key_id', 'downloads', 'item'])
+TrendPoint = namedtuple('TrendPoint', ['start', 'downloads'])
+
+
+def period_start(period, moment):
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ALL_TIME
+
+
+def _owners(events):
+    """Map (kind, ref_id) to (subject_id, course_id) for the resources in ``events``."""
+    owners = {}
+    for kind, model in RESOURCES.items():
+        ids = {ref_id for k, ref_id, _, _ in events if k == kind}
+        if ids:
+            rows = db.session.execute(select(model.id, model.subject_id, Subject.course_id)
+                                      .join(Subject, Subject.id == model.subject_id).where(model.id.in_(ids)))
+            owners.update(((kind, ref_id), (subject_id, course_id)) for ref_id, subject_id, course_id in rows)
+    return owners
+
+
+def _apply(deltas):
+    rows = [{'period': period, 'scope': scope, 'key_id': key_id, 'period_start': start, 'downloads': n}
+            for (period, scope, key_id, start), n in deltas.items()]
+    if not rows:
+        return
+    upsert(db.session.connection(), DownloadRollup, rows, ['period', 'scope', 'key_id', 'period_start'], 'downloads')
+
+
+def roll_up(batch_size=5000):
+    """Fold logged download events into the rollups; returns how many events were folded.
+
+    Events are deleted and counted in the same transaction (DELETE ... RETURNING),
+    so two processes rolling up at once never count an event twice.
+    """
+    folded = 0
+    while True:
+        first = db.session.query(func.min(DownloadEvent.id)).scalar()
+        if first is None:
+            break
+        events = db.session.execute(
+            delete(DownloadEvent).where(DownloadEvent.id < first + batch_size)
+            .returning(DownloadEvent.kind, DownloadEvent.ref_id, DownloadEvent.occurred_at, DownloadEvent.count)
+        ).all()
+        owners = _owners(events)
+        deltas = Counter()
+        for kind, ref_id, occurred_at, count in events:
+            subject_id, course_id = owners.get((kind, ref_id), (None, None))
+            for period in ('hour', 'day', 'all'):
+                start = period_start(period, occurred_at)
+                deltas[(period, 'site', SITE, start)] += count
+                deltas[(period, kind, ref_id, start)] += count
+                if subject_id is not None:
+                    deltas[(period, 'subject', subject_id, start)] += count
+                    deltas[(period, 'course', course_id, start)] += count
+        _apply(deltas)
+        db.session.commit()
+        folded += len(events)
+    if folded:
+        days = current_app.config.get('ANALYTICS_HOURLY_RETENTION_DAYS', 14)
+        db.session.execute(delete(DownloadRollup).where(
+            DownloadRollup.period == 'hour',
+            DownloadRollup.scope.in_(['site', *SCOPES]),
+            DownloadRollup.period_start < period_start('hour', datetime.utcnow() - timedelta(days=days))))
+        db.session.commit()
+    return folded
+
+
+def init_rollups():
+    """Seed the all-time rollups from the download counts of archives that predate them."""
+    seeded = db.session.query(DownloadRollup.key_id).filter_by(period='all', scope='site').first()
+    if seeded is not None:
+        return
+    total = sum(db.session.query(func.coalesce(func.sum(model.download_count), 0)).scalar()
+                for model in RESOURCES.values())
+    if not total:
+        return
+    columns = ['period', 'scope', 'key_id', 'period_start', 'downloads']
+    for kind, model in RESOURCES.items():
+        counted = model.download_count > 0
+        db.session.execute(insert(DownloadRollup).from_select(columns, select(
+            literal('all'), literal(kind), model.id, literal(ALL_TIME), model.download_count).where(counted)))
+    for scope, key in (('subject', Subject.id), ('course', Subject.course_id)):
+        per_key = Counter()
+        for model in RESOURCES.values():
+            query = select(key, func.sum(model.download_count)).select_from(model) \
+                .join(Subject, Subject.id == model.subject_id).where(model.download_count > 0).group_by(key)
+            per_key.update(dict(db.session.execute(query).all()))
+        _apply(Counter({('all', scope, key_id, ALL_TIME): n for key_id, n in per_key.items()}))
+    _apply(Counter({('all', 'site', SITE, ALL_TIME): total}))
+    db.session.commit()
+
+
+def _window(window, now):
+    period, length, _ = WINDOWS[window]
+    since = ALL_TIME if length is None else period_start(period, now - length) + \
+        (timedelta(hours=1) if period == 'hour' else timedelta(days=1))
+    return period, since
+
+
+def top(scope, window, limit=10, now=None):
+    """The ``limit`` most downloaded items of ``scope`` in ``window``, as Ranked tuples."""
+    period, since = _window(window, now or datetime.utcnow())
+    if period == 'all':
+        # One row per item, read in order from the end of the index.
+        query = select(DownloadRollup.key_id, DownloadRollup.downloads).where(
+            DownloadRollup.period == period, DownloadRollup.scope == scope,
+            DownloadRollup.period_start == ALL_TIME).order_by(DownloadRollup.downloads.desc())
+    else:
+        downloads = func.sum(DownloadRollup.downloads).label('downloads')
+        query = select(DownloadRollup.key_id, downloads).where(
+            DownloadRollup.period == period, DownloadRollup.scope == scope,
+            DownloadRollup.period_start >= since
+        ).group_by(DownloadRollup.key_id).order_by(downloads.desc(), DownloadRollup.key_id)
+    ranked = db.session.execute(query.limit(limit)).all()
+    model = SCOPES[scope]
+    query = model.query.filter(model.id.in_([key_id for key_id, _ in ranked]))
+    if model is Subject:
+        query = query.options(db.joinedload(Subject.course))
+    elif model is not Course:
+        query = query.options(db.joinedload(model.subject))
+    items = {item.id: item for item in query}
+    # Items deleted since they were downloaded keep their place, without a title.
+    return [Ranked(key_id, n, items.get(key_id)) for key_id, n in ranked]
+
+
+def trend(window, now=None):
+    """Site downloads over ``window``, one TrendPoint per bucket, oldest first."""
+    now = now or datetime.utcnow()
+    period, length, bucket = WINDOWS[window]
+    if period == 'all':
+        # Monthly totals for the last year, from the daily rows.
+        period, since = 'day', period_start('day', now - timedelta(days=365))
+    else:
+        since = _window(window, now)[1]
+    rows = dict(db.session.execute(
+        select(DownloadRollup.period_start, DownloadRollup.downloads)
+        .where(DownloadRollup.period == period, DownloadRollup.scope == 'site',
+               DownloadRollup.key_id == SITE, DownloadRollup.period_start >= since)
+    ).all())
+    points = []
+    if bucket == 'month':
+        months = Counter()
+        for start, n in rows.items():
+            months[start.replace(day=1)] += n
+        month = since.replace(day=1)
+        while month <= now:
+            points.append(TrendPoint(month, months.get(month, 0)))
+            month = (month + timedelta(days=32)).replace(day=1)
+        return points
+    step = timedelta(hours=1) if period == 'hour' else timedelta(days=1)
+    start = since
+    while start <= now:
+        points.append(TrendPoint(start, rows.get(start, 0)))
+        start += step
+    return points
+
+
+def total(window='all', now=None):
+    if window == 'all':
+        return db.session.query(DownloadRollup.downloads).filter_by(
+            period='all', scope='site', key_id=SITE, period_start=ALL_TIME).scalar() or 0
+    return sum(point.downloads for point in trend(window, now))
+
+
+def course_stats():
+    """(course name, subjects, notes) for every course, from two grouped counts."""
+    subjects = dict(db.session.query(Subject.course_id, func.count(Subject.id)).group_by(Subject.course_id))
+    notes = dict(db.session.query(Subject.course_id, func.count(Note.id))
+                 .join(Note, Note.subject_id == Subject.id).group_by(Subject.course_id))
+    return [(name, subjects.get(course_id, 0), notes.get(course_id, 0))
+            for course_id, name in db.session.query(Course.id, Course.name).order_by(Course.name)]
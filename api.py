@@ -0,0 +1,256 @@
+"""Read-only JSON API under /api/v1 for the mobile app and campus portal.
+
+Every resource is listed in id order with keyset pagination (``cursor``), and
+takes ``fields`` to return only some fields and ``ids`` to fetch up to
+MAX_PAGE_SIZE items in one request. ``updated_since`` turns a listing into a
+change feed: what was added or edited at or after that time, oldest change
+first; ``/api/v1/<resource>/deleted?since=`` lists what was deleted. Listings
+carry an ``as_of`` time for the client to pass as ``updated_since``/``since``
+on its next sync. Responses have weak ETags from the content version and
+answer If-None-Match with 304 before querying anything else.
+
+Download counts change without a new content version or ``updated_at``; ETags
+of responses that include them also roll over every ETAG_WINDOW seconds.
+"""
+import hashlib
+import json
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import Blueprint, current_app, jsonify, request, abort, url_for
+from sqlalchemy import delete, event, inspect, select, update
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import HTTPException
+
+from app import db
+from cache import content_version
+from models import Course, Subject, Note, QuestionPaper, Tag, Tombstone, note_tags, paper_tags
+from pagination import paginate
+
+PREFIX = '/api/v1'
+
+bp = Blueprint('api', __name__, url_prefix=PREFIX)
+
+Resource = namedtuple('Resource', ['kind', 'model', 'fields', 'tags', 'download'])
+
+_DOCUMENT_FIELDS = ('title', 'original_filename', 'file_size', 'subject_id', 'uploaded_at', 'updated_at',
+                    'download_count', 'tag_ids', 'download_url')
+
+RESOURCES = {
+    'courses': Resource('course', Course, ('id', 'name', 'description', 'created_at', 'updated_at'), None, None),
+    'subjects': Resource('subject', Subject, ('id', 'name', 'course_id', 'semester', 'created_at', 'updated_at'),
+                         None, None),
+    'notes': Resource('note', Note, ('id', 'description') + _DOCUMENT_FIELDS,
+                      note_tags.c.note_id, ('main.download_note', 'note_id')),
+    'papers': Resource('paper', QuestionPaper, ('id', 'year', 'semester', 'exam_type') + _DOCUMENT_FIELDS,
+                       paper_tags.c.paper_id, ('main.download_paper', 'paper_id')),
+    'tags': Resource('tag', Tag, ('id', 'name', 'created_at', 'updated_at'), None, None),
+}
+KINDS = {resource.model: resource.kind for resource in RESOURCES.values()}
+
+# Fields computed from other tables or the URL map rather than read from a column.
+COMPUTED = {'tag_ids', 'download_url'}
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_changes(session, flush_context, instances):
+    """Stamp edited content with updated_at and record deleted content as tombstones.
+
+    Tag edits on a note or paper count as edits of the note or paper. Bulk
+    statements (bulk ingest, the download counters) bypass this; bulk inserts get
+    updated_at from the column default.
+    """
+    now = datetime.utcnow()
+    for obj in session.dirty:
+        # Collections filled through backrefs (a subject's notes) are not edits.
+        if type(obj) in KINDS and (session.is_modified(obj, include_collections=False)
+                                   or (hasattr(obj, 'tags') and inspect(obj).attrs.tags.history.has_changes())):
+            obj.updated_at = now
+    deleted = [obj for obj in session.deleted if type(obj) in KINDS]
+    if not deleted:
+        return
+    connection = session.connection()
+    tag_ids = [obj.id for obj in deleted if isinstance(obj, Tag)]
+    if tag_ids:
+        # Losing a tag changes the tag_ids of everything that had it.
+        for resource in (RESOURCES['notes'], RESOURCES['papers']):
+            tagged = select(resource.tags).where(resource.tags.table.c.tag_id.in_(tag_ids))
+            connection.execute(update(resource.model).where(resource.model.id.in_(tagged)).values(updated_at=now))
+    connection.execute(Tombstone.__table__.insert(),
+                       [{'kind': KINDS[type(obj)], 'ref_id': obj.id, 'deleted_at': now} for obj in deleted])
+    cutoff = now - timedelta(days=current_app.config.get('API_TOMBSTONE_RETENTION_DAYS', 90))
+    connection.execute(delete(Tombstone).where(Tombstone.kind.in_({KINDS[type(obj)] for obj in deleted}),
+                                               Tombstone.deleted_at < cutoff))
+
+
+@bp.app_errorhandler(HTTPException)
+def api_error(error):
+    if not request.path.startswith(PREFIX + '/'):
+        return error
+    return jsonify({'error': error.description}), error.code
+
+
+def parse_time(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f'{name} must be an ISO 8601 time')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def selected_fields(resource):
+    fields = request.args.get('fields')
+    if not fields:
+        return resource.fields
+    names = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}; "
+                   f"{request.view_args['name']} have {', '.join(resource.fields)}")
+    # Keep the resource's order, and always identify the item.
+    return tuple(f for f in resource.fields if f == 'id' or f in names)
+
+
+def requested_ids():
+    ids = request.args.get('ids')
+    if ids is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(i) for i in ids.split(',') if i.strip()))
+    except ValueError:
+        abort(400, 'ids must be a comma-separated list of integers')
+    if not ids or len(ids) > current_app.config.get('MAX_PAGE_SIZE', 100):
+        abort(400, f"ids takes 1 to {current_app.config.get('MAX_PAGE_SIZE', 100)} ids")
+    return ids
+
+
+def as_of():
+    # Writes that were in flight when the request started may commit with an
+    # earlier updated_at, so the next sync overlaps this one a little.
+    overlap = current_app.config.get('API_SYNC_OVERLAP', 5)
+    return (datetime.utcnow() - timedelta(seconds=overlap)).isoformat()
+
+
+def api_etag(fields=()):
+    parts = [content_version(), request.path, sorted(request.args.items(multi=True))]
+    if 'download_count' in fields:
+        parts.append(int(time.time() // current_app.config['ETAG_WINDOW']))
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:32]
+
+
+def conditional(sparse=True):
+    """Give an API view a weak ETag from the content version and answer a matching
+    If-None-Match with 304 before the view runs. The view is called with the
+    resource and, for ``sparse`` views, the fields asked for."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(name, **kwargs):
+            resource = RESOURCES.get(name) or abort(404, f'No resource {name}')
+            fields = selected_fields(resource) if sparse else ()
+            if 'download_count' in fields and not current_app.config.get('ETAG_WINDOW'):
+                return view(resource, fields, **kwargs)
+            etag = api_etag(fields)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(resource, fields, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.cache_control.no_cache = True
+            response.cache_control.public = True
+            return response
+        return wrapper
+    return decorator
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def serialize(resource, fields, rows):
+    """Dicts of ``fields`` for ``rows``, with one extra query for tag_ids at most."""
+    tags = defaultdict(list)
+    if 'tag_ids' in fields and rows:
+        table = resource.tags.table
+        query = select(resource.tags, table.c.tag_id).where(resource.tags.in_([row.id for row in rows])) \
+            .order_by(resource.tags, table.c.tag_id)
+        for ref_id, tag_id in db.session.execute(query):
+            tags[ref_id].append(tag_id)
+    items = []
+    for row in rows:
+        item = {}
+        for field in fields:
+            if field == 'tag_ids':
+                item[field] = tags[row.id]
+            elif field == 'download_url':
+                endpoint, arg = resource.download
+                item[field] = url_for(endpoint, **{arg: row.id})
+            elif field == 'download_count':
+                item[field] = row.download_count or 0
+            else:
+                item[field] = _value(getattr(row, field))
+        items.append(item)
+    return items
+
+
+def column_query(resource, fields, *extra):
+    model = resource.model
+    names = dict.fromkeys(('id',) + tuple(f for f in fields if f not in COMPUTED) + extra)
+    return db.session.query(*[getattr(model, name) for name in names])
+
+
+@bp.route('/<name>')
+@conditional()
+def api_list(resource, fields):
+    model = resource.model
+    ids = requested_ids()
+    if ids is not None:
+        rows = column_query(resource, fields).filter(model.id.in_(ids)).all()
+        found = {row.id: row for row in rows}
+        return jsonify(items=serialize(resource, fields, [found[i] for i in ids if i in found]),
+                       missing=[i for i in ids if i not in found])
+    since = parse_time('updated_since')
+    query = column_query(resource, fields, 'updated_at' if since else 'id')
+    if since is not None:
+        # Oldest change first, so a client that stops part way can carry on from its cursor.
+        keys = ((model.updated_at, False), (model.id, False))
+        query = query.filter(model.updated_at >= since)
+    else:
+        keys = ((model.id, False),)
+    stamp = as_of()
+    page = paginate(query, keys, request.args.get('cursor'))
+    return jsonify(items=serialize(resource, fields, page.items), next_cursor=page.next_cursor,
+                   per_page=page.per_page, as_of=stamp)
+
+
+@bp.route('/<name>/<int:item_id>')
+@conditional()
+def api_item(resource, fields, item_id):
+    row = column_query(resource, fields).filter(resource.model.id == item_id).first()
+    if row is None:
+        abort(404, f'No {resource.kind} {item_id}')
+    return jsonify(serialize(resource, fields, [row])[0])
+
+
+@bp.route('/<name>/deleted')
+@conditional(sparse=False)
+def api_deleted(resource, fields):
+    since = parse_time('since')
+    retention = current_app.config.get('API_TOMBSTONE_RETENTION_DAYS', 90)
+    if since is None or since < datetime.utcnow() - timedelta(days=retention):
+        # Older deletions may have been pruned: the client has to sync from scratch.
+        abort(410, f'since must be within the last {retention} days; list everything again instead')
+    query = db.session.query(Tombstone.id, Tombstone.ref_id, Tombstone.deleted_at).filter(
+        Tombstone.kind == resource.kind, Tombstone.deleted_at >= since)
+    stamp = as_of()
+    page = paginate(query, ((Tombstone.deleted_at, False), (Tombstone.id, False)), request.args.get('cursor'))
+    return jsonify(items=[{'id': row.ref_id, 'deleted_at': row.deleted_at.isoformat()} for row in page.items],
+                   next_cursor=page.next_cursor, per_page=page.per_page, as_of=stamp)
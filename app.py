@@ -1,17 +1,16 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-
 import os
 import logging
 
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-logging.basicConfig(level=logging.DEBUG)
+import database
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 class Base(DeclarativeBase):
@@ -21,25 +20,174 @@ class Base(DeclarativeBase):
 db = SQLAlchemy(model_class=Base)
 login_manager = LoginManager()
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///edu_archive.db"
-
-print(f"DEBUG: SQLALCHEMY_ENGINE_OPTIONS is: {app.config.get('SQLALCHEMY_ENGINE_OPTIONS')}")
-
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
-db.init_app(app)
-login_manager.init_app(app)
-login_manager.login_view = "login"
-
-
-
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-with app.app_context():
-    import models
-    db.create_all()
+def create_app():
+    """Build the configured application, with its views, extensions and commands,
+    without touching the database or the disk."""
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET")
+    # One proxy in front (Replit's, or nginx): its X-Forwarded-For gives the client
+    # address that per-client download limits are counted against.
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = database.database_url()
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
+    # Connection pool per process, used for Postgres and other database servers.
+    app.config["DB_POOL_SIZE"] = 5
+    app.config["DB_MAX_OVERFLOW"] = 10
+    app.config["DB_POOL_TIMEOUT"] = 30
+    app.config["DB_POOL_RECYCLE"] = 1800
+    # Applied to every new SQLite connection. WAL lets readers run alongside a writer.
+    app.config["SQLITE_PRAGMAS"] = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    }
+    app.config["PAGE_SIZE"] = 25
+    app.config["MAX_PAGE_SIZE"] = 100
+    app.config["DOWNLOAD_FLUSH_INTERVAL"] = 5.0
+    app.config["DOWNLOAD_MAX_AGE"] = 300
+    # None to stream from gunicorn, "x-accel" for nginx or "x-sendfile" for Apache/lighttpd.
+    app.config["DOWNLOAD_OFFLOAD"] = None
+    app.config["DOWNLOAD_ACCEL_PREFIX"] = "/protected-uploads"
+    # Downloads one client address may have in flight per worker process (None for no limit).
+    app.config["DOWNLOAD_MAX_PER_CLIENT"] = 4
+    # Largest accepted request body, and largest file accepted through resumable uploads.
+    app.config["MAX_CONTENT_LENGTH"] = 256 * 1024 * 1024
+    app.config["UPLOAD_CHUNK_SIZE"] = 8 * 1024 * 1024
+    app.config["UPLOAD_PARTIAL_MAX_AGE"] = 24 * 3600
+    app.config["INGEST_WORKERS"] = 4
+    # "embedded" runs background jobs on a thread in each web process; set "external"
+    # when `flask run-worker` processes are deployed alongside the web server.
+    app.config["JOB_WORKER"] = "embedded"
+    app.config["JOB_POLL_INTERVAL"] = 2.0
+    app.config["JOB_RETRY_DELAY"] = 10
+    app.config["JOB_TIMEOUT"] = 3600
+    # Rendered public pages: "memory" caches per process, "sqlite" adds a cache shared
+    # by all workers on the host (PAGE_CACHE_PATH, default instance/page_cache.db).
+    app.config["PAGE_CACHE"] = "memory"
+    app.config["PAGE_CACHE_TTL"] = 300
+    app.config["PAGE_CACHE_SIZE"] = 512
+    app.config["PAGE_CACHE_PATH"] = None
+    # Keep uploads that compress by at least STORAGE_COMPRESSION_MIN_SAVING as
+    # "gzip" or "zstd" files on disk (None stores them as uploaded).
+    app.config["STORAGE_COMPRESSION"] = None
+    app.config["STORAGE_COMPRESSION_LEVEL"] = None
+    app.config["STORAGE_COMPRESSION_MIN_SAVING"] = 0.1
+    # First-page thumbnails and text previews, kept in PREVIEW_FOLDER (default
+    # uploads/.previews) up to PREVIEW_MAX_BYTES.
+    app.config["PREVIEW_FOLDER"] = None
+    app.config["PREVIEW_MAX_BYTES"] = 256 * 1024 * 1024
+    app.config["PREVIEW_WIDTH"] = 320
+    app.config["PREVIEW_QUALITY"] = 70
+    app.config["PREVIEW_CHARS"] = 600
+    # Cache lifetime of a served preview; previews of a stored file never change.
+    app.config["PREVIEW_MAX_AGE"] = 7 * 24 * 3600
+    # Download events are rolled up into hourly/daily analytics this often (seconds);
+    # hourly rows are kept for ANALYTICS_HOURLY_RETENTION_DAYS.
+    app.config["ANALYTICS_ROLLUP_INTERVAL"] = 60
+    app.config["ANALYTICS_HOURLY_RETENTION_DAYS"] = 14
+    # Listing pages get weak ETags from the content version, renewed at least this
+    # often (seconds) so download counts catch up; 0 turns ETags off.
+    app.config["ETAG_WINDOW"] = 300
+    # /api/v1: deletions are listed for API_TOMBSTONE_RETENTION_DAYS, and each
+    # listing's as_of lags by API_SYNC_OVERLAP seconds to cover writes in flight.
+    app.config["API_TOMBSTONE_RETENTION_DAYS"] = 90
+    app.config["API_SYNC_OVERLAP"] = 5
+    # Compress HTML and JSON responses here; leave off when a proxy already does it.
+    app.config["COMPRESS_RESPONSES"] = False
+    app.config["COMPRESS_MIN_SIZE"] = 1024
+    app.config["COMPRESS_LEVEL"] = 6
+    app.config["COMPRESS_BROTLI_QUALITY"] = 4
+    app.config["COMPRESS_MIMETYPES"] = [
+        "text/html", "application/json", "text/css", "text/plain", "text/csv", "application/javascript",
+        "image/svg+xml",
+    ]
+    # /admin/metrics: METRICS_TOKEN lets a scraper in without logging in, and
+    # METRICS_DIR (shared by all workers on the host) makes it report every worker.
+    app.config["METRICS_TOKEN"] = None
+    app.config["METRICS_DIR"] = None
+    app.config["METRICS_FLUSH_INTERVAL"] = 15
+    app.config["METRICS_SLOW_QUERY_MS"] = 500
+    # Sample the stacks of requests slower than PROFILE_SLOW_MS into PROFILE_DIR
+    # (default instance/profiles); None turns the sampler off.
+    app.config["PROFILE_SLOW_MS"] = None
+    app.config["PROFILE_INTERVAL"] = 0.01
+    app.config["PROFILE_DIR"] = None
+    # Apply pending migrations once when gunicorn starts (see gunicorn.conf.py); turn off
+    # to run `flask init-db` as a separate deploy step.
+    app.config["DB_AUTO_UPGRADE"] = True
+    app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "uploads")
+    app.config["LOG_LEVEL"] = "INFO"
+    app.config.from_prefixed_env()
+    logging.basicConfig(level=app.config["LOG_LEVEL"])
+    app.config["USE_X_SENDFILE"] = app.config["DOWNLOAD_OFFLOAD"] == "x-sendfile"
+    database.init_app(app)
+    db.init_app(app)
+    with app.app_context():
+        database.init_engine(app, db.engine)
+    login_manager.init_app(app)
+    login_manager.login_view = "main.login"
+    init_views(app)
+    # Alembic takes a few hundred milliseconds to import, so web workers leave it
+    # out; only the flask command and init_database() need migrations.
+    if click.get_current_context(silent=True) is not None:
+        init_migrations(app)
+    return app
+
+
+def init_views(app):
+    # Imported here because they use db and models, which import this module.
+    import jobs
+    import api
+    import commands
+    import routes
+    from assets import assets
+    from cache import page_cache
+    from compression import compression
+    from counters import download_counter
+    from limits import download_limiter
+    from metrics import metrics
+    from previews import previews
+    from storage import storage
+
+    # First, so its after_request hook runs last and times the others too.
+    metrics.init_app(app)
+    download_counter.init_app(app)
+    download_limiter.init_app(app)
+    jobs.embedded_worker.init_app(app)
+    storage.init_app(app)
+    page_cache.init_app(app)
+    assets.init_app(app)
+    compression.init_app(app)
+    previews.init_app(app)
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(commands.bp)
+
+
+def init_migrations(app):
+    from flask_migrate import Migrate
+    if "migrate" not in app.extensions:
+        Migrate(app, db, directory=os.path.join(BASE_DIR, "migrations"))
+
+
+def init_database(app):
+    """Bring the schema up to date and fill derived tables for older archives.
+
+    Run once per deploy (gunicorn's master does it on start, or `flask init-db`),
+    not in every worker.
+    """
+    init_migrations(app)
+    with app.app_context():
+        import models  # noqa: F401
+        from flask_migrate import upgrade
+        upgrade()
+        import search
+        search.init_search_index()
+        import facets
+        facets.init_facets()
+        import analytics
+        analytics.init_rollups()
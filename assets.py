@@ -0,0 +1,183 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask build-assets`` copies everything under ``static/`` into ``static/dist/``
+with a content hash in each file name, minifies our own stylesheets, rewrites
+``url()`` references between assets to the hashed names and writes ``.gz`` (and,
+with the ``brotli`` package installed, ``.br``) variants next to each text file.
+Templates link assets through ``asset_url()``; once a build exists those URLs
+are served from ``/assets/`` with a one-year immutable cache lifetime. Without a
+build, ``asset_url()`` falls back to the plain static files.
+
+Bootstrap and Font Awesome are vendored under ``static/vendor/`` so that pages
+load without reaching any CDN.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import abort, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+MAX_AGE = 365 * 24 * 3600
+
+# Already-compressed formats gain nothing from another pass.
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.ttf', '.map'}
+MIN_COMPRESS_SIZE = 512
+
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_COMMENT_RE = re.compile(r'/\*(?!!).*?\*/', re.S)
+SOURCE_MAP_RE = re.compile(r'\n?/[/*]# sourceMappingURL=[^\n]*')
+
+
+def minify_css(css):
+    css = CSS_COMMENT_RE.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def _hashed_name(path, data):
+    root, extension = posixpath.splitext(path)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+
+
+def _rewrite_urls(css, path, manifest):
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+        # Cache-busting query strings are dropped; SVG font fragments are kept.
+        target, sep, fragment = url.split('?')[0].partition('#')
+        resolved = posixpath.normpath(posixpath.join(base, target))
+        if resolved not in manifest:
+            return match.group(0)
+        hashed = posixpath.relpath(manifest[resolved], base)
+        return f'url({quote}{hashed}{sep}{fragment}{quote})'
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+def _compress(path, data):
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build_assets(static_folder, clean=False):
+    """Build ``static/dist`` and return the manifest.
+
+    Files from earlier builds are kept unless ``clean`` is set, so pages that were
+    cached before the rebuild still find the asset names they refer to.
+    """
+    out_dir = os.path.join(static_folder, BUILD_DIR)
+    if clean and os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != out_dir)
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            sources.append(os.path.relpath(full, static_folder).replace(os.sep, '/'))
+    # Stylesheets go last, so the fonts and images they refer to already have hashed names.
+    sources.sort(key=lambda p: p.endswith('.css'))
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(static_folder, *path.split('/')), 'rb') as f:
+            data = f.read()
+        extension = posixpath.splitext(path)[1]
+        if extension in ('.css', '.js'):
+            text = SOURCE_MAP_RE.sub('', data.decode('utf-8'))
+            if extension == '.css':
+                if not path.endswith('.min.css'):
+                    text = minify_css(text)
+                text = _rewrite_urls(text, path, manifest)
+            data = text.encode('utf-8')
+        hashed = _hashed_name(path, data)
+        target = os.path.join(out_dir, *hashed.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        if extension in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+            _compress(target, data)
+        manifest[path] = hashed
+
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if brotli is None:
+        logger.info('brotli is not installed; only gzip variants were written')
+    return manifest
+
+
+class Assets:
+    def __init__(self):
+        self.app = None
+        self._manifest = None
+
+    def init_app(self, app):
+        self.app = app
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.send_asset)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    @property
+    def root(self):
+        return os.path.join(self.app.static_folder, BUILD_DIR)
+
+    def manifest(self):
+        # Read on first use rather than at startup; a missing build means plain static files.
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.root, MANIFEST)) as f:
+                    self._manifest = json.load(f)
+            except FileNotFoundError:
+                self._manifest = {}
+        return self._manifest
+
+    def url(self, filename):
+        """URL for a file under ``static/``, fingerprinted when a build exists."""
+        hashed = self.manifest().get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('asset', filename=hashed)
+
+    def send_asset(self, filename):
+        path = safe_join(self.root, filename)
+        if path is None or filename.endswith(('.gz', '.br')) or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+                encoding = candidate
+                path += suffix
+                break
+        response = send_file(path, mimetype=mimetype, max_age=MAX_AGE, conditional=True)
+        # The name changes whenever the content does, so browsers never need to revalidate.
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response
+
+
+assets = Assets()
@@ -0,0 +1,88 @@
+"""Measure bytes on the wire and latency of listing pages with and without
+response compression and conditional GETs.
+
+Seeds a throwaway SQLite database like db_load_test.py, then requests each page
+repeatedly through the WSGI app in four modes: uncompressed, gzip, brotli, and
+revalidation with the ETag from an earlier response (a 304 when unchanged):
+
+    python benchmarks/compression_benchmark.py --documents 5000 --repeat 50
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db_load_test  # noqa: E402
+
+PAGES = ['/', '/notes', '/question-papers', '/question-papers?semester=3&semester=4', '/search?q=Note',
+         '/admin/notes', '/admin/question-papers']
+
+MODES = {
+    'identity': {},
+    'gzip': {'Accept-Encoding': 'gzip'},
+    'br': {'Accept-Encoding': 'br'},
+    '304': {'Accept-Encoding': 'br, gzip'},
+}
+
+
+def measure(client, url, headers, repeat):
+    sizes, timings = [], []
+    client.get(url, headers=headers)  # warm up
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(response.data))
+        if response.status_code not in (200, 304):
+            raise SystemExit(f'{url} returned {response.status_code}')
+    timings.sort()
+    return statistics.median(sizes), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_load_test.configure(SimpleNamespace(database_url=None, sqlite_defaults=False), tmp)
+        logging.disable(logging.INFO)
+        from app import db, init_database
+        from main import app
+        from models import Admin
+        from storage import storage
+
+        app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        app.config['WTF_CSRF_ENABLED'] = False
+        storage.init_app(app)
+        init_database(app)
+        with app.app_context():
+            db_load_test.seed(SimpleNamespace(files=5, file_kb=1, documents=args.documents), random.Random(42))
+            admin = Admin(username='bench')
+            admin.set_password('bench')
+            db.session.add(admin)
+            db.session.commit()
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+        print(f"{'page':<42}{'mode':<10}{'bytes':>10}{'p95 ms':>10}")
+        for url in PAGES:
+            for mode, headers in MODES.items():
+                app.config['COMPRESS_RESPONSES'] = mode != 'identity'
+                headers = dict(headers)
+                if mode == '304':
+                    headers['If-None-Match'] = client.get(url, headers=headers).headers['ETag']
+                size, p95 = measure(client, url, headers, args.repeat)
+                print(f'{url:<42}{mode:<10}{size:>10.0f}{p95:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
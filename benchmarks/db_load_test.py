@@ -0,0 +1,175 @@
+"""Measure concurrent page and download throughput against SQLite or Postgres.
+
+Seeds a database with synthetic courses, notes and papers, then forks worker
+processes, like gunicorn does, whose client threads mix public page views with
+file downloads through the WSGI app. Downloads feed the batched download
+counter, so readers contend with its writes the way they do in production:
+
+    python benchmarks/db_load_test.py --processes 4 --threads 4 --seconds 20
+    python benchmarks/db_load_test.py --sqlite-defaults
+    python benchmarks/db_load_test.py --database-url postgresql://localhost/edu_bench
+
+Without --database-url a throwaway SQLite file is used; --sqlite-defaults skips
+the connection pragmas to show what they are worth. A Postgres database given
+with --database-url must be empty, since the load test fills it.
+"""
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from environment import configure_app  # noqa: E402
+
+PAGE_WEIGHT = 0.7
+
+
+def configure(args, tmp):
+    url = args.database_url or f"sqlite:///{os.path.join(tmp, 'load.db')}"
+    # Measure the database rather than the page cache.
+    config = {'PAGE_CACHE': 'null'}
+    if args.sqlite_defaults:
+        config['SQLITE_PRAGMAS'] = '{}'
+    configure_app(url, secret='load-test', **config)
+
+
+def seed(args, rng):
+    from app import db
+    from models import Course, Subject, Note, QuestionPaper
+    from storage import storage
+
+    now = datetime.utcnow()
+    blobs = [storage.save(io.BytesIO(rng.randbytes(args.file_kb * 1024)), 'pdf') for _ in range(args.files)]
+    db.session.commit()
+    db.session.execute(db.insert(Course), [{'name': f'Course {i}', 'created_at': now} for i in range(10)])
+    course_ids = [c.id for c in Course.query]
+    db.session.execute(db.insert(Subject), [{'name': f'Subject {i}', 'course_id': rng.choice(course_ids),
+                                             'semester': rng.randint(1, 8), 'created_at': now} for i in range(100)])
+    subject_ids = [s.id for s in Subject.query]
+    half = args.documents // 2
+    db.session.execute(db.insert(Note), [
+        {'title': f'Note {i}', 'filename': rng.choice(blobs).filename, 'original_filename': f'note{i}.pdf',
+         'file_size': args.file_kb * 1024, 'subject_id': rng.choice(subject_ids), 'uploaded_at': now,
+         'download_count': 0} for i in range(half)])
+    db.session.execute(db.insert(QuestionPaper), [
+        {'title': f'Paper {i}', 'year': rng.randint(2010, 2024), 'semester': rng.randint(1, 8),
+         'exam_type': rng.choice(['midterm', 'endterm', 'quiz']), 'filename': rng.choice(blobs).filename,
+         'original_filename': f'paper{i}.pdf', 'file_size': args.file_kb * 1024,
+         'subject_id': rng.choice(subject_ids), 'uploaded_at': now, 'download_count': 0}
+        for i in range(args.documents - half)])
+    db.session.commit()
+    return subject_ids, [n for (n,) in db.session.query(Note.id)], [p for (p,) in db.session.query(QuestionPaper.id)]
+
+
+def run_client(app, stop, results, rng, subject_ids, note_ids, paper_ids):
+    client = app.test_client()
+    pages = ['/', '/notes', '/question-papers', lambda: f'/notes/subject/{rng.choice(subject_ids)}',
+             lambda: f'/question-papers?year={rng.randint(2010, 2024)}']
+    while not stop.is_set():
+        if rng.random() < PAGE_WEIGHT:
+            kind = 'page'
+            url = rng.choice(pages)
+            url = url() if callable(url) else url
+        else:
+            kind = 'download'
+            if rng.random() < 0.5:
+                url = f'/download/note/{rng.choice(note_ids)}'
+            else:
+                url = f'/download/paper/{rng.choice(paper_ids)}'
+        start = time.perf_counter()
+        response = client.get(url)
+        response.close()
+        elapsed = (time.perf_counter() - start) * 1000
+        results[kind].append(elapsed if response.status_code == 200 else None)
+
+
+def run_process(app, args, index, queue, *ids):
+    from app import db
+    from counters import download_counter
+    with app.app_context():
+        # Connections inherited from the parent must not be shared across the fork.
+        db.engine.dispose(close=False)
+    results = defaultdict(list)
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_client, args=(app, stop, results, random.Random(index * 1000 + i), *ids))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    download_counter.flush()
+    queue.put(dict(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Database to fill and load; a throwaway SQLite file by default.')
+    parser.add_argument('--sqlite-defaults', action='store_true', help='Skip the SQLite connection pragmas.')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--file-kb', type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(args, tmp)
+        logging.disable(logging.INFO)
+        from app import db, init_database
+        from main import app
+        from storage import storage
+
+        app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        storage.init_app(app)
+        rng = random.Random(42)
+        init_database(app)
+        with app.app_context():
+            start = time.perf_counter()
+            subject_ids, note_ids, paper_ids = seed(args, rng)
+            print(f'Seeded {args.documents} documents in {time.perf_counter() - start:.1f}s')
+            print(f'Backend: {db.engine.dialect.name}, pool: {type(db.engine.pool).__name__}, '
+                  f"pragmas: {json.dumps(app.config['SQLITE_PRAGMAS']) if db.engine.dialect.name == 'sqlite' else '-'}")
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=run_process, args=(app, args, i, queue, subject_ids, note_ids, paper_ids))
+                   for i in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        results = defaultdict(list)
+        for _ in workers:
+            for kind, timings in queue.get().items():
+                results[kind] += timings
+        for worker in workers:
+            worker.join()
+
+        print(f"\n{args.processes} processes x {args.threads} threads for {args.seconds:.0f}s")
+        print(f"{'kind':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for kind in ('page', 'download'):
+            timings = results[kind]
+            ok = sorted(t for t in timings if t is not None)
+            if not ok:
+                print(f'{kind:<10}{len(timings):>10}{len(timings):>8}')
+                continue
+            p95 = ok[min(len(ok) - 1, int(len(ok) * 0.95))]
+            print(f'{kind:<10}{len(timings):>10}{len(timings) - len(ok):>8}{len(ok) / args.seconds:>10.1f}'
+                  f'{statistics.median(ok):>10.1f}{p95:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
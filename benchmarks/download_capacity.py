@@ -0,0 +1,195 @@
+"""Measure how many concurrent downloads a running server sustains, with slow clients.
+
+Each simulated student repeatedly downloads a random note or paper over a fresh
+connection and reads it at --client-kbps through a small receive buffer, the
+way a phone on campus Wi-Fi does, so the server has to wait on the client
+rather than hand the whole file to the kernel at once. For every --clients
+level it reports downloads per second, throughput, time to first byte and how
+long the home page takes to load meanwhile:
+
+    gunicorn -c gunicorn.conf.py main:app                  # sync workers
+    python benchmarks/download_capacity.py --manifest /tmp/bench/manifest.json --json sync.json
+    GUNICORN_ASYNC=1 gunicorn -c gunicorn.conf.py main:app  # gevent workers
+    python benchmarks/download_capacity.py --manifest /tmp/bench/manifest.json --baseline sync.json
+
+Every client sends its own X-Forwarded-For address, so the per-client download
+limit (DOWNLOAD_MAX_PER_CLIENT) does not throttle the test as a whole.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from http_load import percentile
+
+
+async def fetch(host, port, path, headers, rcvbuf, kbps, timeout):
+    """GET ``path`` over a new connection; returns (status, time to first byte, total time, bytes)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if rcvbuf:
+        # Set before connecting, so the window the server sees stays small.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setblocking(False)
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    await asyncio.wait_for(loop.sock_connect(sock, (host, port)), timeout)
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        lines = [f'GET {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close']
+        lines += [f'{k}: {v}' for k, v in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        first_byte = time.perf_counter() - start
+        status = int(head.split(b' ', 2)[1])
+        received = 0
+        chunk = max(1024, kbps * 1024 // 10) if kbps else 64 * 1024
+        while True:
+            data = await asyncio.wait_for(reader.read(chunk), timeout)
+            if not data:
+                break
+            received += len(data)
+            if kbps:
+                # Read no faster than the client's link would deliver.
+                behind = received / (kbps * 1024) - (time.perf_counter() - start - first_byte)
+                if behind > 0:
+                    await asyncio.sleep(behind)
+        return status, first_byte, time.perf_counter() - start, received
+    finally:
+        writer.close()
+
+
+def pick_download(rng, manifest):
+    kind = rng.choice([k for k in ('note', 'paper') if manifest[k + 's']])
+    return f"/download/{kind}/{rng.randint(1, manifest[kind + 's'])}"
+
+
+async def student(number, args, host, port, manifest, deadline, results):
+    rng = random.Random(args.seed * 100000 + number)
+    headers = {'X-Forwarded-For': f'10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}'}
+    while time.perf_counter() < deadline:
+        try:
+            status, first_byte, elapsed, received = await fetch(
+                host, port, pick_download(rng, manifest), headers, args.rcvbuf, args.client_kbps, args.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            results['errors'] += 1
+            await asyncio.sleep(0.1)
+            continue
+        if status >= 400:
+            results['errors'] += 1
+            if status == 429:
+                results['limited'] += 1
+            await asyncio.sleep(0.1)
+            continue
+        results['first_byte'].append(first_byte)
+        results['elapsed'].append(elapsed)
+        results['bytes'] += received
+
+
+async def probe(args, host, port, deadline, results):
+    # A visitor loading the home page while the downloads are in flight.
+    while time.perf_counter() < deadline:
+        try:
+            status, _, elapsed, _ = await fetch(host, port, '/', {'X-Forwarded-For': '192.0.2.1'},
+                                                0, 0, args.timeout)
+            if status < 400:
+                results['page'].append(elapsed)
+            else:
+                results['page_errors'] += 1
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            results['page_errors'] += 1
+        await asyncio.sleep(args.probe_interval)
+
+
+async def run_level(clients, args, host, port, manifest):
+    results = {'first_byte': [], 'elapsed': [], 'page': [], 'bytes': 0, 'errors': 0, 'limited': 0,
+               'page_errors': 0}
+    deadline = time.perf_counter() + args.warmup + args.seconds
+    tasks = []
+    # Students arrive over the warm-up rather than all in the same millisecond.
+    for i in range(clients):
+        tasks.append(asyncio.create_task(student(i, args, host, port, manifest, deadline, results)))
+        await asyncio.sleep(args.warmup / clients)
+    measured_from = time.perf_counter()
+    for key in ('first_byte', 'elapsed', 'bytes', 'errors', 'limited'):
+        results[key] = [] if isinstance(results[key], list) else 0
+    tasks.append(asyncio.create_task(probe(args, host, port, deadline, results)))
+    await asyncio.gather(*tasks)
+    duration = time.perf_counter() - measured_from
+    first_byte = sorted(results['first_byte'])
+    elapsed = sorted(results['elapsed'])
+    page = sorted(results['page'])
+    return {
+        'downloads': len(elapsed),
+        'errors': results['errors'],
+        'limited': results['limited'],
+        'downloads_per_s': len(elapsed) / duration,
+        'mb_per_s': results['bytes'] / duration / 1e6,
+        'ttfb_p50_ms': percentile(first_byte, 0.50) * 1000,
+        'ttfb_p95_ms': percentile(first_byte, 0.95) * 1000,
+        'ttfb_p99_ms': percentile(first_byte, 0.99) * 1000,
+        'download_p50_ms': percentile(elapsed, 0.50) * 1000,
+        'page_p95_ms': percentile(page, 0.95) * 1000,
+        'page_errors': results['page_errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--manifest', required=True, help='Written by benchmarks/generate_archive.py.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', default='25,100,400', help='Comma-separated concurrency levels.')
+    parser.add_argument('--seconds', type=float, default=20, help='Measured time per level, after the warm-up.')
+    parser.add_argument('--warmup', type=float, default=3, help='Time over which the clients connect.')
+    parser.add_argument('--client-kbps', type=int, default=256, help='Read rate of each client (0: as fast as it can).')
+    parser.add_argument('--rcvbuf', type=int, default=16 * 1024, help='Client socket receive buffer (0: the default).')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--probe-interval', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Write the results here, to pass as --baseline later.')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against.')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    parts = urlsplit(args.url)
+    host, port = parts.hostname, parts.port or 80
+    try:
+        socket.create_connection((host, port), timeout=5).close()
+    except OSError as e:
+        raise SystemExit(f'Cannot reach {args.url}: {e}')
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['levels']
+
+    print(f'{args.url}, clients reading at {args.client_kbps} KB/s, {args.seconds:.0f}s per level')
+    print(f"{'clients':>8}{'downloads':>11}{'errors':>8}{'dl/s':>8}{'MB/s':>8}"
+          f"{'ttfb p50':>10}{'ttfb p95':>10}{'ttfb p99':>10}{'dl p50':>9}{'page p95':>10}")
+    levels = {}
+    for clients in [int(c) for c in args.clients.split(',')]:
+        result = levels[str(clients)] = asyncio.run(run_level(clients, args, host, port, manifest))
+        print(f"{clients:>8}{result['downloads']:>11}{result['errors']:>8}{result['downloads_per_s']:>8.1f}"
+              f"{result['mb_per_s']:>8.1f}{result['ttfb_p50_ms']:>10.0f}{result['ttfb_p95_ms']:>10.0f}"
+              f"{result['ttfb_p99_ms']:>10.0f}{result['download_p50_ms']:>9.0f}{result['page_p95_ms']:>10.0f}")
+        before = baseline.get(str(clients))
+        if before and result['downloads']:
+            changes = defaultdict(str)
+            for key in ('downloads_per_s', 'ttfb_p50_ms', 'ttfb_p95_ms', 'ttfb_p99_ms', 'page_p95_ms'):
+                if before[key] and before[key] == before[key]:
+                    changes[key] = f'{(result[key] - before[key]) / before[key]:+.0%}'
+            print(f"{'  vs baseline':<27}{changes['downloads_per_s']:>8}{'':>8}{changes['ttfb_p50_ms']:>10}"
+                  f"{changes['ttfb_p95_ms']:>10}{changes['ttfb_p99_ms']:>10}{'':>9}{changes['page_p95_ms']:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'target': args.url, 'client_kbps': args.client_kbps, 'seconds': args.seconds,
+                       'levels': levels}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
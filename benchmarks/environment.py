@@ -0,0 +1,23 @@
+"""Settings for benchmarks that load the app in their own process.
+
+create_app() reads its configuration from the environment, so `configure_app`
+has to run before anything imports main or calls create_app().
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_app(database_url, uploads=None, secret='benchmark', **config):
+    """Point the app at ``database_url`` (and ``uploads``), leave jobs to an
+    external worker, and set any other config keys given as FLASK_ variables."""
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = database_url
+    if uploads is not None:
+        os.environ['FLASK_UPLOAD_FOLDER'] = os.path.abspath(uploads)
+    os.environ['FLASK_JOB_WORKER'] = 'external'
+    os.environ.setdefault('SESSION_SECRET', secret)
+    for name, value in config.items():
+        os.environ[f'FLASK_{name}'] = value
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
@@ -0,0 +1,229 @@
+"""Fill an empty database and upload folder with a synthetic archive.
+
+Creates courses, subjects, tags, notes and question papers (millions if asked,
+inserted in batches), tag links with a few popular tags and a long tail, a set
+of small PDF and text files in content-addressed storage for the documents to
+point at, and an admin account. The search index and paper filter counts are
+rebuilt at the end, as after an import. The same --seed always produces the same
+archive, so runs before and after a change see identical data:
+
+    python benchmarks/generate_archive.py --database-url sqlite:////tmp/bench/archive.db \\
+        --uploads /tmp/bench/uploads --notes 1000000 --papers 500000
+
+A manifest (``manifest.json`` next to the uploads folder unless --manifest says
+otherwise) records what was generated, for benchmarks/http_load.py to pick
+request parameters from.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from environment import configure_app  # noqa: E402
+
+WORDS = ('algorithm data structure graph tree heap network protocol thermodynamics '
+         'circuit signal transform fourier laplace matrix vector calculus integral '
+         'differential equation compiler parser grammar automata database index query '
+         'transaction kernel process thread memory cache pipeline processor semiconductor '
+         'diode transistor amplifier control system feedback stability mechanics fluid').split()
+EXAM_TYPES = ('midterm', 'endterm', 'quiz', 'assignment')
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def make_pdf(rng, size):
+    """A one-page PDF with a line of text, padded with comments to about ``size`` bytes."""
+    text = sentence(rng, 8)
+    content = f'BT /F1 14 Tf 72 720 Td ({text}) Tj ET'.encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    while out.tell() < size - 600:
+        out.write(f'% {sentence(rng, 12)}\n'.encode())
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def make_txt(rng, size):
+    lines, total = [], 0
+    while total < size:
+        lines.append(sentence(rng, 12) + '\n')
+        total += len(lines[-1])
+    return ''.join(lines).encode()
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_rows(model_or_table, rows, batch_size, label):
+    from app import db
+    table = getattr(model_or_table, '__table__', model_or_table)
+    count = 0
+    start = time.perf_counter()
+    for batch in batches(rows, batch_size):
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        count += len(batch)
+    print(f'{label:<12}{count:>12} rows in {time.perf_counter() - start:6.1f}s')
+    return count
+
+
+def seed(args, rng):
+    from app import db
+    from models import Admin, Course, Subject, Tag, Note, QuestionPaper, note_tags, paper_tags
+    from storage import storage, recount_references
+
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    blobs = []
+    for i in range(args.files):
+        extension = 'txt' if i % 5 == 4 else 'pdf'
+        size = max(1024, int(rng.expovariate(1 / (args.file_kb * 1024))))
+        data = make_txt(rng, size) if extension == 'txt' else make_pdf(rng, size)
+        blobs.append(storage.acquire(storage.write(io.BytesIO(data), extension)))
+    db.session.commit()
+    print(f"{'files':<12}{len(blobs):>12} blobs in {time.perf_counter() - start:6.1f}s")
+
+    insert_rows(Course, ({'id': i, 'name': f'Course {i} {sentence(rng, 2)}', 'created_at': now}
+                         for i in range(1, args.courses + 1)), args.batch_size, 'courses')
+    insert_rows(Subject, ({'id': i, 'name': sentence(rng, 3).title(), 'course_id': rng.randint(1, args.courses),
+                           'semester': rng.randint(1, 8), 'created_at': now}
+                          for i in range(1, args.subjects + 1)), args.batch_size, 'subjects')
+    tag_names = sorted({f'{rng.choice(WORDS)}-{i}' for i in range(args.tags)})
+    insert_rows(Tag, ({'id': i, 'name': name, 'created_at': now} for i, name in enumerate(tag_names, 1)),
+                args.batch_size, 'tags')
+
+    def uploaded_at(i, total):
+        # Spread over five years, oldest first, as the ids are.
+        return now - timedelta(minutes=(total - i) * 5 * 365 * 24 * 60 // max(total, 1))
+
+    def document(i, total, kind):
+        blob = rng.choice(blobs)
+        return {'id': i, 'title': sentence(rng, rng.randint(3, 7)).capitalize(), 'filename': blob.filename,
+                'original_filename': f'{kind}{i}.{blob.filename.rsplit(".", 1)[-1]}', 'file_size': blob.size,
+                'subject_id': rng.randint(1, args.subjects), 'uploaded_at': uploaded_at(i, total),
+                'download_count': int(rng.paretovariate(1.2)) - 1}
+
+    insert_rows(Note, (dict(document(i, args.notes, 'note'), description=sentence(rng, rng.randint(0, 30)))
+                       for i in range(1, args.notes + 1)), args.batch_size, 'notes')
+    insert_rows(QuestionPaper, (dict(document(i, args.papers, 'paper'), year=rng.randint(2010, 2025),
+                                     semester=rng.randint(1, 8), exam_type=rng.choice(EXAM_TYPES))
+                                for i in range(1, args.papers + 1)), args.batch_size, 'papers')
+
+    def tag_links(total, key):
+        # Zipf-like: a handful of tags are on a large share of documents.
+        for i in range(1, total + 1):
+            for tag_id in {min(len(tag_names), int(rng.paretovariate(0.8))) for _ in range(rng.randint(0, 3))}:
+                yield {key: i, 'tag_id': tag_id}
+
+    insert_rows(note_tags, tag_links(args.notes, 'note_id'), args.batch_size, 'note tags')
+    insert_rows(paper_tags, tag_links(args.papers, 'paper_id'), args.batch_size, 'paper tags')
+
+    if db.engine.dialect.name == 'postgresql':
+        # Rows were inserted with explicit ids, which leaves the sequences behind.
+        from transfer import _reset_sequences
+        _reset_sequences(db.session.connection())
+    recount_references()
+    admin = Admin(username=args.admin_username)
+    admin.set_password(args.admin_password)
+    db.session.add(admin)
+    db.session.commit()
+    return tag_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='An empty database to fill.')
+    parser.add_argument('--uploads', required=True, help='Upload folder to write the files to.')
+    parser.add_argument('--manifest', help='Where to write the manifest (default: next to the uploads folder).')
+    parser.add_argument('--courses', type=int, default=20)
+    parser.add_argument('--subjects', type=int, default=400)
+    parser.add_argument('--tags', type=int, default=300)
+    parser.add_argument('--notes', type=int, default=50000)
+    parser.add_argument('--papers', type=int, default=50000)
+    parser.add_argument('--files', type=int, default=200, help='Distinct files the documents point at.')
+    parser.add_argument('--file-kb', type=int, default=64, help='Mean file size.')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-search', action='store_true', help='Do not build the search index.')
+    parser.add_argument('--admin-username', default='bench')
+    parser.add_argument('--admin-password', default='bench')
+    args = parser.parse_args()
+
+    os.makedirs(args.uploads, exist_ok=True)
+    configure_app(args.database_url, args.uploads)
+    logging.disable(logging.INFO)
+    from app import db, init_database
+    from main import app
+    import facets
+    import search
+    from models import Course
+
+    init_database(app)
+    with app.app_context():
+        if db.session.query(Course.id).first() is not None:
+            raise SystemExit('The database already has courses; generate into an empty one.')
+        tag_names = seed(args, random.Random(args.seed))
+        start = time.perf_counter()
+        facets.rebuild_facets()
+        db.session.commit()
+        if not args.skip_search:
+            search.rebuild_search_index()
+            db.session.commit()
+        print(f"{'indexes':<12}{'':>12} rebuilt in {time.perf_counter() - start:6.1f}s")
+
+    manifest = {
+        'database_url': args.database_url,
+        'uploads': os.path.abspath(args.uploads),
+        'seed': args.seed,
+        'courses': args.courses,
+        'subjects': args.subjects,
+        'notes': args.notes,
+        'papers': args.papers,
+        'tags': tag_names,
+        'years': [2010, 2025],
+        'words': list(WORDS),
+        'search': not args.skip_search,
+        'admin': {'username': args.admin_username, 'password': args.admin_password},
+    }
+    path = args.manifest or os.path.join(os.path.dirname(os.path.abspath(args.uploads)), 'manifest.json')
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f'Manifest written to {path}')
+
+
+if __name__ == '__main__':
+    main()
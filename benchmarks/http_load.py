@@ -0,0 +1,268 @@
+"""Drive request scenarios against the app and report latency percentiles and throughput.
+
+Reads the manifest written by benchmarks/generate_archive.py to pick ids, tags,
+filters and search terms, then runs each scenario in turn for --seconds with
+--concurrency client threads over keep-alive connections:
+
+    gunicorn -c gunicorn.conf.py main:app   # with the generated database and uploads
+    python benchmarks/http_load.py --manifest /tmp/bench/manifest.json --json before.json
+    # ... make a change, restart the server ...
+    python benchmarks/http_load.py --manifest /tmp/bench/manifest.json --baseline before.json
+
+--in-process skips the server and HTTP and calls the WSGI app directly, which
+isolates the time spent in the app (like a microbenchmark) from the server's.
+The admin_bulk_upload scenario logs in as the manifest's admin and parks one
+small file per request for the ingest job, so it writes to the upload folder.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from environment import configure_app  # noqa: E402
+from generate_archive import make_pdf  # noqa: E402
+
+
+def _download(rng, manifest):
+    kind = rng.choice([k for k in ('note', 'paper') if manifest[k + 's']])
+    return f"/download/{kind}/{rng.randint(1, manifest[kind + 's'])}"
+
+
+def _search_terms(rng, manifest):
+    words = manifest['words']
+    return rng.choice([rng.choice(words), f'{rng.choice(words)} {rng.choice(words)}', rng.choice(words)[:4]])
+
+
+def _paper_filters(rng, manifest):
+    first, last = manifest['years']
+    filters = [('year', rng.randint(first, last))]
+    if rng.random() < 0.5:
+        filters.append(('semester', rng.randint(1, 8)))
+    if rng.random() < 0.3:
+        filters.append(('tag', rng.randint(1, min(len(manifest['tags']), 10))))
+    return filters
+
+
+def _api_notes(rng, manifest):
+    if rng.random() < 0.5:
+        ids = ','.join(str(rng.randint(1, manifest['notes'])) for _ in range(20))
+        return f'/api/v1/notes?ids={ids}&fields=title,updated_at,tag_ids'
+    return "/api/v1/notes?updated_since=2000-01-01&per_page=50"
+
+
+def _bulk_upload(rng, manifest):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (('resource_type', 'notes'), ('subject_id', str(rng.randint(1, manifest['subjects'])))):
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="bench.pdf"\r\n'
+                 f'Content-Type: application/pdf\r\n\r\n'.encode() + make_pdf(rng, 8 * 1024) + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+# name -> (needs login, function returning (method, path, body, headers))
+SCENARIOS = {
+    'index': (False, lambda rng, m: ('GET', '/', None, {})),
+    'notes_tag': (False, lambda rng, m: (
+        'GET', '/notes?' + urlencode({'tag': rng.choice(m['tags'][:20])}), None, {})),
+    'question_papers': (False, lambda rng, m: (
+        'GET', '/question-papers?' + urlencode(_paper_filters(rng, m)), None, {})),
+    'search': (False, lambda rng, m: ('GET', '/search?' + urlencode({'q': _search_terms(rng, m)}), None, {})),
+    'download': (False, lambda rng, m: ('GET', _download(rng, m), None, {})),
+    'api_notes': (False, lambda rng, m: ('GET', _api_notes(rng, m), None, {})),
+    'admin_bulk_upload': (True, lambda rng, m: ('POST', '/admin/bulk-upload', *_bulk_upload(rng, m))),
+}
+
+
+class HTTPClient:
+    """One keep-alive connection, with just enough cookie handling for a session."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+        return response.status, data
+
+    def close(self):
+        self.connection.close()
+
+
+class WSGIClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+    def close(self):
+        pass
+
+
+def log_in(client, manifest):
+    _, page = client.request('GET', '/login')
+    match = re.search(rb'name="csrf_token"[^>]*value="([^"]+)"', page)
+    form = {'username': manifest['admin']['username'], 'password': manifest['admin']['password']}
+    if match:
+        form['csrf_token'] = match.group(1).decode()
+    status, _ = client.request('POST', '/login', urlencode(form).encode(),
+                               {'Content-Type': 'application/x-www-form-urlencoded'})
+    if status != 302:
+        raise SystemExit(f'Logging in as {manifest["admin"]["username"]} failed ({status})')
+
+
+def run_client(make_client, scenario, manifest, rng, stop, results):
+    needs_login, build = SCENARIOS[scenario]
+    client = make_client()
+    if needs_login:
+        log_in(client, manifest)
+    timings, errors, sent = [], 0, 0
+    while not stop.is_set():
+        method, path, body, headers = build(rng, manifest)
+        start = time.perf_counter()
+        try:
+            status, data = client.request(method, path, body, headers)
+        except (http.client.HTTPException, OSError):
+            errors += 1
+            client = make_client()
+            if needs_login:
+                log_in(client, manifest)
+            continue
+        elapsed = time.perf_counter() - start
+        if status >= 400:
+            errors += 1
+        else:
+            timings.append(elapsed)
+            sent += len(data)
+    client.close()
+    results.append((timings, errors, sent))
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else float('nan')
+
+
+def run_scenario(make_client, scenario, manifest, args):
+    results = []
+    for warmup in (True, False):
+        stop = threading.Event()
+        threads = [threading.Thread(target=run_client,
+                                    args=(make_client, scenario, manifest, random.Random(args.seed * 100 + i),
+                                          stop, [] if warmup else results))
+                   for i in range(args.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.warmup if warmup else args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+    timings = sorted(t for r in results for t in r[0])
+    return {
+        'requests': len(timings),
+        'errors': sum(r[1] for r in results),
+        'rps': len(timings) / duration,
+        'mb_per_s': sum(r[2] for r in results) / duration / 1e6,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+    }
+
+
+def in_process_app(manifest):
+    configure_app(manifest['database_url'], manifest['uploads'])
+    logging.disable(logging.INFO)
+    from app import init_database
+    from main import app
+    init_database(app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--manifest', required=True, help='Written by benchmarks/generate_archive.py.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--in-process', action='store_true', help='Call the WSGI app directly instead of over HTTP.')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='Run only this scenario (repeatable); all by default.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Write the results here, to pass as --baseline later.')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against.')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    scenarios = args.scenario or [s for s in SCENARIOS if s != 'search' or manifest.get('search', True)]
+    if args.in_process:
+        app = in_process_app(manifest)
+        make_client = lambda: WSGIClient(app)  # noqa: E731
+    else:
+        make_client = lambda: HTTPClient(args.url)  # noqa: E731
+        try:
+            make_client().request('GET', '/')
+        except OSError as e:
+            raise SystemExit(f'Cannot reach {args.url}: {e}')
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+
+    target = 'in-process' if args.in_process else args.url
+    print(f'{target}, {args.concurrency} clients, {args.seconds:.0f}s per scenario')
+    print(f"{'scenario':<20}{'requests':>10}{'errors':>8}{'req/s':>10}{'MB/s':>8}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    results = {}
+    for scenario in scenarios:
+        result = results[scenario] = run_scenario(make_client, scenario, manifest, args)
+        print(f"{scenario:<20}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+              f"{result['mb_per_s']:>8.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+        before = baseline.get(scenario)
+        if before and result['requests']:
+            changes = defaultdict(str)
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if before[key]:
+                    changes[key] = f'{(result[key] - before[key]) / before[key]:+.0%}'
+            print(f"{'  vs baseline':<20}{'':>10}{'':>8}{changes['rps']:>10}{'':>8}"
+                  f"{changes['p50_ms']:>10}{changes['p95_ms']:>10}{changes['p99_ms']:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'target': target, 'concurrency': args.concurrency, 'seconds': args.seconds,
+                       'scenarios': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
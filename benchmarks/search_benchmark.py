@@ -0,0 +1,112 @@
+"""Compare search latency of the FTS index against the old ILIKE scan.
+
+Seeds a throwaway SQLite database with synthetic notes and question papers and
+times the same queries through both paths:
+
+    python benchmarks/search_benchmark.py --documents 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from app import db  # noqa: E402
+from models import Course, Subject, Note, QuestionPaper  # noqa: E402
+import search  # noqa: E402
+
+WORDS = ('algorithm data structure graph tree heap network protocol thermodynamics '
+         'circuit signal transform fourier laplace matrix vector calculus integral '
+         'differential equation compiler parser grammar automata database index query '
+         'transaction kernel process thread memory cache pipeline processor semiconductor '
+         'diode transistor amplifier control system feedback stability mechanics fluid').split()
+QUERIES = ('fourier', 'graph algorithm', 'trans', 'database index query', 'semicon', 'zzznomatch')
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def seed(documents, rng):
+    now = datetime.utcnow()
+    courses = [{'id': i, 'name': f'Course {i} {sentence(rng, 2)}', 'created_at': now} for i in range(1, 11)]
+    subjects = [{'id': i, 'name': sentence(rng, 3), 'course_id': rng.randint(1, 10),
+                 'semester': rng.randint(1, 8), 'created_at': now} for i in range(1, 201)]
+    db.session.execute(db.insert(Course), courses)
+    db.session.execute(db.insert(Subject), subjects)
+    half = documents // 2
+    notes = [{'title': sentence(rng, 5), 'description': sentence(rng, 30), 'filename': f'n{i}.pdf',
+              'original_filename': f'n{i}.pdf', 'file_size': 1024, 'subject_id': rng.randint(1, 200),
+              'uploaded_at': now, 'download_count': 0} for i in range(half)]
+    papers = [{'title': sentence(rng, 4), 'year': rng.randint(2005, 2024), 'semester': rng.randint(1, 8),
+               'exam_type': rng.choice(['midterm', 'endterm', 'quiz']), 'filename': f'p{i}.pdf',
+               'original_filename': f'p{i}.pdf', 'file_size': 1024, 'subject_id': rng.randint(1, 200),
+               'uploaded_at': now, 'download_count': 0} for i in range(documents - half)]
+    db.session.execute(db.insert(Note), notes)
+    db.session.execute(db.insert(QuestionPaper), papers)
+    db.session.commit()
+
+
+def ilike_search(query):
+    term = f'%{query}%'
+    notes = Note.query.join(Subject).join(Course).filter(db.or_(
+        Note.title.ilike(term), Note.description.ilike(term),
+        Subject.name.ilike(term), Course.name.ilike(term),
+    )).order_by(Note.uploaded_at.desc()).all()
+    papers = QuestionPaper.query.join(Subject).join(Course).filter(db.or_(
+        QuestionPaper.title.ilike(term), Subject.name.ilike(term), Course.name.ilike(term),
+    )).order_by(QuestionPaper.uploaded_at.desc()).all()
+    return len(notes) + len(papers)
+
+
+def fts_search(query):
+    return len(search.search_notes(query)) + len(search.search_papers(query))
+
+
+def measure(fn, query, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        hits = fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return hits, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_app = Flask(__name__)
+        bench_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(bench_app)
+        with bench_app.app_context():
+            db.create_all()
+            search.init_search_index()
+            start = time.perf_counter()
+            seed(args.documents, random.Random(42))
+            print(f'Seeded {args.documents} documents in {time.perf_counter() - start:.1f}s')
+            start = time.perf_counter()
+            search.rebuild_search_index()
+            print(f'Built search index in {time.perf_counter() - start:.1f}s\n')
+
+            print(f"{'query':<22}{'ilike ms':>10}{'ilike hits':>12}{'fts ms':>10}{'fts hits':>10}")
+            for query in QUERIES:
+                ilike_hits, ilike_ms = measure(ilike_search, query, args.repeat)
+                fts_hits, fts_ms = measure(fts_search, query, args.repeat)
+                print(f'{query:<22}{ilike_ms:>10.1f}{ilike_hits:>12}{fts_ms:>10.1f}{fts_hits:>10}')
+            print('\nFTS results are ranked and capped at 50 per type; ILIKE returns every match unranked.')
+
+
+if __name__ == '__main__':
+    main()
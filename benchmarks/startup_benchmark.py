@@ -0,0 +1,77 @@
+"""Measure how long a fresh worker process takes from import to its first response.
+
+Each run starts a new Python process, as gunicorn does for every worker and
+every autoscale cold start, imports ``main`` and serves ``GET /`` through the
+WSGI app. The database is prepared once beforehand, like the deploy step does:
+
+    python benchmarks/startup_benchmark.py --runs 20
+    python benchmarks/startup_benchmark.py --database-url postgresql://localhost/edu_bench
+
+The statement count is the SQL a worker issues while importing the app, before
+it has served anything.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = '''
+import json, time
+start = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(1))
+import main
+imported = time.perf_counter()
+at_import = len(statements)
+response = main.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_response': done - start, 'statements': at_import}))
+'''
+
+PREPARE = '''
+from app import init_database
+from main import app
+init_database(app)
+'''
+
+
+def run(code, env):
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True)
+    return result.stdout.strip().splitlines()[-1] if result.stdout.strip() else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Database to start against; a throwaway SQLite file by default.')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env['FLASK_SQLALCHEMY_DATABASE_URI'] = args.database_url or f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        env['FLASK_JOB_WORKER'] = 'external'
+        env['FLASK_UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        env.setdefault('SESSION_SECRET', 'startup-benchmark')
+        run(PREPARE, env)
+
+        results = [json.loads(run(WORKER, env)) for _ in range(args.runs)]
+
+    print(f'{args.runs} worker starts')
+    print(f"{'':<16}{'median ms':>10}{'max ms':>10}")
+    for name in ('import', 'first_response'):
+        timings = [r[name] * 1000 for r in results]
+        print(f'{name:<16}{statistics.median(timings):>10.1f}{max(timings):>10.1f}')
+    print(f"statements during import: {max(r['statements'] for r in results)}")
+
+
+if __name__ == '__main__':
+    main()
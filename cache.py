@@ -0,0 +1,307 @@
+"""Cache for the rendered public pages and template fragments.
+
+Entries are keyed on the content version, a counter that is bumped in the same
+transaction as any change to courses, subjects, notes, papers or tags. A request
+that starts after such a commit reads the new version and so never sees a page
+rendered from older data; superseded entries simply age out of the cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from itertools import chain
+
+from flask import current_app, g, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from assets import assets
+from models import ContentVersion, Course, Subject, Note, QuestionPaper, Tag, note_tags, paper_tags
+from pagination import wants_json
+
+logger = logging.getLogger(__name__)
+
+CONTENT_MODELS = (Course, Subject, Note, QuestionPaper, Tag)
+CONTENT_TABLES = {model.__table__ for model in CONTENT_MODELS} | {note_tags, paper_tags}
+
+
+class MemoryCache:
+    """Least-recently-used cache local to one process."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """Cache shared by every worker process on the host, kept in its own SQLite file
+    so that cache writes never contend with the application database."""
+
+    PURGE_EVERY = 200
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS page_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _connection(self):
+        # sqlite3 connections must not cross threads or survive a fork.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT value, expires FROM page_cache WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning('Page cache read failed: %s', e)
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('INSERT OR REPLACE INTO page_cache (key, value, expires) VALUES (?, ?, ?)',
+                               (key, json.dumps(value), now + ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                connection.execute('DELETE FROM page_cache WHERE expires < ?', (now,))
+        except sqlite3.Error as e:
+            logger.warning('Page cache write failed: %s', e)
+
+    def clear(self):
+        self._connection().execute('DELETE FROM page_cache')
+
+
+class TieredCache:
+    """A process-local cache in front of a shared one."""
+
+    def __init__(self, local, shared, local_ttl=60):
+        self.local = local
+        self.shared = shared
+        # Entries copied down from the shared cache may be most of their TTL old already.
+        self.local_ttl = local_ttl
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.local_ttl)
+        return value
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, ttl)
+        self.shared.set(key, value, ttl)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+
+def content_version():
+    """The content version as of this request, read at most once per request."""
+    if 'content_version' not in g:
+        g.content_version = db.session.execute(
+            select(ContentVersion.version).where(ContentVersion.id == 1)).scalar() or 0
+    return g.content_version
+
+
+def bump_content_version(session):
+    if session.info.get('content_version_bumped'):
+        return
+    session.info['content_version_bumped'] = True
+    connection = session.connection()
+    bumped = connection.execute(update(ContentVersion).where(ContentVersion.id == 1)
+                                .values(version=ContentVersion.version + 1)).rowcount
+    if not bumped:
+        connection.execute(insert(ContentVersion).values(id=1, version=1))
+
+
+@event.listens_for(Session, 'before_flush')
+def _content_flushed(session, flush_context, instances):
+    if any(isinstance(obj, CONTENT_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        bump_content_version(session)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _content_bulk_statement(state):
+    # Bulk INSERT/UPDATE/DELETE statements (bulk ingest, for one) bypass the flush.
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    table = getattr(state.statement, 'table', None)
+    if table in CONTENT_TABLES:
+        bump_content_version(state.session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _content_transaction_ended(session):
+    session.info.pop('content_version_bumped', None)
+
+
+_deploy_digest = None
+
+
+def deploy_digest():
+    """Hash of the templates and the asset build, so a deploy that changes the
+    markup also changes every ETag."""
+    global _deploy_digest
+    if _deploy_digest is None:
+        digest = hashlib.sha256()
+        root = os.path.join(current_app.root_path, current_app.template_folder)
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode())
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        digest.update(json.dumps(assets.manifest(), sort_keys=True).encode())
+        _deploy_digest = digest.hexdigest()
+    return _deploy_digest
+
+
+def view_etag():
+    # Download counts and extracted text do not bump the content version, so the
+    # tag also rolls over every ETAG_WINDOW seconds to let those show up.
+    window = int(time.time() // current_app.config['ETAG_WINDOW'])
+    parts = [content_version(), window, deploy_digest(), current_user.get_id(), request.path,
+             sorted(request.args.items(multi=True)), wants_json()]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:32]
+
+
+def conditional(view):
+    """Give a listing view a weak ETag and answer a matching If-None-Match with 304,
+    before the view runs any of its queries."""
+    @wraps(view)
+    def wrapper(**kwargs):
+        if request.method != 'GET' or not current_app.config.get('ETAG_WINDOW') or '_flashes' in session:
+            return view(**kwargs)
+        etag = view_etag()
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(**kwargs))
+            if response.status_code != 200 or '_flashes' in session:
+                return response
+        response.set_etag(etag, weak=True)
+        response.cache_control.no_cache = True
+        if current_user.is_authenticated:
+            response.cache_control.private = True
+        response.vary.add('Accept')
+        return response
+    return wrapper
+
+
+class PageCache:
+    def __init__(self):
+        self.app = None
+        self.backend = None
+        self.ttl = 300
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get('PAGE_CACHE_TTL', 300)
+        kind = app.config.get('PAGE_CACHE')
+        local = MemoryCache(app.config.get('PAGE_CACHE_SIZE', 512))
+        if kind == 'memory':
+            self.backend = local
+        elif kind == 'sqlite':
+            path = app.config.get('PAGE_CACHE_PATH') or os.path.join(app.instance_path, 'page_cache.db')
+            self.backend = TieredCache(local, SQLiteCache(path))
+        elif kind:
+            raise ValueError(f'Unknown PAGE_CACHE backend {kind!r}')
+        app.jinja_env.globals['cached_fragment'] = self.fragment
+
+    def enabled(self):
+        # Admins see their own flash messages and controls, so only anonymous
+        # visitors with nothing pending in their session share cached pages.
+        return (self.backend is not None and request.method == 'GET'
+                and not current_user.is_authenticated and '_flashes' not in session)
+
+    def key(self, *parts):
+        return ':'.join(str(p) for p in (content_version(),) + parts)
+
+    def cached(self, view):
+        """Cache a public view's 200 responses, keyed on the path and query string."""
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not self.enabled():
+                return view(**kwargs)
+            args = sorted(request.args.items(multi=True))
+            key = self.key('page', request.path, json.dumps(args), int(wants_json()))
+            entry = self.backend.get(key)
+            if entry is not None:
+                response = self.app.response_class(entry['body'], content_type=entry['content_type'])
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = self.app.make_response(view(**kwargs))
+            if response.status_code == 200 and not session.modified:
+                self.backend.set(key, {'body': response.get_data(as_text=True),
+                                       'content_type': response.content_type}, self.ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+
+    def fragment(self, name, *args, caller):
+        """Template helper: ``{% call cached_fragment('courses', ...) %}...{% endcall %}``."""
+        if self.backend is None:
+            return caller()
+        key = self.key('fragment', name, *args)
+        html = self.backend.get(key)
+        if html is None:
+            html = str(caller())
+            self.backend.set(key, html, self.ttl)
+        return Markup(html)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+page_cache = PageCache()
@@ -0,0 +1,158 @@
+import os
+
+import click
+from flask import Blueprint, current_app
+
+import assets
+import extraction
+import facets
+import jobs
+import search
+from app import db, init_database
+from storage import ENCODINGS, compression_report, migrate_legacy_uploads, storage
+from transfer import TransferError, copy_database, copy_uploads
+from models import Note, QuestionPaper, ExtractedText
+from previews import previews
+
+# cli_group=None puts the commands straight under `flask` rather than `flask commands`.
+bp = Blueprint('commands', __name__, cli_group=None)
+
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the schema and fill derived tables; run once per deploy."""
+    init_database(current_app._get_current_object())
+    click.echo('Database is up to date.')
+
+
+@bp.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove files left from earlier builds first.')
+def build_assets_command(clean):
+    """Fingerprint and precompress everything under static/ into static/dist/."""
+    manifest = assets.build_assets(current_app.static_folder, clean=clean)
+    click.echo(f'Built {len(manifest)} assets.')
+
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from the notes and question papers tables."""
+    count = search.rebuild_search_index()
+    click.echo(f'Indexed {count} documents.')
+
+
+@bp.cli.command('rebuild-facets')
+def rebuild_facets_command():
+    """Recount the question paper filter values from the papers table."""
+    count = facets.rebuild_facets()
+    click.echo(f'Counted {count} filter values.')
+
+
+@bp.cli.command('extract-text')
+@click.option('--force', is_flag=True, help='Re-extract files that already have stored text.')
+def extract_text_command(force):
+    """Extract and index the text of uploaded files that have not been processed yet."""
+    done = set() if force else {f for (f,) in db.session.query(ExtractedText.filename)}
+    count = 0
+    for kind, model in (('note', Note), ('paper', QuestionPaper)):
+        for ref_id, filename in db.session.query(model.id, model.filename).order_by(model.id).all():
+            if filename in done:
+                continue
+            record = extraction.extract_and_index(kind, ref_id, force=force)
+            done.add(filename)
+            count += 1
+            status = record.error or f'{record.char_count} characters'
+            click.echo(f'{kind} {ref_id} ({filename}): {status}')
+    click.echo(f'Processed {count} files.')
+
+
+@bp.cli.command('generate-previews')
+@click.option('--force', is_flag=True, help='Remake previews that already exist, including failed ones.')
+def generate_previews_command(force):
+    """Make missing first-page thumbnails and text previews for every uploaded file."""
+    filenames = set()
+    for model in (Note, QuestionPaper):
+        filenames.update(f for (f,) in db.session.query(model.filename).distinct())
+    written = 0
+    for filename in sorted(filenames):
+        written += previews.generate(filename, force=force)
+    click.echo(f'Wrote {written} previews for {len(filenames)} files; evicted {previews.evict()}.')
+
+
+@bp.cli.command('dedupe-uploads')
+@click.option('--dry-run', is_flag=True, help='Report what would change without touching any files.')
+@click.option('--delete-orphans', is_flag=True, help='Also delete files no note or paper refers to.')
+def dedupe_uploads_command(dry_run, delete_orphans):
+    """Move legacy uploads into content-addressed storage, merging identical files."""
+    report = migrate_legacy_uploads(dry_run=dry_run, delete_orphans=delete_orphans)
+    for filename in report['missing']:
+        click.echo(f'missing: {filename}')
+    for filename in report['orphans']:
+        click.echo(f'orphan: {filename}')
+    prefix = 'Would reclaim' if dry_run else 'Reclaimed'
+    click.echo(f"Scanned {report['files']} files, {report['duplicates']} duplicates. "
+               f"{prefix} {report['bytes_reclaimed']} bytes.")
+
+
+@bp.cli.command('compress-uploads')
+@click.option('--encoding', type=click.Choice(list(ENCODINGS)),
+              help='Compression to use (default: STORAGE_COMPRESSION).')
+@click.option('--dry-run', is_flag=True, help='Report the savings without replacing any files.')
+def compress_uploads_command(encoding, dry_run):
+    """Compress stored uploads that are worth it and report the disk space saved."""
+    encoding = encoding or storage.compression
+    if encoding is None:
+        raise click.UsageError('Pass --encoding or set FLASK_STORAGE_COMPRESSION.')
+    report = compression_report(encoding, dry_run=dry_run)
+    click.echo(f"{'extension':<10}{'files':>8}{'compressed':>12}{'size':>14}{'on disk':>14}{'saved':>8}")
+    totals = {'files': 0, 'compressed': 0, 'size': 0, 'stored': 0}
+    for extension, entry in sorted(report.items()) + [('total', totals)]:
+        if extension != 'total':
+            for key in totals:
+                totals[key] += entry[key]
+        saved = 1 - entry['stored'] / entry['size'] if entry['size'] else 0
+        click.echo(f"{extension:<10}{entry['files']:>8}{entry['compressed']:>12}{entry['size']:>14}"
+                   f"{entry['stored']:>14}{saved:>8.1%}")
+
+
+@bp.cli.command('run-worker')
+@click.option('--once', is_flag=True, help='Run the jobs that are due and exit.')
+@click.option('--poll-interval', default=1.0, show_default=True, help='Seconds to wait when the queue is empty.')
+def run_worker_command(once, poll_interval):
+    """Run queued background jobs (uploads, deletions, text extraction)."""
+    if once:
+        click.echo(f'Ran {jobs.work_off()} jobs.')
+    else:
+        jobs.run_worker(current_app._get_current_object(), poll_interval=poll_interval)
+
+
+@bp.cli.command('import-sqlite')
+@click.argument('source', default='instance/edu_archive.db', type=click.Path(exists=True, dir_okay=False))
+@click.option('--uploads-from', type=click.Path(exists=True, file_okay=False),
+              help='Upload folder of the old deployment; files missing from storage are copied from it.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per COPY/INSERT batch.')
+@click.option('--resume', is_flag=True, help='Continue an interrupted import instead of requiring an empty database.')
+@click.option('--skip-files', is_flag=True, help='Copy the rows only; do not copy or verify upload files.')
+def import_sqlite_command(source, uploads_from, batch_size, resume, skip_files):
+    """Copy a SQLite archive into the configured database (e.g. Postgres via DATABASE_URL)."""
+    def report(table, done, total):
+        click.echo(f'{table}: {done}/{total}')
+
+    init_database(current_app._get_current_object())
+    try:
+        counts = copy_database(f'sqlite:///{os.path.abspath(source)}', batch_size=batch_size, resume=resume,
+                               progress=report)
+    except TransferError as e:
+        raise click.ClickException(str(e))
+    mismatched = {t: c for t, c in counts.items() if c[0] != c[1]}
+    for table, (expected, actual) in mismatched.items():
+        click.echo(f'row count mismatch in {table}: {expected} in source, {actual} in target')
+    click.echo(f'Copied {sum(c[1] for c in counts.values())} rows from {len(counts)} tables.')
+
+    problems = []
+    if not skip_files:
+        copied, verified, problems = copy_uploads(uploads_from)
+        for problem in problems:
+            click.echo(problem)
+        click.echo(f'Copied {copied} files; {verified} match their checksums.')
+    if mismatched or problems:
+        raise click.ClickException('Import finished with problems; fix them and rerun with --resume.')
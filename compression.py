@@ -0,0 +1,83 @@
+"""Gzip/Brotli compression of dynamic responses.
+
+Off unless ``COMPRESS_RESPONSES`` is set, since a proxy in front of the app may
+already compress. File responses (downloads, ``/assets/``) are left alone: they
+are either precompressed or already compressed formats like PDF, and sending
+them through this path would load them into memory. Streamed responses are
+compressed chunk by chunk and flushed after each chunk, so the client still
+receives them progressively.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class ResponseCompression:
+    def __init__(self):
+        self.app = None
+        self.mimetypes = set()
+
+    def init_app(self, app):
+        self.app = app
+        self.mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ()))
+        app.after_request(self.compress_response)
+
+    def encoding(self):
+        if brotli is not None and request.accept_encodings['br']:
+            return 'br'
+        if request.accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.app.config.get('COMPRESS_BROTLI_QUALITY', 4))
+            return compressor.process, compressor.flush, compressor.finish
+        # wbits=31 writes a gzip header and trailer around the deflate stream.
+        compressor = zlib.compressobj(self.app.config.get('COMPRESS_LEVEL', 6), zlib.DEFLATED, 31)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def compress(self, data, encoding):
+        process, _, finish = self._compressor(encoding)
+        return process(data) + finish()
+
+    def _stream(self, chunks, encoding):
+        process, flush, finish = self._compressor(encoding)
+        for chunk in chunks:
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+
+    def compress_response(self, response):
+        config = self.app.config
+        if (not config.get('COMPRESS_RESPONSES') or response.status_code < 200
+                or response.status_code in (204, 206, 304) or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.mimetype not in self.mimetypes):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.encoding()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self._stream(response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+                return response
+            response.set_data(self.compress(data, encoding))
+        response.content_encoding = encoding
+        # A strong ETag promises byte-identical bodies, which no longer holds.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = ResponseCompression()
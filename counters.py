@@ -0,0 +1,113 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert
+
+import analytics
+from app import db
+from models import DownloadEvent, Note, QuestionPaper
+
+logger = logging.getLogger(__name__)
+
+TABLES = {
+    'note': Note.__table__,
+    'paper': QuestionPaper.__table__,
+}
+
+
+class DownloadCounter:
+    """In-memory download counts, flushed as one batched UPDATE per table every
+    ``DOWNLOAD_FLUSH_INTERVAL`` seconds and once more when the process exits.
+
+    Each flush also logs the counts as download events, which the same thread
+    rolls up for the analytics page every ``ANALYTICS_ROLLUP_INTERVAL`` seconds.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 5.0
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.rollup_interval = 60
+        self._last_rollup = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('DOWNLOAD_FLUSH_INTERVAL', self.interval)
+        self.rollup_interval = app.config.get('ANALYTICS_ROLLUP_INTERVAL', self.rollup_interval)
+        atexit.register(self.flush)
+
+    def increment(self, kind, ref_id, amount=1):
+        with self._lock:
+            self._pending[(kind, ref_id)] += amount
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Started by the first download rather than in init_app: the app is loaded
+        # in gunicorn's master before it forks, and a flusher started there would
+        # be missing from every worker while their counts piled up unflushed.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='download-counter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush download counts')
+            if time.monotonic() - self._last_rollup >= self.rollup_interval:
+                self._last_rollup = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        analytics.roll_up()
+                except Exception:
+                    logger.exception('Failed to roll up download events')
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, Counter()
+            if not batch:
+                return 0
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as connection:
+                        for kind, table in TABLES.items():
+                            rows = [{'ref_id': ref_id, 'amount': amount}
+                                    for (k, ref_id), amount in batch.items() if k == kind]
+                            if rows:
+                                connection.execute(
+                                    table.update()
+                                    .where(table.c.id == bindparam('ref_id'))
+                                    .values(download_count=func.coalesce(table.c.download_count, 0)
+                                            + bindparam('amount')),
+                                    rows,
+                                )
+                        now = datetime.utcnow()
+                        connection.execute(insert(DownloadEvent), [
+                            {'kind': kind, 'ref_id': ref_id, 'occurred_at': now, 'count': amount}
+                            for (kind, ref_id), amount in batch.items()])
+            except Exception:
+                # Put the counts back so the next flush retries them.
+                with self._lock:
+                    self._pending.update(batch)
+                raise
+            return sum(batch.values())
+
+
+download_counter = DownloadCounter()
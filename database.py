@@ -0,0 +1,78 @@
+import os
+import sqlite3
+
+from sqlalchemy import and_, event, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = "sqlite:///edu_archive.db"
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE.
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def database_url():
+    url = os.environ.get("DATABASE_URL") or DEFAULT_DATABASE_URL
+    # Some hosts still hand out postgres:// URLs, which SQLAlchemy no longer accepts.
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(config):
+    """Engine options for the configured database; pool settings only apply to servers."""
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() == "sqlite":
+        return options
+    # Each gunicorn worker gets its own pool, so the server sees up to
+    # workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+    options.setdefault("pool_size", config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+    options.setdefault("pool_recycle", config["DB_POOL_RECYCLE"])
+    options.setdefault("pool_pre_ping", True)
+    return options
+
+
+def upsert(connection, table, rows, keys, add):
+    """Insert ``rows`` into ``table``, or add their ``add`` column onto the rows
+    already there with the same ``keys``.
+
+    One INSERT ... ON CONFLICT statement where the dialect has it; elsewhere an
+    UPDATE per row, followed by an INSERT when it matched nothing.
+    """
+    table = getattr(table, "__table__", table)
+    make_insert = _UPSERTS.get(connection.dialect.name)
+    if make_insert is not None:
+        stmt = make_insert(table).values(rows)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=keys, set_={add: table.c[add] + stmt.excluded[add]}))
+        return
+    for row in rows:
+        match = and_(*(table.c[key] == row[key] for key in keys))
+        if not connection.execute(update(table).where(match).values({add: table.c[add] + row[add]})).rowcount:
+            connection.execute(insert(table).values(row))
+
+
+def init_app(app):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+
+def init_engine(app, engine):
+    """Apply SQLITE_PRAGMAS to every new connection of the app's own engine.
+
+    Registered on that engine only, so other SQLite databases opened in the same
+    process (the source of `flask import-sqlite`) are left as they are.
+    """
+    pragmas = app.config.get("SQLITE_PRAGMAS") or {}
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
@@ -0,0 +1,139 @@
+import re
+import zipfile
+from xml.etree import ElementTree
+
+import jobs
+import search
+from app import db
+from models import Note, QuestionPaper, ExtractedText
+from storage import storage
+
+# Enough for the questions in a full paper or a long set of notes; anything past
+# this adds index size without helping anyone find the document.
+MAX_CHARS = 100000
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def _normalize(text):
+    return re.sub(r'[ \t\r\f\v]+', ' ', re.sub(r'\n\s*\n+', '\n', text)).strip()[:MAX_CHARS]
+
+
+def _extract_txt(path):
+    with open(path, 'rb') as f:
+        data = f.read(MAX_CHARS * 4)
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the read limit is not a reason to give up on UTF-8.
+        if e.start >= len(data) - 3:
+            return data[:e.start].decode('utf-8')
+        return data.decode('latin-1')
+
+
+def _xml_text(archive, member, tag, block_tag):
+    root = ElementTree.fromstring(archive.read(member))
+    blocks = []
+    for block in root.iter(block_tag):
+        blocks.append(''.join(node.text or '' for node in block.iter(tag)))
+    return '\n'.join(b for b in blocks if b)
+
+
+def _extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        return _xml_text(archive, 'word/document.xml', WORD_NS + 't', WORD_NS + 'p')
+
+
+def _slide_number(name):
+    match = re.search(r'(\d+)\.xml$', name)
+    return int(match.group(1)) if match else 0
+
+
+def _extract_pptx(path):
+    with zipfile.ZipFile(path) as archive:
+        slides = sorted((n for n in archive.namelist()
+                         if n.startswith('ppt/slides/slide') and n.endswith('.xml')), key=_slide_number)
+        return '\n'.join(_xml_text(archive, s, DRAWING_NS + 't', DRAWING_NS + 'p') for s in slides)
+
+
+def _extract_pdf(path):
+    # Imported here rather than at the top: it is slow to load and only the job
+    # worker needs it, not every web process on startup.
+    try:
+        import pypdf
+    except ImportError:
+        raise ExtractionError('pypdf is not installed')
+    reader = pypdf.PdfReader(path)
+    parts, total = [], 0
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        total += len(text)
+        if total >= MAX_CHARS:
+            break
+    return '\n'.join(parts)
+
+
+EXTRACTORS = {
+    'txt': _extract_txt,
+    'docx': _extract_docx,
+    'pptx': _extract_pptx,
+    'pdf': _extract_pdf,
+}
+
+
+def extract_text(path):
+    extension = path.rsplit('.', 1)[-1].lower()
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        raise ExtractionError(f'No text extractor for .{extension} files')
+    try:
+        return _normalize(extractor(path))
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f'{type(e).__name__}: {e}') from e
+
+
+def store_text(filename):
+    record = ExtractedText.query.filter_by(filename=filename).first() or ExtractedText(filename=filename)
+    try:
+        # Compressed uploads are extracted from a decompressed temporary copy.
+        with storage.local_copy(filename) as path:
+            record.text = extract_text(path)
+        record.error = None
+    except FileNotFoundError:
+        record.text = ''
+        record.error = 'File is missing from storage'
+    except ExtractionError as e:
+        record.text = ''
+        record.error = str(e)[:255]
+    db.session.add(record)
+    return record
+
+
+def extract_and_index(kind, ref_id, force=False):
+    model = Note if kind == 'note' else QuestionPaper
+    row = model.query.get(ref_id)
+    if row is None:
+        return None
+    # Identical uploads share a blob, so their text only needs extracting once.
+    record = None if force else ExtractedText.query.filter_by(filename=row.filename).first()
+    if record is None:
+        record = store_text(row.filename)
+    if kind == 'note':
+        search.index_note(row)
+    else:
+        search.index_paper(row)
+    db.session.commit()
+    return record
+
+
+def schedule_extraction(kind, *ref_ids):
+    # Added to the caller's transaction, so the job exists exactly when the rows do.
+    return jobs.enqueue('extract_text', kind=kind, ref_ids=list(ref_ids))
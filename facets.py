@@ -0,0 +1,181 @@
+"""Filter counts for the question paper listing.
+
+``paper_facet`` keeps the number of papers for every year, semester, exam type,
+subject and tag. Session hooks adjust those counts in the same transaction as the
+papers themselves, so reading the filters costs one query over a table that grows
+with the number of distinct values, not with the number of papers.
+"""
+from collections import Counter, namedtuple
+
+from sqlalchemy import Integer, and_, cast, delete, event, false, func, insert, select
+from sqlalchemy.orm import Session, attributes
+
+from app import db
+from database import upsert
+from forms import EXAM_TYPES
+from models import PaperFacet, QuestionPaper, Subject, Course, Tag, paper_tags
+
+# Facet name -> QuestionPaper column; tags come from the association table.
+COLUMNS = {
+    'year': 'year',
+    'semester': 'semester',
+    'exam_type': 'exam_type',
+    'subject': 'subject_id',
+}
+FACETS = tuple(COLUMNS) + ('tag',)
+
+# ``value`` is what goes in the query string, ``key`` what is stored in paper_facet.
+FacetOption = namedtuple('FacetOption', ['value', 'key', 'label', 'count'])
+
+EXAM_TYPE_LABELS = dict(EXAM_TYPES)
+
+SORT_KEYS = {
+    'year': lambda o: -int(o.key),
+    'semester': lambda o: int(o.key),
+    'exam_type': lambda o: o.label,
+    'subject': lambda o: o.label.lower(),
+    'tag': lambda o: o.label.lower(),
+}
+
+
+def _history_values(paper, attr, side):
+    history = attributes.get_history(paper, attr, passive=attributes.PASSIVE_OFF)
+    changed = history.added if side == 'new' else history.deleted
+    return list(history.unchanged or ()) + list(changed or ())
+
+
+def _paper_counts(paper, side):
+    counts = Counter()
+    for facet, attr in COLUMNS.items():
+        for value in _history_values(paper, attr, side):
+            if value is not None:
+                counts[(facet, str(value))] += 1
+    for tag in _history_values(paper, 'tags', side):
+        if tag.id is not None:
+            counts[('tag', str(tag.id))] += 1
+    return counts
+
+
+def _apply(connection, deltas):
+    rows = [{'facet': facet, 'value': value, 'count': n} for (facet, value), n in deltas.items() if n]
+    if not rows:
+        return
+    upsert(connection, PaperFacet, rows, ['facet', 'value'], 'count')
+
+
+# Edits load the previous value on assignment, so history always has both sides.
+for _attr in COLUMNS.values():
+    event.listen(getattr(QuestionPaper, _attr), 'set', lambda *args: None, active_history=True)
+
+
+@event.listens_for(Session, 'before_flush')
+def _papers_flushed(session, flush_context, instances):
+    deltas = Counter()
+    removed = []
+    for obj in session.new:
+        if isinstance(obj, QuestionPaper):
+            deltas.update(_paper_counts(obj, 'new'))
+    for obj in session.dirty:
+        if isinstance(obj, QuestionPaper) and session.is_modified(obj):
+            deltas.update(_paper_counts(obj, 'new'))
+            deltas.subtract(_paper_counts(obj, 'old'))
+    for obj in session.deleted:
+        if isinstance(obj, QuestionPaper):
+            deltas.subtract(_paper_counts(obj, 'old'))
+        elif isinstance(obj, Tag):
+            removed.append(('tag', str(obj.id)))
+        elif isinstance(obj, Subject):
+            removed.append(('subject', str(obj.id)))
+    if deltas or removed:
+        connection = session.connection()
+        _apply(connection, deltas)
+        for facet, value in removed:
+            connection.execute(delete(PaperFacet).where(PaperFacet.facet == facet, PaperFacet.value == value))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _papers_bulk_inserted(state):
+    # Bulk ingest inserts rows without a flush. Papers created that way have no tags yet.
+    if not state.is_insert or state.bind_mapper is None or state.bind_mapper.class_ is not QuestionPaper:
+        return
+    params = state.parameters
+    rows = params if isinstance(params, list) else [params or {}]
+    deltas = Counter()
+    for row in rows:
+        for facet, column in COLUMNS.items():
+            if row.get(column) is not None:
+                deltas[(facet, str(row[column]))] += 1
+    _apply(state.session.connection(), deltas)
+
+
+def rebuild_facets():
+    db.session.execute(delete(PaperFacet))
+    queries = [select(getattr(QuestionPaper, column), func.count()).where(getattr(QuestionPaper, column).isnot(None))
+               .group_by(getattr(QuestionPaper, column)) for column in COLUMNS.values()]
+    queries.append(select(paper_tags.c.tag_id, func.count())
+                   .join(QuestionPaper, QuestionPaper.id == paper_tags.c.paper_id)
+                   .join(Tag, Tag.id == paper_tags.c.tag_id).group_by(paper_tags.c.tag_id))
+    rows = []
+    for facet, query in zip(FACETS, queries):
+        rows += [{'facet': facet, 'value': str(value), 'count': n} for value, n in db.session.execute(query)]
+    if rows:
+        db.session.execute(insert(PaperFacet), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def init_facets():
+    """Fill the facet table for archives created before it existed."""
+    if PaperFacet.query.first() is None and QuestionPaper.query.first() is not None:
+        rebuild_facets()
+
+
+def paper_facets():
+    """Every facet value that has at least one paper, as ``{facet: [FacetOption]}``."""
+    rows = db.session.execute(
+        select(PaperFacet.facet, PaperFacet.value, PaperFacet.count, Tag.name, Subject.name, Course.name)
+        .outerjoin(Tag, and_(PaperFacet.facet == 'tag', Tag.id == cast(PaperFacet.value, Integer)))
+        .outerjoin(Subject, and_(PaperFacet.facet == 'subject', Subject.id == cast(PaperFacet.value, Integer)))
+        .outerjoin(Course, Course.id == Subject.course_id)
+        .where(PaperFacet.count > 0)
+    )
+    facets = {facet: [] for facet in FACETS}
+    for facet, key, count, tag_name, subject_name, course_name in rows:
+        if facet == 'tag':
+            if tag_name is None:
+                continue
+            option = FacetOption(tag_name, key, tag_name, count)
+        elif facet == 'subject':
+            if subject_name is None:
+                continue
+            option = FacetOption(key, key, f'{course_name} - {subject_name}', count)
+        elif facet == 'semester':
+            option = FacetOption(key, key, f'Semester {key}', count)
+        elif facet == 'exam_type':
+            option = FacetOption(key, key, EXAM_TYPE_LABELS.get(key, key.capitalize()), count)
+        else:
+            option = FacetOption(key, key, key, count)
+        facets[facet].append(option)
+    for facet, options in facets.items():
+        options.sort(key=SORT_KEYS[facet])
+    return facets
+
+
+def filter_papers(query, facets, selected):
+    """Narrow a QuestionPaper query to the ``selected`` query-string values.
+
+    Values of one facet are alternatives; different facets must all match.
+    """
+    for facet, column in COLUMNS.items():
+        if not selected.get(facet):
+            continue
+        keys = [o.key if facet == 'exam_type' else int(o.key) for o in facets[facet] if o.value in selected[facet]]
+        query = query.filter(getattr(QuestionPaper, column).in_(keys) if keys else false())
+    if selected.get('tag'):
+        tag_ids = [int(o.key) for o in facets['tag'] if o.value in selected['tag']]
+        if not tag_ids:
+            return query.filter(false())
+        tagged = (select(paper_tags.c.paper_id).where(paper_tags.c.tag_id.in_(tag_ids))
+                  .group_by(paper_tags.c.paper_id).subquery())
+        query = query.join(tagged, tagged.c.paper_id == QuestionPaper.id)
+    return query
@@ -1,7 +1,18 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, PasswordField, TextAreaField, IntegerField, SelectField, SelectMultipleField
-from wtforms.validators import DataRequired, Length, NumberRange
+from flask_wtf.file import FileField, FileAllowed
+from wtforms import (StringField, PasswordField, TextAreaField, IntegerField, SelectField, SelectMultipleField,
+                     HiddenField)
+from wtforms.validators import DataRequired, Length, NumberRange, ValidationError
+
+NOTE_EXTENSIONS = ['pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt']
+PAPER_EXTENSIONS = ['pdf', 'doc', 'docx']
+EXAM_TYPES = [
+    ('midterm', 'Midterm'),
+    ('endterm', 'End Term'),
+    ('supplementary', 'Supplementary'),
+    ('quiz', 'Quiz'),
+    ('other', 'Other')
+]
 
 
 class LoginForm(FlaskForm):
@@ -20,61 +31,62 @@ class SubjectForm(FlaskForm):
     semester = IntegerField('Semester', validators=[DataRequired(), NumberRange(min=1, max=10)])
 
 
-class NoteForm(FlaskForm):
+class ResumableUploadMixin:
+    # Large files are sent ahead in chunks; the form then carries only the upload id.
+    upload_id = HiddenField()
+    file_required = True
+    file_extensions = NOTE_EXTENSIONS
+
+    def validate_file(self, field):
+        if self.file_required and not field.data and not self.upload_id.data:
+            raise ValidationError('This field is required.')
+
+
+class NoteForm(ResumableUploadMixin, FlaskForm):
     title = StringField('Title', validators=[DataRequired(), Length(max=200)])
     description = TextAreaField('Description')
     subject_id = SelectField('Subject', coerce=int, validators=[DataRequired()])
     tag_ids = SelectMultipleField('Tags', coerce=int)
     file = FileField('File', validators=[
-        FileRequired(),
-        FileAllowed(['pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt'], 'Only PDF, Word, PowerPoint and Text files allowed!')
+        FileAllowed(NOTE_EXTENSIONS, 'Only PDF, Word, PowerPoint and Text files allowed!')
     ])
 
 
-class NoteEditForm(FlaskForm):
+class NoteEditForm(ResumableUploadMixin, FlaskForm):
+    file_required = False
     title = StringField('Title', validators=[DataRequired(), Length(max=200)])
     description = TextAreaField('Description')
     subject_id = SelectField('Subject', coerce=int, validators=[DataRequired()])
     tag_ids = SelectMultipleField('Tags', coerce=int)
     file = FileField('Replace File (optional)', validators=[
-        FileAllowed(['pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt'], 'Only PDF, Word, PowerPoint and Text files allowed!')
+        FileAllowed(NOTE_EXTENSIONS, 'Only PDF, Word, PowerPoint and Text files allowed!')
     ])
 
 
-class QuestionPaperForm(FlaskForm):
+class QuestionPaperForm(ResumableUploadMixin, FlaskForm):
+    file_extensions = PAPER_EXTENSIONS
     title = StringField('Title', validators=[DataRequired(), Length(max=200)])
     year = IntegerField('Year', validators=[DataRequired(), NumberRange(min=2000, max=2100)])
     semester = IntegerField('Semester', validators=[DataRequired(), NumberRange(min=1, max=10)])
-    exam_type = SelectField('Exam Type', choices=[
-        ('midterm', 'Midterm'),
-        ('endterm', 'End Term'),
-        ('supplementary', 'Supplementary'),
-        ('quiz', 'Quiz'),
-        ('other', 'Other')
-    ])
+    exam_type = SelectField('Exam Type', choices=EXAM_TYPES)
     subject_id = SelectField('Subject', coerce=int, validators=[DataRequired()])
     tag_ids = SelectMultipleField('Tags', coerce=int)
     file = FileField('File', validators=[
-        FileRequired(),
-        FileAllowed(['pdf', 'doc', 'docx'], 'Only PDF and Word files allowed!')
+        FileAllowed(PAPER_EXTENSIONS, 'Only PDF and Word files allowed!')
     ])
 
 
-class QuestionPaperEditForm(FlaskForm):
+class QuestionPaperEditForm(ResumableUploadMixin, FlaskForm):
+    file_required = False
+    file_extensions = PAPER_EXTENSIONS
     title = StringField('Title', validators=[DataRequired(), Length(max=200)])
     year = IntegerField('Year', validators=[DataRequired(), NumberRange(min=2000, max=2100)])
     semester = IntegerField('Semester', validators=[DataRequired(), NumberRange(min=1, max=10)])
-    exam_type = SelectField('Exam Type', choices=[
-        ('midterm', 'Midterm'),
-        ('endterm', 'End Term'),
-        ('supplementary', 'Supplementary'),
-        ('quiz', 'Quiz'),
-        ('other', 'Other')
-    ])
+    exam_type = SelectField('Exam Type', choices=EXAM_TYPES)
     subject_id = SelectField('Subject', coerce=int, validators=[DataRequired()])
     tag_ids = SelectMultipleField('Tags', coerce=int)
     file = FileField('Replace File (optional)', validators=[
-        FileAllowed(['pdf', 'doc', 'docx'], 'Only PDF and Word files allowed!')
+        FileAllowed(PAPER_EXTENSIONS, 'Only PDF and Word files allowed!')
     ])
 
 
@@ -0,0 +1,42 @@
+import os
+
+# GUNICORN_ASYNC=1 swaps the sync workers, which each serve one request at a
+# time, for gevent workers serving up to GUNICORN_WORKER_CONNECTIONS each (see
+# async_worker.py). The master is patched here, before on_starting imports the
+# app, so the locks and thread-locals of every module are gevent's.
+if os.environ.get('GUNICORN_ASYNC', '').lower() in ('1', 'true', 'yes'):
+    from gevent import monkey
+    monkey.patch_all()
+    worker_class = 'async_worker.GeventSendfileWorker'
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def worker_exit(server, worker):
+    # Write out download counts still buffered in this worker before it goes away.
+    from counters import download_counter
+    if download_counter.app is not None:
+        download_counter.flush()
+
+
+def post_fork(server, worker):
+    # With preload_app the master may already hold pooled connections; a forked
+    # worker must open its own rather than share those sockets.
+    import sys
+    if 'main' in sys.modules:
+        from main import app
+        from app import db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def on_starting(server):
+    # Migrations and backfills run once here in the master, so workers (and every
+    # autoscale cold start's workers) go straight to serving requests.
+    from dotenv import load_dotenv
+    load_dotenv()
+    from main import app
+    from app import db, init_database
+    if app.config['DB_AUTO_UPGRADE']:
+        init_database(app)
+        with app.app_context():
+            db.engine.dispose()
@@ -0,0 +1,166 @@
+import logging
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+
+import extraction
+import search
+from app import db
+from forms import NOTE_EXTENSIONS
+from models import Subject, Note, QuestionPaper
+from storage import storage, upload_names
+
+logger = logging.getLogger(__name__)
+
+YEAR_RE = re.compile(r'(?<!\d)(19[89]\d|20\d\d)(?!\d)')
+SEMESTER_RES = (
+    re.compile(r'(?<![a-z])(?:semester|sem|s)[\s_.-]*(\d{1,2})(?!\d)', re.IGNORECASE),
+    re.compile(r'(?<!\d)(\d{1,2})(?:st|nd|rd|th)?[\s_.-]*sem', re.IGNORECASE),
+)
+EXAM_TYPE_RES = (
+    ('midterm', re.compile(r'(?<![a-z])mid[\s_-]*(?:term|sem(?:ester)?)(?![a-z])', re.IGNORECASE)),
+    ('endterm', re.compile(r'(?<![a-z])(?:end[\s_-]*(?:term|sem(?:ester)?)|finals?)(?![a-z])', re.IGNORECASE)),
+    ('supplementary', re.compile(r'(?<![a-z])(?:supp(?:lementary)?|backlog|re[\s_-]*exam)(?![a-z])', re.IGNORECASE)),
+    ('quiz', re.compile(r'(?<![a-z])(?:quiz(?:zes)?|class[\s_-]*tests?)(?![a-z])', re.IGNORECASE)),
+)
+
+# One line of the report shown after a bulk upload. ``status`` is "added",
+# "exists" (already in this subject, so retrying a dump is harmless) or "failed".
+FileResult = namedtuple('FileResult', ['name', 'status', 'ref_id', 'title', 'detail'])
+
+PaperInfo = namedtuple('PaperInfo', ['title', 'year', 'semester', 'exam_type'])
+
+
+def title_from_filename(name):
+    stem = name.rsplit('.', 1)[0]
+    return re.sub(r'[\s_]+', ' ', stem).strip() or stem
+
+
+def parse_paper_filename(name, default_semester=1, default_year=None):
+    """Guess year, semester and exam type from names like ``DSA_Midterm_2022_Sem3.pdf``."""
+    stem = name.rsplit('.', 1)[0]
+    year = YEAR_RE.search(stem)
+    without_year = YEAR_RE.sub(' ', stem)
+    semester = None
+    for pattern in SEMESTER_RES:
+        match = pattern.search(without_year)
+        if match and 1 <= int(match.group(1)) <= 10:
+            semester = int(match.group(1))
+            break
+    exam_type = next((value for value, pattern in EXAM_TYPE_RES if pattern.search(stem)), 'other')
+    return PaperInfo(
+        title=title_from_filename(name),
+        year=int(year.group(1)) if year else (default_year or datetime.utcnow().year),
+        semester=semester or default_semester,
+        exam_type=exam_type,
+    )
+
+
+def _write_file(file):
+    extension, name = upload_names(file.filename)
+    return name, storage.write(file.stream, extension)
+
+
+def _finish_upload(upload_id):
+    # Kept until the rows are committed, so a rolled back batch can be ingested again.
+    upload, stored = storage.finish_upload(upload_id, keep=True)
+    return upload.original_filename, stored
+
+
+def _allowed(name):
+    return '.' in name and name.rsplit('.', 1)[1].lower() in NOTE_EXTENSIONS
+
+
+def ingest(kind, subject_id, files=(), upload_ids=(), workers=None, progress=None, discard_uploads=True):
+    """Store ``files`` (uploaded FileStorage objects) and finished resumable uploads
+    as notes or papers of one subject, in a single transaction.
+
+    Files are written to storage in parallel, the rows go in with one bulk INSERT,
+    and if anything fails at the database stage the whole batch is rolled back, the
+    files it created are removed and the error is raised again; the resumable
+    uploads are left in place to try again with, and are removed once the batch
+    is committed unless ``discard_uploads`` is false.
+    Text extraction for the new rows is queued in the same transaction.
+    ``progress(done)`` is called as files are stored. Returns a FileResult per
+    input, in order.
+    """
+    subject = Subject.query.get(subject_id)
+    if subject is None:
+        raise ValueError(f'Unknown subject {subject_id}')
+    model = Note if kind == 'note' else QuestionPaper
+    workers = workers or current_app.config.get('INGEST_WORKERS', 4)
+
+    inputs = [(f.filename, _write_file, f) for f in files] + [(u, _finish_upload, u) for u in upload_ids]
+    results = [None] * len(inputs)
+    written = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as pool:
+        futures = {}
+        for i, (label, task, arg) in enumerate(inputs):
+            if task is _write_file and not _allowed(label):
+                results[i] = FileResult(label, 'failed', None, None, 'File type not allowed')
+            else:
+                futures[i] = pool.submit(task, arg)
+        for done, (i, future) in enumerate(futures.items(), 1):
+            try:
+                written[i] = future.result()
+            except Exception as e:
+                logger.warning('Could not store %s: %s', inputs[i][0], e)
+                results[i] = FileResult(inputs[i][0], 'failed', None, None, str(e) or type(e).__name__)
+            if progress is not None:
+                progress(done)
+
+    storage.track_created([stored for _, stored in written.values()])
+    try:
+        existing = {f for (f,) in db.session.query(model.filename).filter(
+            model.subject_id == subject_id, model.filename.in_({s.filename for _, s in written.values()}))}
+        rows = {}
+        for i, (name, stored) in written.items():
+            if not _allowed(name):
+                results[i] = FileResult(name, 'failed', None, None, 'File type not allowed')
+            elif stored.filename in existing:
+                results[i] = FileResult(name, 'exists', None, title_from_filename(name), 'Already in this subject')
+            else:
+                existing.add(stored.filename)
+                row = {'subject_id': subject_id, 'filename': stored.filename, 'original_filename': name,
+                       'file_size': stored.size}
+                if kind == 'note':
+                    row['title'] = title_from_filename(name)
+                else:
+                    row.update(parse_paper_filename(name, default_semester=subject.semester)._asdict())
+                rows[i] = row
+
+        ids = []
+        if rows:
+            storage.acquire_many([written[i][1] for i in rows])
+            ids = list(db.session.execute(
+                insert(model).returning(model.id, sort_by_parameter_order=True), list(rows.values())
+            ).scalars())
+            created = model.query.filter(model.id.in_(ids)).all()
+            if kind == 'note':
+                search.index_notes(created)
+            else:
+                search.index_papers(created)
+            extraction.schedule_extraction(kind, *ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception('Bulk upload into subject %s rolled back', subject_id)
+        raise
+
+    if discard_uploads:
+        for i in written:
+            _, task, upload_id = inputs[i]
+            if task is _finish_upload:
+                storage.cancel_upload(upload_id)
+
+    for ref_id, (i, row) in zip(ids, rows.items()):
+        if kind == 'note':
+            detail = ''
+        else:
+            detail = f"{row['year']}, semester {row['semester']}, {row['exam_type']}"
+        results[i] = FileResult(row['original_filename'], 'added', ref_id, row['title'], detail)
+    return results
@@ -1,9 +1,15 @@
 import os
 import secrets
 import string
-from app import app, db
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables from .env file
+
+from app import create_app, db
 from models import Admin
 
+app = create_app()
+
 def generate_secure_password(length=16):
     alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
     return ''.join(secrets.choice(alphabet) for _ in range(length))
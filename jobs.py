@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from app import db
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+ACTIVE = ('queued', 'running')
+
+
+def task(name):
+    """Register a function as the handler for jobs of kind ``name``.
+
+    Handlers are called as ``handler(ctx, **payload)`` inside an app context and
+    may return a JSON-serialisable result, which is stored on the job.
+    """
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, /, max_attempts=3, **payload):
+    """Add a job to the current session; it becomes visible to workers on commit.
+
+    An identical job that is still queued or running is returned instead of a duplicate.
+    """
+    encoded = json.dumps(payload, sort_keys=True)
+    job = Job.query.filter(Job.kind == kind, Job.payload == encoded, Job.status.in_(ACTIVE)).first()
+    if job is None:
+        job = Job(kind=kind, payload=encoded, max_attempts=max_attempts, status='queued',
+                  attempts=0, progress_done=0, run_at=datetime.utcnow())
+        db.session.add(job)
+    embedded_worker.wake()
+    return job
+
+
+class JobContext:
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def progress(self, done, total=None, message=None):
+        """Record progress in its own short transaction.
+
+        Call it between the task's own commits, never while the session holds
+        uncommitted writes: on SQLite the second connection would wait on them.
+        """
+        values = {'progress_done': done}
+        if total is not None:
+            values['progress_total'] = total
+        if message is not None:
+            values['message'] = message[:255]
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.id == self.job_id).values(**values))
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim(worker):
+    """Atomically mark the next due job as running and return its id, or None."""
+    now = datetime.utcnow()
+    next_job = (select(Job.id).where(Job.status == 'queued', Job.run_at <= now)
+                .order_by(Job.run_at, Job.id).limit(1).with_for_update(skip_locked=True)
+                .scalar_subquery())
+    with db.engine.begin() as connection:
+        return connection.execute(
+            update(Job).where(Job.id == next_job, Job.status == 'queued')
+            .values(status='running', locked_by=worker, locked_at=now, attempts=Job.attempts + 1)
+            .returning(Job.id)
+        ).scalar()
+
+
+def requeue_stale():
+    """Put back jobs whose worker died mid-run."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_TIMEOUT', 3600))
+    with db.engine.begin() as connection:
+        return connection.execute(
+            update(Job).where(Job.status == 'running', Job.locked_at < cutoff)
+            .values(status='queued', locked_by=None, locked_at=None, message='Requeued after worker timeout')
+        ).rowcount
+
+
+def run_job(job_id):
+    job = Job.query.get(job_id)
+    handler = TASKS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f'No task registered for {job.kind!r}')
+        result = handler(JobContext(job_id), **json.loads(job.payload))
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed', job_id, job.kind)
+        job = Job.query.get(job_id)
+        job.error = f'{type(e).__name__}: {e}'
+        job.locked_by = job.locked_at = None
+        if job.attempts < job.max_attempts and handler is not None:
+            delay = current_app.config.get('JOB_RETRY_DELAY', 10) * 2 ** (job.attempts - 1)
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+            job.message = f'Retrying in {delay}s (attempt {job.attempts} of {job.max_attempts})'
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return False
+    job = Job.query.get(job_id)
+    job.status = 'done'
+    job.result = json.dumps(result) if result is not None else None
+    job.error = None
+    job.locked_by = job.locked_at = None
+    job.finished_at = datetime.utcnow()
+    if job.progress_total:
+        job.progress_done = job.progress_total
+    db.session.commit()
+    return True
+
+
+def work_off(worker=None, limit=None):
+    """Run due jobs until the queue is empty (or ``limit`` jobs ran); returns the count."""
+    import tasks  # noqa: F401  registers the task handlers
+    worker = worker or worker_id()
+    count = 0
+    while limit is None or count < limit:
+        job_id = claim(worker)
+        if job_id is None:
+            break
+        run_job(job_id)
+        db.session.remove()
+        count += 1
+    return count
+
+
+def run_worker(app, poll_interval=1.0, stop=None):
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+    worker = worker_id()
+    logger.info('Job worker %s started', worker)
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                requeue_stale()
+                if not work_off(worker):
+                    stop.wait(poll_interval)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Job worker loop failed')
+                stop.wait(poll_interval)
+    logger.info('Job worker %s stopped', worker)
+
+
+class EmbeddedWorker:
+    """Runs queued jobs on a daemon thread inside the web process, so jobs make
+    progress even where no separate ``flask run-worker`` process is deployed."""
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self.ensure_started)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def ensure_started(self):
+        if self.app.config.get('JOB_WORKER') != 'embedded':
+            return
+        # Like the download counter, each forked gunicorn worker starts its own thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='job-worker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = self.app.config.get('JOB_POLL_INTERVAL', 2.0)
+        worker = worker_id()
+        with self.app.app_context():
+            while True:
+                try:
+                    requeue_stale()
+                    work_off(worker)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Embedded job worker failed')
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+
+embedded_worker = EmbeddedWorker()
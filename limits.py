@@ -0,0 +1,78 @@
+import threading
+from collections import Counter
+
+from werkzeug.exceptions import TooManyRequests
+
+
+def _once(func):
+    called = False
+
+    def wrapper():
+        nonlocal called
+        if not called:
+            called = True
+            func()
+    return wrapper
+
+
+class ClientLimiter:
+    """Caps how many downloads one client address streams from this process at once.
+
+    A slot is taken when the download starts and given back when the server has
+    finished sending the body (or the client went away), so a handful of clients
+    opening dozens of parallel range requests cannot take every connection of an
+    async worker. Downloads offloaded to nginx are left to nginx's ``limit_conn``.
+    """
+
+    RETRY_AFTER = 5
+
+    def __init__(self):
+        self.app = None
+        self.limit = None
+        self._active = Counter()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.limit = app.config.get('DOWNLOAD_MAX_PER_CLIENT')
+
+    def acquire(self, client):
+        """Take a slot for ``client``, or raise 429 Too Many Requests."""
+        with self._lock:
+            if self.limit and self._active[client] >= self.limit:
+                raise TooManyRequests(f'At most {self.limit} downloads at a time, please.',
+                                      retry_after=self.RETRY_AFTER)
+            self._active[client] += 1
+
+    def release(self, client):
+        with self._lock:
+            self._active[client] -= 1
+            if self._active[client] <= 0:
+                del self._active[client]
+
+    def send(self, client, send, *args, **kwargs):
+        """Call ``send`` for ``client`` and keep the slot until its response has been sent."""
+        self.acquire(client)
+        try:
+            response = send(*args, **kwargs)
+        except BaseException:
+            self.release(client)
+            raise
+        release = _once(lambda: self.release(client))
+        response.call_on_close(release)
+        body = response.response
+        if response.direct_passthrough and hasattr(body, 'close'):
+            # Servers send file bodies (gunicorn with sendfile) and close them
+            # without calling the response's close callbacks.
+            close_file = body.close
+
+            def close():
+                try:
+                    close_file()
+                finally:
+                    release()
+            body.close = close
+        return response
+
+
+download_limiter = ClientLimiter()
@@ -1,5 +1,12 @@
-from app import app
-import routes
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables from .env file
+
+from app import create_app, init_database
+
+app = create_app()
 
 if __name__ == '__main__':
+    if app.config['DB_AUTO_UPGRADE']:
+        init_database(app)
     app.run(host='0.0.0.0', port=5000, debug=True)
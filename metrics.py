@@ -0,0 +1,369 @@
+"""Request metrics in the Prometheus text format, and an opt-in sampling profiler.
+
+Each process records, per endpoint, request latency and the number and total
+time of SQL statements a request ran; per template, render time; and the bytes
+sent by downloads. Latency is measured up to the response being handed to the
+server, so it does not include the time a slow client takes to receive a file.
+Statements slower than ``METRICS_SLOW_QUERY_MS`` are logged, whether they come
+from a request or a background job.
+
+``/admin/metrics`` serves the numbers to a logged-in admin, or to a scraper
+sending ``Authorization: Bearer <METRICS_TOKEN>``. Every gunicorn worker keeps
+its own numbers; with ``METRICS_DIR`` set they write them there every
+``METRICS_FLUSH_INTERVAL`` seconds and the endpoint adds them all up.
+
+With ``PROFILE_SLOW_MS`` set, a thread samples the stacks of requests in flight
+every ``PROFILE_INTERVAL`` seconds, and requests that take longer than that
+threshold leave a ``.folded`` file in ``PROFILE_DIR`` (default
+``instance/profiles``), one ``frame;frame;frame count`` line per distinct stack,
+which flamegraph.pl and speedscope read as they are. The sampler reads the
+stacks of threads, so it is turned off under gevent's monkey patching
+(``GUNICORN_ASYNC``), where requests are greenlets sharing one thread.
+"""
+import glob
+import hmac
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from flask import abort, current_app, request, before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+RENDER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, by endpoint.'),
+    'db_statements_per_request': ('histogram', 'SQL statements run by one request, by endpoint.'),
+    'db_time_per_request_seconds': ('histogram', 'Time spent in SQL statements by one request, by endpoint.'),
+    'db_slow_statements_total': ('counter', 'SQL statements slower than METRICS_SLOW_QUERY_MS.'),
+    'template_render_seconds': ('histogram', 'Time to render a template, including templates it renders.'),
+    'download_bytes_total': ('counter', 'Bytes of file downloads sent by the app, by kind.'),
+}
+
+DOWNLOAD_ENDPOINTS = {'main.download_note': 'note', 'main.download_paper': 'paper'}
+
+
+def _gevent_patched():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+class Histogram:
+    def __init__(self, buckets, counts=None, total=0.0):
+        self.buckets = buckets
+        self.counts = counts or [0] * (len(buckets) + 1)
+        self.sum = total
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class RequestStats:
+    __slots__ = ('start', 'statements', 'sql_time', 'templates', 'samples')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.templates = []
+        self.samples = Counter()
+
+
+class Registry:
+    """Counters and histograms of one process, keyed on (name, labels)."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self.counters[name, labels] += amount
+
+    def observe(self, name, labels, value, buckets):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(h.buckets), list(h.counts), h.sum]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        for name, labels, value in snapshot['counters']:
+            self.counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, buckets, counts, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                self.histograms[key] = Histogram(tuple(buckets), counts, total)
+            else:
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_text(registry):
+    by_name = defaultdict(list)
+    for (name, labels), value in registry.counters.items():
+        by_name[name].append((labels, value))
+    for (name, labels), histogram in registry.histograms.items():
+        by_name[name].append((labels, histogram))
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name.get(name, ()), key=lambda item: item[0]):
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(value.buckets) + ['+Inf'], value.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value.sum)}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    def __init__(self):
+        self.app = None
+        self.registry = Registry()
+        self._local = threading.local()
+        self._active = {}
+        self._sampler = None
+        self._sampler_pid = None
+        self._sampler_lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.slow_query = (app.config.get('METRICS_SLOW_QUERY_MS') or 0) / 1000
+        self.profile_slow = (app.config.get('PROFILE_SLOW_MS') or 0) / 1000
+        self.profile_interval = app.config.get('PROFILE_INTERVAL', 0.01)
+        if self.profile_slow and _gevent_patched():
+            logger.warning('PROFILE_SLOW_MS is ignored: the sampler cannot see the stacks of gevent greenlets')
+            self.profile_slow = 0
+        app.before_request(self._start_request)
+        # Registered before the other after_request hooks, so it runs after them
+        # (Flask calls them in reverse) and compression counts towards latency.
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/admin/metrics', 'admin_metrics', self.send_metrics)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        event.listen(Engine, 'before_cursor_execute', self._statement_started)
+        event.listen(Engine, 'after_cursor_execute', self._statement_finished)
+        event.listen(Engine, 'handle_error', self._statement_failed)
+
+    @property
+    def current(self):
+        return getattr(self._local, 'stats', None)
+
+    # Requests
+
+    def _start_request(self):
+        stats = self._local.stats = RequestStats()
+        if self.profile_slow:
+            self._ensure_sampler()
+            self._active[threading.get_ident()] = stats
+
+    def _finish_request(self, response):
+        stats = self.current
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.start
+        endpoint = (('endpoint', request.endpoint or 'unmatched'),)
+        registry = self.registry
+        registry.inc('http_requests_total', endpoint + (('method', request.method),
+                                                        ('status', str(response.status_code))))
+        registry.observe('http_request_duration_seconds', endpoint, elapsed, LATENCY_BUCKETS)
+        registry.observe('db_statements_per_request', endpoint, stats.statements, QUERY_COUNT_BUCKETS)
+        registry.observe('db_time_per_request_seconds', endpoint, stats.sql_time, LATENCY_BUCKETS)
+        kind = DOWNLOAD_ENDPOINTS.get(request.endpoint)
+        # Offloaded downloads have no length here; nginx or Apache sends those bytes.
+        if kind is not None and response.status_code in (200, 206) and response.content_length:
+            registry.inc('download_bytes_total', (('kind', kind),), response.content_length)
+        if self.profile_slow and elapsed >= self.profile_slow:
+            self._write_profile(stats, elapsed)
+        self._maybe_flush()
+        return response
+
+    def _teardown_request(self, exc):
+        self._active.pop(threading.get_ident(), None)
+        self._local.stats = None
+
+    # Templates and SQL
+
+    def _template_started(self, sender, template, context, **extra):
+        stats = self.current
+        if stats is not None:
+            stats.templates.append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        stats = self.current
+        if stats is not None and stats.templates:
+            elapsed = time.perf_counter() - stats.templates.pop()
+            self.registry.observe('template_render_seconds', (('template', template.name),),
+                                  elapsed, RENDER_BUCKETS)
+
+    def _statement_started(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _statement_finished(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('metrics_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        stats = self.current
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_time += elapsed
+        if self.slow_query and elapsed >= self.slow_query:
+            self.registry.inc('db_slow_statements_total', ())
+            logger.warning('Slow SQL statement (%.0f ms): %s', elapsed * 1000, ' '.join(statement.split())[:500])
+
+    def _statement_failed(self, context):
+        started = context.connection.info.get('metrics_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    # Sampling profiler
+
+    def _ensure_sampler(self):
+        # A worker forked from a master that already sampled inherits _sampler but
+        # not the thread behind it, hence the pid check.
+        if self._sampler is not None and self._sampler_pid == os.getpid():
+            return
+        with self._sampler_lock:
+            if self._sampler is not None and self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+            self._sampler = threading.Thread(target=self._sample, name='metrics-sampler', daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.profile_interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident, stats in list(self._active.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if stack:
+                    stats.samples[';'.join(reversed(stack))] += 1
+
+    def _write_profile(self, stats, elapsed):
+        if not stats.samples:
+            return
+        directory = self.app.config.get('PROFILE_DIR') or os.path.join(self.app.instance_path, 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        name = (f"{time.strftime('%Y%m%dT%H%M%S')}-{request.endpoint or 'unmatched'}"
+                f"-{int(elapsed * 1000)}ms-{os.getpid()}.folded")
+        with open(os.path.join(directory, name), 'w') as f:
+            for stack, count in stats.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        logger.info('Slow request %s %s took %.0f ms; profile written to %s',
+                    request.method, request.path, elapsed * 1000, name)
+
+    # Export
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.app.config['METRICS_DIR'], f'{pid or os.getpid()}.json')
+
+    def _maybe_flush(self, force=False):
+        if not self.app.config.get('METRICS_DIR'):
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.app.config.get('METRICS_FLUSH_INTERVAL', 15):
+            return
+        self._last_flush = now
+        os.makedirs(self.app.config['METRICS_DIR'], exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.app.config['METRICS_DIR'], suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, self._snapshot_path())
+
+    def collect(self):
+        """Return a Registry with this process's numbers, plus those the other
+        workers left in METRICS_DIR."""
+        if not self.app.config.get('METRICS_DIR'):
+            return self.registry
+        self._maybe_flush(force=True)
+        combined = Registry()
+        for path in glob.glob(os.path.join(self.app.config['METRICS_DIR'], '*.json')):
+            pid = int(os.path.basename(path)[:-len('.json')])
+            if not _running(pid):
+                # A worker that exited; its counts go with it, which Prometheus
+                # treats like any other counter reset.
+                os.remove(path)
+                continue
+            try:
+                with open(path) as f:
+                    combined.merge(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return combined
+
+    def send_metrics(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        supplied = request.headers.get('Authorization', '')
+        if not (token and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())):
+            if 'Authorization' in request.headers:
+                abort(401)
+            if not current_user.is_authenticated:
+                return current_app.login_manager.unauthorized()
+        return current_app.response_class(render_text(self.collect()),
+                                          mimetype='text/plain; version=0.0.4')
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+metrics = Metrics()
@@ -0,0 +1,184 @@
+"""baseline schema
+
+The schema as it stood when migrations were introduced. Databases created
+earlier by db.create_all() already have some or all of these tables, so every
+table and index is created only if it does not exist yet.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 16:25:52.738459
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('admin',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=64), nullable=False),
+    sa.Column('password_hash', sa.String(length=256), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('username'),
+    if_not_exists=True
+    )
+    op.create_table('blob',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('filename'),
+    if_not_exists=True
+    )
+    op.create_index('ix_blob_sha256', 'blob', ['sha256'], if_not_exists=True)
+    op.create_table('content_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('course',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name'),
+    if_not_exists=True
+    )
+    op.create_table('extracted_text',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('content', sa.LargeBinary(), nullable=True),
+    sa.Column('char_count', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('extracted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('filename'),
+    if_not_exists=True
+    )
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('progress_done', sa.Integer(), nullable=False),
+    sa.Column('progress_total', sa.Integer(), nullable=True),
+    sa.Column('message', sa.String(length=255), nullable=True),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_by', sa.String(length=64), nullable=True),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index('ix_job_status_run_at', 'job', ['status', 'run_at'], if_not_exists=True)
+    op.create_table('paper_facet',
+    sa.Column('facet', sa.String(length=20), nullable=False),
+    sa.Column('value', sa.String(length=50), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('facet', 'value'),
+    if_not_exists=True
+    )
+    op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name'),
+    if_not_exists=True
+    )
+    op.create_table('subject',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=False),
+    sa.Column('semester', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['course_id'], ['course.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('note',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=200), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('original_filename', sa.String(length=255), nullable=False),
+    sa.Column('file_size', sa.Integer(), nullable=True),
+    sa.Column('subject_id', sa.Integer(), nullable=False),
+    sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+    sa.Column('download_count', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['subject_id'], ['subject.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index('ix_note_filename', 'note', ['filename'], if_not_exists=True)
+    op.create_table('question_paper',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=200), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('semester', sa.Integer(), nullable=False),
+    sa.Column('exam_type', sa.String(length=50), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('original_filename', sa.String(length=255), nullable=False),
+    sa.Column('file_size', sa.Integer(), nullable=True),
+    sa.Column('subject_id', sa.Integer(), nullable=False),
+    sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+    sa.Column('download_count', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['subject_id'], ['subject.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index('ix_question_paper_filename', 'question_paper', ['filename'], if_not_exists=True)
+    op.create_table('note_tags',
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['note_id'], ['note.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('note_id', 'tag_id'),
+    if_not_exists=True
+    )
+    op.create_table('paper_tags',
+    sa.Column('paper_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['paper_id'], ['question_paper.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('paper_id', 'tag_id'),
+    if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('paper_tags')
+    op.drop_table('note_tags')
+    op.drop_index('ix_question_paper_filename', table_name='question_paper')
+    op.drop_table('question_paper')
+    op.drop_index('ix_note_filename', table_name='note')
+    op.drop_table('note')
+    op.drop_table('subject')
+    op.drop_table('tag')
+    op.drop_table('paper_facet')
+    op.drop_index('ix_job_status_run_at', table_name='job')
+    op.drop_table('job')
+    op.drop_table('extracted_text')
+    op.drop_table('course')
+    op.drop_table('content_version')
+    op.drop_index('ix_blob_sha256', table_name='blob')
+    op.drop_table('blob')
+    op.drop_table('admin')
@@ -0,0 +1,42 @@
+"""indexes for listing queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 16:26:18.759472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_subject_course_id_semester', 'subject', ['course_id', 'semester'])
+    op.create_index('ix_note_uploaded_at_id', 'note', ['uploaded_at', 'id'])
+    op.create_index('ix_note_subject_id_uploaded_at_id', 'note', ['subject_id', 'uploaded_at', 'id'])
+    op.create_index('ix_question_paper_uploaded_at_id', 'question_paper', ['uploaded_at', 'id'])
+    # Same mixed directions as the paper listing order, so it is read without a sort.
+    op.create_index('ix_question_paper_year_semester_id', 'question_paper',
+                    [sa.text('year DESC'), 'semester', sa.text('id DESC')])
+    op.create_index('ix_question_paper_subject_id_year', 'question_paper', ['subject_id', 'year'])
+    op.create_index('ix_question_paper_semester_year', 'question_paper', ['semester', 'year'])
+    op.create_index('ix_note_tags_tag_id_note_id', 'note_tags', ['tag_id', 'note_id'])
+    op.create_index('ix_paper_tags_tag_id_paper_id', 'paper_tags', ['tag_id', 'paper_id'])
+
+
+def downgrade():
+    op.drop_index('ix_paper_tags_tag_id_paper_id', table_name='paper_tags')
+    op.drop_index('ix_note_tags_tag_id_note_id', table_name='note_tags')
+    op.drop_index('ix_question_paper_semester_year', table_name='question_paper')
+    op.drop_index('ix_question_paper_subject_id_year', table_name='question_paper')
+    op.drop_index('ix_question_paper_year_semester_id', table_name='question_paper')
+    op.drop_index('ix_question_paper_uploaded_at_id', table_name='question_paper')
+    op.drop_index('ix_note_subject_id_uploaded_at_id', table_name='note')
+    op.drop_index('ix_note_uploaded_at_id', table_name='note')
+    op.drop_index('ix_subject_course_id_semester', table_name='subject')
@@ -0,0 +1,43 @@
+"""download event log and analytics rollups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 17:05:12.418306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('download_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('ref_id', sa.Integer(), nullable=False),
+    sa.Column('occurred_at', sa.DateTime(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('download_rollup',
+    sa.Column('period', sa.String(length=5), nullable=False),
+    sa.Column('scope', sa.String(length=10), nullable=False),
+    sa.Column('key_id', sa.Integer(), nullable=False),
+    sa.Column('period_start', sa.DateTime(), nullable=False),
+    sa.Column('downloads', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('period', 'scope', 'key_id', 'period_start')
+    )
+    op.create_index('ix_download_rollup_period_scope_start', 'download_rollup',
+                    ['period', 'scope', 'period_start', 'downloads'])
+
+
+def downgrade():
+    op.drop_index('ix_download_rollup_period_scope_start', table_name='download_rollup')
+    op.drop_table('download_rollup')
+    op.drop_table('download_event')
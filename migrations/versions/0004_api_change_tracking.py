@@ -0,0 +1,50 @@
+"""updated_at columns and tombstones for the API change feed
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 18:12:47.530917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+# Table, and the column existing rows take their updated_at from.
+TRACKED = (
+    ('course', 'created_at'),
+    ('subject', 'created_at'),
+    ('note', 'uploaded_at'),
+    ('question_paper', 'uploaded_at'),
+    ('tag', 'created_at'),
+)
+
+
+def upgrade():
+    for table, since in TRACKED:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = coalesce({since}, CURRENT_TIMESTAMP)')
+        op.create_index(f'ix_{table}_updated_at_id', table, ['updated_at', 'id'])
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('ref_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstone_kind_deleted_at_id', 'tombstone', ['kind', 'deleted_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_tombstone_kind_deleted_at_id', table_name='tombstone')
+    op.drop_table('tombstone')
+    for table, _ in reversed(TRACKED):
+        op.drop_index(f'ix_{table}_updated_at_id', table_name=table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -1,3 +1,4 @@
+import zlib
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
@@ -22,9 +23,13 @@ class Course(db.Model):
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     subjects = db.relationship('Subject', backref='course', lazy=True, cascade='all, delete-orphan')
 
+    # The API's change feed; updated_at is maintained by api.py.
+    __table_args__ = (db.Index('ix_course_updated_at_id', 'updated_at', 'id'),)
+
     def __repr__(self):
         return f'<Course {self.name}>'
 
@@ -35,10 +40,16 @@ class Subject(db.Model):
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     semester = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     notes = db.relationship('Note', backref='subject', lazy=True, cascade='all, delete-orphan')
     question_papers = db.relationship('QuestionPaper', backref='subject', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_subject_course_id_semester', 'course_id', 'semester'),
+        db.Index('ix_subject_updated_at_id', 'updated_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Subject {self.name}>'
 
@@ -47,14 +58,34 @@ class Note(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    filename = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False, index=True)
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     download_count = db.Column(db.Integer, default=0)
     tags = db.relationship('Tag', secondary='note_tags', backref=db.backref('notes', lazy='dynamic'))
 
+    # Match the listing orders in routes.py: newest first, with id as the tie-breaker.
+    __table_args__ = (
+        db.Index('ix_note_uploaded_at_id', 'uploaded_at', 'id'),
+        db.Index('ix_note_subject_id_uploaded_at_id', 'subject_id', 'uploaded_at', 'id'),
+        db.Index('ix_note_updated_at_id', 'updated_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'original_filename': self.original_filename,
+            'file_size': self.file_size,
+            'subject_id': self.subject_id,
+            'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None,
+            'download_count': self.download_count or 0,
+        }
+
     def __repr__(self):
         return f'<Note {self.title}>'
 
@@ -65,14 +96,37 @@ class QuestionPaper(db.Model):
     year = db.Column(db.Integer, nullable=False)
     semester = db.Column(db.Integer, nullable=False)
     exam_type = db.Column(db.String(50))
-    filename = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False, index=True)
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     download_count = db.Column(db.Integer, default=0)
     tags = db.relationship('Tag', secondary='paper_tags', backref=db.backref('papers', lazy='dynamic'))
 
+    __table_args__ = (
+        db.Index('ix_question_paper_uploaded_at_id', 'uploaded_at', 'id'),
+        db.Index('ix_question_paper_year_semester_id', year.desc(), semester, id.desc()),
+        db.Index('ix_question_paper_subject_id_year', 'subject_id', 'year'),
+        db.Index('ix_question_paper_semester_year', 'semester', 'year'),
+        db.Index('ix_question_paper_updated_at_id', 'updated_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'year': self.year,
+            'semester': self.semester,
+            'exam_type': self.exam_type,
+            'original_filename': self.original_filename,
+            'file_size': self.file_size,
+            'subject_id': self.subject_id,
+            'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None,
+            'download_count': self.download_count or 0,
+        }
+
     def __repr__(self):
         return f'<QuestionPaper {self.title} - {self.year}>'
 
@@ -81,6 +135,9 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_tag_updated_at_id', 'updated_at', 'id'),)
 
     def __repr__(self):
         return f'<Tag {self.name}>'
@@ -88,11 +145,146 @@ class Tag(db.Model):
 
 note_tags = db.Table('note_tags',
     db.Column('note_id', db.Integer, db.ForeignKey('note.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    # The primary key only serves lookups by note; tag filters need the reverse.
+    db.Index('ix_note_tags_tag_id_note_id', 'tag_id', 'note_id')
 )
 
 
 paper_tags = db.Table('paper_tags',
     db.Column('paper_id', db.Integer, db.ForeignKey('question_paper.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Index('ix_paper_tags_tag_id_paper_id', 'tag_id', 'paper_id')
 )
+
+
+class Blob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), unique=True, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Blob {self.filename}>'
+
+
+class PaperFacet(db.Model):
+    # Number of question papers per filter value, maintained by facets.py.
+    facet = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PaperFacet {self.facet}={self.value}: {self.count}>'
+
+
+class DownloadEvent(db.Model):
+    # Download counts as flushed by counters.py, until analytics.py rolls them up.
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+
+class DownloadRollup(db.Model):
+    # Downloads of one note, paper, subject or course, or of the whole site (key 0),
+    # per hour, per day or for all time; maintained by analytics.py.
+    period = db.Column(db.String(5), primary_key=True)
+    scope = db.Column(db.String(10), primary_key=True)
+    key_id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Top downloads of a scope over a range of periods.
+        db.Index('ix_download_rollup_period_scope_start', 'period', 'scope', 'period_start', 'downloads'),
+    )
+
+
+class Tombstone(db.Model):
+    # A deleted course, subject, note, paper or tag, kept for the API's change feed.
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_tombstone_kind_deleted_at_id', 'kind', 'deleted_at', 'id'),)
+
+
+class ContentVersion(db.Model):
+    # Single row, bumped with every change to public content; see cache.py.
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer)
+    message = db.Column(db.String(255))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    @property
+    def percent(self):
+        if self.status == 'done':
+            return 100
+        if not self.progress_total:
+            return 0
+        return min(100, int(100 * self.progress_done / self.progress_total))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'progress_done': self.progress_done,
+            'progress_total': self.progress_total,
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+
+class ExtractedText(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), unique=True, nullable=False)
+    content = db.Column(db.LargeBinary)
+    char_count = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(255))
+    extracted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def text(self):
+        if not self.content:
+            return ''
+        return zlib.decompress(self.content).decode('utf-8')
+
+    @text.setter
+    def text(self, value):
+        self.content = zlib.compress(value.encode('utf-8'), 6) if value else None
+        self.char_count = len(value or '')
+
+    def __repr__(self):
+        return f'<ExtractedText {self.filename}>'
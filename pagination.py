@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+from flask import current_app, request, abort
+from sqlalchemy import and_, or_, tuple_, DateTime
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'per_page'])
+
+
+def page_size():
+    default = current_app.config.get('PAGE_SIZE', 25)
+    maximum = current_app.config.get('MAX_PAGE_SIZE', 100)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+def wants_json():
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_serialize(v) for v in values], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys=None):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        abort(400, 'Invalid cursor')
+    if not isinstance(values, list) or (keys is not None and len(values) != len(keys)):
+        abort(400, 'Invalid cursor')
+    if keys is not None:
+        try:
+            values = [_cursor_value(column, v) for (column, _), v in zip(keys, values)]
+        except (TypeError, ValueError):
+            abort(400, 'Invalid cursor')
+    return values
+
+
+def _cursor_value(column, value):
+    """``value`` as a bind parameter for ``column``; TypeError if it cannot be one."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise TypeError(value)
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is int and not isinstance(value, int):
+        raise TypeError(value)
+    if python_type in (float, Decimal) and isinstance(value, str):
+        raise TypeError(value)
+    if python_type is str and not isinstance(value, str):
+        raise TypeError(value)
+    return value
+
+
+def keyset_after(keys, values):
+    """Condition selecting the rows that sort after ``values`` under ``keys``.
+
+    ``keys`` is a sequence of ``(column, descending)`` pairs ending in a unique column.
+    """
+    directions = {descending for _, descending in keys}
+    if len(directions) == 1:
+        # A single row-value comparison lets the database seek straight into a composite index.
+        columns = tuple_(*[column for column, _ in keys])
+        return columns < tuple_(*values) if directions.pop() else columns > tuple_(*values)
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal = [c == v for (c, _), v in zip(keys[:i], values[:i])]
+        clauses.append(and_(*equal, column < values[i] if descending else column > values[i]))
+    return or_(*clauses)
+
+
+def order_by_keys(keys):
+    return [column.desc() if descending else column.asc() for column, descending in keys]
+
+
+def paginate(query, keys, cursor=None, per_page=None):
+    per_page = per_page or page_size()
+    values = decode_cursor(cursor, keys)
+    if values is not None:
+        query = query.filter(keyset_after(keys, values))
+    rows = query.order_by(*order_by_keys(keys)).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column, _ in keys])
+    return Page(rows, next_cursor, per_page)
@@ -0,0 +1,199 @@
+"""First-page thumbnails and short text previews of uploaded files.
+
+Previews are made once per stored file by the text extraction job and kept under
+``PREVIEW_FOLDER`` (``uploads/.previews`` by default), mirroring the upload
+names: ``<filename>.webp`` for the first page of a PDF and ``<filename>.txt``
+for the opening text of any file. The folder is a cache bounded by
+``PREVIEW_MAX_BYTES``; the least recently served previews are evicted first.
+Serving a preview never writes to the database: a missing or evicted preview is
+a 404 until the next extraction job or `flask generate-previews` remakes it.
+
+Rendering thumbnails needs ``pypdfium2`` and ``Pillow``; without them only text
+previews are made.
+"""
+import io
+import logging
+import os
+import tempfile
+import time
+
+from flask import abort, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+import extraction
+from models import ExtractedText
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+KINDS = {'webp': 'image/webp', 'txt': 'text/plain; charset=utf-8'}
+
+# Served previews have their mtime refreshed at most this often, which is what
+# eviction orders by.
+TOUCH_INTERVAL = 24 * 3600
+
+
+class PreviewError(Exception):
+    pass
+
+
+def _render_thumbnail(source, width):
+    # Imported on first use: only the job worker renders, and both are slow to load.
+    try:
+        import pypdfium2
+    except ImportError:
+        raise PreviewError('pypdfium2 is not installed')
+    document = pypdfium2.PdfDocument(source)
+    try:
+        if len(document) == 0:
+            raise PreviewError('PDF has no pages')
+        page = document[0]
+        page_width = page.get_width()
+        image = page.render(scale=width / page_width).to_pil()
+        page.close()
+    finally:
+        document.close()
+    return image
+
+
+def _first_page_text(source):
+    import pypdf
+    reader = pypdf.PdfReader(source)
+    return reader.pages[0].extract_text() if reader.pages else ''
+
+
+class Previews:
+    def __init__(self):
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        app.add_url_rule('/previews/<path:name>', 'preview', self.send_preview)
+        app.jinja_env.globals['preview_url'] = self.url
+
+    @property
+    def root(self):
+        return self.app.config.get('PREVIEW_FOLDER') or os.path.join(self.app.config['UPLOAD_FOLDER'], '.previews')
+
+    def path(self, filename, kind):
+        return os.path.join(self.root, *f'{filename}.{kind}'.split('/'))
+
+    def url(self, filename, kind):
+        return url_for('preview', name=f'{filename}.{kind}')
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _text(self, filename, source):
+        record = ExtractedText.query.filter_by(filename=filename).first()
+        if record is not None and not record.error:
+            text = record.text
+        elif filename.endswith('.pdf'):
+            text = _first_page_text(source)
+        else:
+            text = extraction.extract_text(source)
+        limit = self.app.config.get('PREVIEW_CHARS', 600)
+        text = ' '.join(text[:limit * 2].split())
+        return text[:limit].rsplit(' ', 1)[0] + ' …' if len(text) > limit else text
+
+    def generate(self, filename, force=False):
+        """Make whatever previews of ``filename`` are missing; returns how many were written.
+
+        A file that cannot be previewed gets an empty preview, so it is not retried
+        on every page view; ``force`` (as in `flask generate-previews --force`)
+        tries again.
+        """
+        text_path = self.path(filename, 'txt')
+        thumb_path = self.path(filename, 'webp')
+        make_text = force or not os.path.exists(text_path)
+        make_thumb = filename.endswith('.pdf') and (force or not os.path.exists(thumb_path))
+        if not (make_text or make_thumb) or not storage.exists(filename):
+            return 0
+        written = 0
+        # Compressed uploads are read from a decompressed temporary copy.
+        with storage.local_copy(filename) as source:
+            if make_text:
+                try:
+                    text = self._text(filename, source)
+                except Exception as e:
+                    logger.warning('No text preview for %s: %s', filename, e)
+                    text = ''
+                self._write(text_path, text.encode('utf-8'))
+                written += 1
+            if make_thumb:
+                try:
+                    image = _render_thumbnail(source, self.app.config.get('PREVIEW_WIDTH', 320))
+                except Exception as e:
+                    logger.warning('No thumbnail for %s: %s', filename, e)
+                    self._write(thumb_path, b'')
+                    return written + 1
+                self._write(thumb_path, self._encode(image))
+                written += 1
+        return written
+
+    def _encode(self, image):
+        out = io.BytesIO()
+        image.convert('RGB').save(out, 'WEBP', quality=self.app.config.get('PREVIEW_QUALITY', 70))
+        return out.getvalue()
+
+    def evict(self):
+        """Delete the least recently served previews until the folder is below
+        PREVIEW_MAX_BYTES again (down to 90% of it, so eviction does not run on
+        every new preview). Returns the number of files removed."""
+        limit = self.app.config.get('PREVIEW_MAX_BYTES')
+        if not limit or not os.path.isdir(self.root):
+            return 0
+        entries, total = [], 0
+        for directory, dirs, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= limit:
+            return 0
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def send_preview(self, name):
+        filename, _, kind = name.rpartition('.')
+        # Names starting with a dot are storage's own scratch and preview folders.
+        if kind not in KINDS or filename.startswith('.') or not storage.exists(filename):
+            abort(404)
+        if kind == 'webp' and not filename.endswith('.pdf'):
+            # Only PDFs get thumbnails.
+            abort(404)
+        path = safe_join(self.root, name)
+        if path is None:
+            abort(404)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # Not made yet, or evicted; anonymous requests do not queue work.
+            abort(404)
+        if stat.st_size == 0 and kind == 'webp':
+            abort(404)
+        if time.time() - stat.st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+        # Previews belong to a content-addressed file, so they never change.
+        return send_from_directory(self.root, name, mimetype=KINDS[kind],
+                                   max_age=self.app.config['PREVIEW_MAX_AGE'])
+
+
+previews = Previews()
@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+        self.parameters = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(None if executemany else parameters)
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
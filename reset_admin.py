@@ -5,9 +5,11 @@ from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
-from app import app, db
+from app import create_app, db
 from models import Admin
 
+app = create_app()
+
 def generate_secure_password(length=16):
     alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
     return ''.join(secrets.choice(alphabet) for _ in range(length))
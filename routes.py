@@ -1,13 +1,28 @@
-import os
-import uuid
-from flask import render_template, redirect, url_for, flash, request, send_from_directory, abort
+import json
+import mimetypes
+from datetime import datetime
+from flask import (Blueprint, current_app, render_template, redirect, url_for, flash, request, send_from_directory,
+                   abort, jsonify)
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-
-from app import app, db, login_manager
-from models import Admin, Course, Subject, Note, QuestionPaper, Tag
-from forms import (LoginForm, CourseForm, SubjectForm, NoteForm, NoteEditForm, 
-                   QuestionPaperForm, QuestionPaperEditForm, SearchForm, TagForm)
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from wtforms.validators import ValidationError
+
+import analytics
+import extraction
+import facets
+import jobs
+import search as search_index
+from app import db, login_manager
+from cache import page_cache, conditional
+from counters import download_counter
+from limits import download_limiter
+from storage import storage, upload_names, UploadError, UploadNotFound, ENCODINGS
+from pagination import paginate, page_size, wants_json, encode_cursor, decode_cursor
+from models import Admin, Course, Subject, Note, QuestionPaper, Tag, Job
+from forms import (NOTE_EXTENSIONS, LoginForm, CourseForm, SubjectForm, NoteForm, NoteEditForm,
+                   QuestionPaperForm, QuestionPaperEditForm, TagForm)
+
+bp = Blueprint('main', __name__)
 
 
 @login_manager.user_loader
@@ -16,26 +31,37 @@ def load_user(user_id):
 
 
 def allowed_file(filename):
-    allowed_extensions = {'pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in NOTE_EXTENSIONS
 
 
 def save_file(file):
     if file and allowed_file(file.filename):
-        original_filename = secure_filename(file.filename)
-        extension = original_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{extension}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
-        file_size = os.path.getsize(filepath)
-        return unique_filename, original_filename, file_size
+        extension, original_filename = upload_names(file.filename)
+        blob = storage.save(file.stream, extension)
+        return blob.filename, original_filename, blob.size
     return None, None, None
 
 
+def save_chunked_upload(upload_id, extensions):
+    try:
+        upload = storage.get_upload(upload_id)
+        if upload.extension not in extensions:
+            storage.cancel_upload(upload_id)
+            return None, None, None
+        upload, blob = storage.save_upload(upload_id)
+    except UploadError:
+        return None, None, None
+    return blob.filename, upload.original_filename, blob.size
+
+
+def save_form_file(form):
+    if form.upload_id.data:
+        return save_chunked_upload(form.upload_id.data, form.file_extensions)
+    return save_file(form.file.data)
+
+
 def delete_file(filename):
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    storage.release(filename)
 
 
 def format_file_size(size):
@@ -47,126 +73,334 @@ def format_file_size(size):
         return f"{size / (1024 * 1024):.1f} MB"
 
 
-app.jinja_env.filters['format_size'] = format_file_size
+bp.add_app_template_filter(format_file_size, 'format_size')
+bp.add_app_template_filter(search_index.highlight, 'highlight')
+bp.add_app_template_global(generate_csrf, 'csrf_token')
+
+NOTE_KEYS = ((Note.uploaded_at, True), (Note.id, True))
+PAPER_RECENT_KEYS = ((QuestionPaper.uploaded_at, True), (QuestionPaper.id, True))
+PAPER_KEYS = ((QuestionPaper.year, True), (QuestionPaper.semester, False), (QuestionPaper.id, True))
+
+
+def url_for_page(cursor=None):
+    args = request.args.to_dict(flat=False)
+    args.pop('cursor', None)
+    args.pop('format', None)
+    if cursor:
+        args['cursor'] = cursor
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+bp.add_app_template_global(url_for_page)
+
+
+def note_json(note):
+    data = note.to_dict()
+    data['subject'] = note.subject.name
+    data['course'] = note.subject.course.name
+    data['download_url'] = url_for('main.download_note', note_id=note.id)
+    return data
+
+
+def paper_json(paper):
+    data = paper.to_dict()
+    data['subject'] = paper.subject.name
+    data['course'] = paper.subject.course.name
+    data['download_url'] = url_for('main.download_paper', paper_id=paper.id)
+    return data
+
+
+def page_json(page, serializer, **extra):
+    return jsonify(items=[serializer(item) for item in page.items], next_cursor=page.next_cursor,
+                   per_page=page.per_page, **extra)
+
+
+def with_subject(model):
+    return db.joinedload(model.subject).joinedload(Subject.course)
+
 
+def subject_counts_by_course():
+    rows = db.session.query(Subject.course_id, db.func.count(Subject.id)).group_by(Subject.course_id).all()
+    return dict(rows)
 
-@app.route('/')
+
+def note_counts_by_course():
+    rows = db.session.query(Subject.course_id, db.func.count(Note.id)) \
+        .join(Note, Note.subject_id == Subject.id).group_by(Subject.course_id).all()
+    return dict(rows)
+
+
+def note_counts_by_subject(course_id):
+    rows = db.session.query(Note.subject_id, db.func.count(Note.id)) \
+        .join(Subject, Note.subject_id == Subject.id) \
+        .filter(Subject.course_id == course_id).group_by(Note.subject_id).all()
+    return dict(rows)
+
+
+@bp.route('/')
+@conditional
+@page_cache.cached
 def index():
-    courses = Course.query.all()
-    recent_notes = Note.query.order_by(Note.uploaded_at.desc()).limit(5).all()
-    recent_papers = QuestionPaper.query.order_by(QuestionPaper.uploaded_at.desc()).limit(5).all()
-    return render_template('index.html', courses=courses, recent_notes=recent_notes, recent_papers=recent_papers)
+    courses = Course.query.order_by(Course.id).all()
+    recent_notes = Note.query.options(with_subject(Note)).order_by(Note.uploaded_at.desc()).limit(5).all()
+    recent_papers = QuestionPaper.query.options(with_subject(QuestionPaper)) \
+        .order_by(QuestionPaper.uploaded_at.desc()).limit(5).all()
+    return render_template('index.html', courses=courses, recent_notes=recent_notes, recent_papers=recent_papers,
+                           subject_counts=subject_counts_by_course())
 
 
-@app.route('/notes')
+@bp.route('/notes')
+@conditional
+@page_cache.cached
 def notes():
     tag_filter = request.args.get('tag')
-    courses = Course.query.all()
+    courses = Course.query.order_by(Course.id).all()
     tags = Tag.query.order_by(Tag.name).all()
     
     filtered_notes = None
     if tag_filter:
-        tag = Tag.query.filter_by(name=tag_filter).first()
-        if tag:
-            filtered_notes = tag.notes.order_by(Note.uploaded_at.desc()).all()
+        filtered_notes = paginate(Note.query.options(with_subject(Note)).join(Note.tags)
+                                  .filter(Tag.name == tag_filter), NOTE_KEYS, request.args.get('cursor'))
+        if wants_json():
+            return page_json(filtered_notes, note_json, tag=tag_filter)
     
     return render_template('notes.html', courses=courses, tags=tags, 
-                           current_tag=tag_filter, filtered_notes=filtered_notes)
+                           current_tag=tag_filter, filtered_notes=filtered_notes,
+                           subject_counts=subject_counts_by_course(), note_counts=note_counts_by_course())
 
 
-@app.route('/notes/course/<int:course_id>')
+@bp.route('/notes/course/<int:course_id>')
+@conditional
+@page_cache.cached
 def course_subjects(course_id):
     course = Course.query.get_or_404(course_id)
     subjects = Subject.query.filter_by(course_id=course_id).order_by(Subject.semester).all()
-    return render_template('course_subjects.html', course=course, subjects=subjects)
+    return render_template('course_subjects.html', course=course, subjects=subjects,
+                           note_counts=note_counts_by_subject(course_id))
 
 
-@app.route('/notes/subject/<int:subject_id>')
+@bp.route('/notes/subject/<int:subject_id>')
+@conditional
+@page_cache.cached
 def subject_notes(subject_id):
-    subject = Subject.query.get_or_404(subject_id)
-    notes = Note.query.filter_by(subject_id=subject_id).order_by(Note.uploaded_at.desc()).all()
+    subject = Subject.query.options(db.joinedload(Subject.course)).get_or_404(subject_id)
+    notes = paginate(Note.query.filter_by(subject_id=subject_id), NOTE_KEYS, request.args.get('cursor'))
+    if wants_json():
+        return page_json(notes, note_json, subject_id=subject_id)
     return render_template('subject_notes.html', subject=subject, notes=notes)
 
 
-@app.route('/question-papers')
+@bp.route('/question-papers')
+@conditional
+@page_cache.cached
 def question_papers():
-    semester_filter = request.args.get('semester', type=int)
-    year_filter = request.args.get('year', type=int)
-    tag_filter = request.args.get('tag')
-    
-    query = QuestionPaper.query
-    
-    if semester_filter:
-        query = query.filter_by(semester=semester_filter)
-    if year_filter:
-        query = query.filter_by(year=year_filter)
-    if tag_filter:
-        tag = Tag.query.filter_by(name=tag_filter).first()
-        if tag:
-            query = query.filter(QuestionPaper.tags.contains(tag))
-    
-    papers = query.order_by(QuestionPaper.year.desc(), QuestionPaper.semester).all()
-    
-    years = db.session.query(QuestionPaper.year).distinct().order_by(QuestionPaper.year.desc()).all()
-    years = [y[0] for y in years]
-    
-    semesters = db.session.query(QuestionPaper.semester).distinct().order_by(QuestionPaper.semester).all()
-    semesters = [s[0] for s in semesters]
-    
-    tags = Tag.query.order_by(Tag.name).all()
-    
-    return render_template('question_papers.html', papers=papers, years=years, semesters=semesters,
-                           current_semester=semester_filter, current_year=year_filter,
-                           tags=tags, current_tag=tag_filter)
-
-
-@app.route('/download/<filename>')
+    paper_facets = facets.paper_facets()
+    selected = {facet: request.args.getlist(facet) for facet in facets.FACETS if request.args.getlist(facet)}
+    query = facets.filter_papers(QuestionPaper.query.options(with_subject(QuestionPaper)), paper_facets, selected)
+    papers = paginate(query, PAPER_KEYS, request.args.get('cursor'))
+    if wants_json():
+        return page_json(papers, paper_json, facets={
+            facet: [{'value': o.value, 'label': o.label, 'count': o.count} for o in options]
+            for facet, options in paper_facets.items()
+        })
+    return render_template('question_papers.html', papers=papers, facets=paper_facets, selected=selected)
+
+
+def is_first_transfer(response):
+    if request.method != 'GET':
+        return False
+    if response.status_code == 200:
+        return True
+    # Resumed ranges are the tail of a download that was already counted.
+    return response.status_code == 206 and request.range is not None and request.range.ranges[0][0] == 0
+
+
+def send_upload(filename, download_name, kind, ref_id, size=None):
+    # Blobs are named after their SHA-256, which makes the name a strong validator.
+    etag = filename.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    as_attachment = not request.args.get('inline', type=int)
+    located = storage.locate(filename)
+    if located is None:
+        abort(404)
+    encoding = located[1]
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    if encoding is not None:
+        if not request.accept_encodings[encoding]:
+            return send_decompressed(filename, download_name, kind, ref_id, size, etag, as_attachment, mimetype)
+        # The stored compressed bytes go out as they are, with a validator of their own.
+        etag = f'{etag}-{encoding}'
+        filename += ENCODINGS[encoding]
+
+    if current_app.config.get('DOWNLOAD_OFFLOAD') == 'x-accel':
+        # nginx serves the bytes (and handles Range/ETag) from an internal location,
+        # passing on the Content-Encoding set here.
+        response = current_app.response_class()
+        response.headers['X-Accel-Redirect'] = f"{current_app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/')}/{filename}"
+        response.headers['Content-Type'] = mimetype
+        response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                             filename=download_name)
+        response.set_etag(etag)
+        if etag not in request.if_none_match and (request.range is None or request.range.ranges[0][0] == 0):
+            download_counter.increment(kind, ref_id)
+    else:
+        response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, mimetype=mimetype,
+                                       as_attachment=as_attachment, download_name=download_name, etag=etag,
+                                       max_age=current_app.config['DOWNLOAD_MAX_AGE'])
+        response.headers['Accept-Ranges'] = 'bytes'
+        if is_first_transfer(response):
+            download_counter.increment(kind, ref_id)
+    if encoding is not None:
+        response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def send_decompressed(filename, download_name, kind, ref_id, size, etag, as_attachment, mimetype):
+    # Decompressed as it is sent, a chunk at a time. Byte offsets into the
+    # decompressed file cannot be reached without reading up to them, so there are
+    # no Range requests here; clients that resume downloads accept gzip anyway.
+    response = current_app.response_class(storage.iter_content(filename), mimetype=mimetype, direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                         filename=download_name)
+    if size:
+        response.content_length = size
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['DOWNLOAD_MAX_AGE']
+    response.vary.add('Accept-Encoding')
+    response = response.make_conditional(request, accept_ranges=False)
+    if response.status_code == 200 and request.method == 'GET':
+        download_counter.increment(kind, ref_id)
+    return response
+
+
+@bp.route('/download/note/<int:note_id>')
+def download_note(note_id):
+    note = db.session.query(Note.filename, Note.original_filename, Note.file_size).filter_by(id=note_id).first()
+    if note is None:
+        abort(404)
+    return download_limiter.send(request.remote_addr, send_upload, note.filename, note.original_filename,
+                                 'note', note_id, note.file_size)
+
+
+@bp.route('/download/paper/<int:paper_id>')
+def download_paper(paper_id):
+    paper = db.session.query(QuestionPaper.filename, QuestionPaper.original_filename,
+                             QuestionPaper.file_size).filter_by(id=paper_id).first()
+    if paper is None:
+        abort(404)
+    return download_limiter.send(request.remote_addr, send_upload, paper.filename, paper.original_filename,
+                                 'paper', paper_id, paper.file_size)
+
+
+@bp.route('/download/<path:filename>')
 def download_file(filename):
-    note = Note.query.filter_by(filename=filename).first()
+    # Old links by stored filename; both lookups use the filename indexes.
+    note = db.session.query(Note.id).filter_by(filename=filename).first()
     if note:
-        note.download_count = (note.download_count or 0) + 1
-        db.session.commit()
-    else:
-        paper = QuestionPaper.query.filter_by(filename=filename).first()
-        if paper:
-            paper.download_count = (paper.download_count or 0) + 1
-            db.session.commit()
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+        return redirect(url_for('main.download_note', note_id=note.id, **request.args), 301)
+    paper = db.session.query(QuestionPaper.id).filter_by(filename=filename).first()
+    if paper:
+        return redirect(url_for('main.download_paper', paper_id=paper.id, **request.args), 301)
+    abort(404)
 
 
-@app.route('/search')
+@bp.route('/search')
+@conditional
 def search():
     query = request.args.get('q', '').strip()
     if len(query) < 2:
         flash('Please enter at least 2 characters to search', 'warning')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
-    search_term = f"%{query}%"
+    per_page = page_size()
+    state = decode_cursor(request.args.get('cursor')) or [None, None]
+    if len(state) != 2:
+        abort(400, 'Invalid cursor')
     
-    notes = Note.query.join(Subject).join(Course).filter(
-        db.or_(
-            Note.title.ilike(search_term),
-            Note.description.ilike(search_term),
-            Subject.name.ilike(search_term),
-            Course.name.ilike(search_term)
+    note_page = search_hits_page(search_index.search_notes, query, per_page, state[0])
+    paper_page = search_hits_page(search_index.search_papers, query, per_page, state[1])
+    if note_page is not None and paper_page is not None:
+        (note_hits, notes_after), (paper_hits, papers_after) = note_page, paper_page
+        notes = ordered_by_hits(Note, note_hits)
+        papers = ordered_by_hits(QuestionPaper, paper_hits)
+        highlights = {('note', h.id): h for h in note_hits}
+        highlights.update({('paper', h.id): h for h in paper_hits})
+    else:
+        search_term = f"%{query}%"
+        
+        notes_query = Note.query.join(Subject).join(Course) \
+            .options(db.contains_eager(Note.subject).contains_eager(Subject.course)).filter(
+            db.or_(
+                Note.title.ilike(search_term),
+                Note.description.ilike(search_term),
+                Subject.name.ilike(search_term),
+                Course.name.ilike(search_term)
+            )
         )
-    ).order_by(Note.uploaded_at.desc()).all()
-    
-    papers = QuestionPaper.query.join(Subject).join(Course).filter(
-        db.or_(
-            QuestionPaper.title.ilike(search_term),
-            Subject.name.ilike(search_term),
-            Course.name.ilike(search_term)
+        
+        papers_query = QuestionPaper.query.join(Subject).join(Course) \
+            .options(db.contains_eager(QuestionPaper.subject).contains_eager(Subject.course)).filter(
+            db.or_(
+                QuestionPaper.title.ilike(search_term),
+                Subject.name.ilike(search_term),
+                Course.name.ilike(search_term)
+            )
         )
-    ).order_by(QuestionPaper.uploaded_at.desc()).all()
+        
+        notes, notes_after = ilike_page(notes_query, NOTE_KEYS, per_page, state[0])
+        papers, papers_after = ilike_page(papers_query, PAPER_RECENT_KEYS, per_page, state[1])
+        highlights = {}
     
-    return render_template('search_results.html', query=query, notes=notes, papers=papers)
-
-
-@app.route('/login', methods=['GET', 'POST'])
+    next_cursor = None
+    if notes_after is not False or papers_after is not False:
+        next_cursor = encode_cursor([notes_after, papers_after])
+    
+    if wants_json():
+        return jsonify(query=query, notes=[note_json(n) for n in notes], papers=[paper_json(p) for p in papers],
+                       next_cursor=next_cursor, per_page=per_page)
+    return render_template('search_results.html', query=query, notes=notes, papers=papers,
+                           highlights=highlights, next_cursor=next_cursor)
+
+
+# A search cursor holds one position per result list: None before the first page,
+# False once the list is exhausted, otherwise where the next page starts.
+def search_hits_page(search_fn, query, per_page, after):
+    if after is False:
+        return [], False
+    if after is not None and not (isinstance(after, list) and len(after) == 2
+                                  and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in after)):
+        abort(400, 'Invalid cursor')
+    hits = search_fn(query, per_page + 1, tuple(after) if after else None)
+    if hits is None:
+        return None
+    if len(hits) > per_page:
+        last = hits[per_page - 1]
+        return hits[:per_page], [last.rank, last.id]
+    return hits, False
+
+
+def ilike_page(query, keys, per_page, after):
+    if after is False:
+        return [], False
+    if after is not None and not isinstance(after, str):
+        abort(400, 'Invalid cursor')
+    page = paginate(query, keys, after, per_page)
+    return page.items, page.next_cursor or False
+
+
+def ordered_by_hits(model, hits):
+    if not hits:
+        return []
+    rows = {row.id: row for row in model.query.options(with_subject(model))
+            .filter(model.id.in_([h.id for h in hits])).all()}
+    return [rows[h.id] for h in hits if h.id in rows]
+
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
     
     form = LoginForm()
     if form.validate_on_submit():
@@ -175,20 +409,20 @@ def login():
             login_user(admin)
             flash('Login successful!', 'success')
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('admin_dashboard'))
+            return redirect(next_page or url_for('main.admin_dashboard'))
         flash('Invalid username or password', 'danger')
     return render_template('login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin_dashboard():
     total_notes = Note.query.count()
@@ -206,14 +440,15 @@ def admin_dashboard():
                            recent_papers=recent_papers)
 
 
-@app.route('/admin/courses')
+@bp.route('/admin/courses')
 @login_required
+@conditional
 def admin_courses():
     courses = Course.query.all()
     return render_template('admin/courses.html', courses=courses)
 
 
-@app.route('/admin/courses/add', methods=['GET', 'POST'])
+@bp.route('/admin/courses/add', methods=['GET', 'POST'])
 @login_required
 def admin_add_course():
     form = CourseForm()
@@ -222,11 +457,11 @@ def admin_add_course():
         db.session.add(course)
         db.session.commit()
         flash('Course added successfully!', 'success')
-        return redirect(url_for('admin_courses'))
+        return redirect(url_for('main.admin_courses'))
     return render_template('admin/course_form.html', form=form, title='Add Course')
 
 
-@app.route('/admin/courses/edit/<int:course_id>', methods=['GET', 'POST'])
+@bp.route('/admin/courses/edit/<int:course_id>', methods=['GET', 'POST'])
 @login_required
 def admin_edit_course(course_id):
     course = Course.query.get_or_404(course_id)
@@ -234,35 +469,32 @@ def admin_edit_course(course_id):
     if form.validate_on_submit():
         course.name = form.name.data
         course.description = form.description.data
+        search_index.reindex_course(course)
         db.session.commit()
         flash('Course updated successfully!', 'success')
-        return redirect(url_for('admin_courses'))
+        return redirect(url_for('main.admin_courses'))
     return render_template('admin/course_form.html', form=form, title='Edit Course')
 
 
-@app.route('/admin/courses/delete/<int:course_id>', methods=['POST'])
+@bp.route('/admin/courses/delete/<int:course_id>', methods=['POST'])
 @login_required
 def admin_delete_course(course_id):
     course = Course.query.get_or_404(course_id)
-    for subject in course.subjects:
-        for note in subject.notes:
-            delete_file(note.filename)
-        for paper in subject.question_papers:
-            delete_file(paper.filename)
-    db.session.delete(course)
+    job = jobs.enqueue('delete_course', course_id=course.id)
     db.session.commit()
-    flash('Course deleted successfully!', 'success')
-    return redirect(url_for('admin_courses'))
+    flash(f'Deleting course {course.name} in the background.', 'info')
+    return redirect(url_for('main.admin_job', job_id=job.id))
 
 
-@app.route('/admin/subjects')
+@bp.route('/admin/subjects')
 @login_required
+@conditional
 def admin_subjects():
     subjects = Subject.query.join(Course).order_by(Course.name, Subject.semester).all()
     return render_template('admin/subjects.html', subjects=subjects)
 
 
-@app.route('/admin/subjects/add', methods=['GET', 'POST'])
+@bp.route('/admin/subjects/add', methods=['GET', 'POST'])
 @login_required
 def admin_add_subject():
     form = SubjectForm()
@@ -276,11 +508,11 @@ def admin_add_subject():
         db.session.add(subject)
         db.session.commit()
         flash('Subject added successfully!', 'success')
-        return redirect(url_for('admin_subjects'))
+        return redirect(url_for('main.admin_subjects'))
     return render_template('admin/subject_form.html', form=form, title='Add Subject')
 
 
-@app.route('/admin/subjects/edit/<int:subject_id>', methods=['GET', 'POST'])
+@bp.route('/admin/subjects/edit/<int:subject_id>', methods=['GET', 'POST'])
 @login_required
 def admin_edit_subject(subject_id):
     subject = Subject.query.get_or_404(subject_id)
@@ -290,34 +522,35 @@ def admin_edit_subject(subject_id):
         subject.name = form.name.data
         subject.course_id = form.course_id.data
         subject.semester = form.semester.data
+        db.session.flush()
+        search_index.reindex_subject(subject)
         db.session.commit()
         flash('Subject updated successfully!', 'success')
-        return redirect(url_for('admin_subjects'))
+        return redirect(url_for('main.admin_subjects'))
     return render_template('admin/subject_form.html', form=form, title='Edit Subject')
 
 
-@app.route('/admin/subjects/delete/<int:subject_id>', methods=['POST'])
+@bp.route('/admin/subjects/delete/<int:subject_id>', methods=['POST'])
 @login_required
 def admin_delete_subject(subject_id):
     subject = Subject.query.get_or_404(subject_id)
-    for note in subject.notes:
-        delete_file(note.filename)
-    for paper in subject.question_papers:
-        delete_file(paper.filename)
-    db.session.delete(subject)
+    job = jobs.enqueue('delete_subject', subject_id=subject.id)
     db.session.commit()
-    flash('Subject deleted successfully!', 'success')
-    return redirect(url_for('admin_subjects'))
+    flash(f'Deleting subject {subject.name} in the background.', 'info')
+    return redirect(url_for('main.admin_job', job_id=job.id))
 
 
-@app.route('/admin/notes')
+@bp.route('/admin/notes')
 @login_required
+@conditional
 def admin_notes():
-    notes = Note.query.join(Subject).order_by(Note.uploaded_at.desc()).all()
+    notes = paginate(Note.query.options(with_subject(Note)), NOTE_KEYS, request.args.get('cursor'))
+    if wants_json():
+        return page_json(notes, note_json)
     return render_template('admin/notes.html', notes=notes)
 
 
-@app.route('/admin/notes/add', methods=['GET', 'POST'])
+@bp.route('/admin/notes/add', methods=['GET', 'POST'])
 @login_required
 def admin_add_note():
     form = NoteForm()
@@ -326,7 +559,7 @@ def admin_add_note():
     form.tag_ids.choices = [(t.id, t.name) for t in Tag.query.order_by(Tag.name).all()]
     
     if form.validate_on_submit():
-        filename, original_filename, file_size = save_file(form.file.data)
+        filename, original_filename, file_size = save_form_file(form)
         if filename:
             note = Note(
                 title=form.title.data,
@@ -341,14 +574,17 @@ def admin_add_note():
                 if tag:
                     note.tags.append(tag)
             db.session.add(note)
+            db.session.flush()
+            search_index.index_note(note)
+            extraction.schedule_extraction('note', note.id)
             db.session.commit()
             flash('Note added successfully!', 'success')
-            return redirect(url_for('admin_notes'))
+            return redirect(url_for('main.admin_notes'))
         flash('Error uploading file', 'danger')
     return render_template('admin/note_form.html', form=form, title='Add Note')
 
 
-@app.route('/admin/notes/edit/<int:note_id>', methods=['GET', 'POST'])
+@bp.route('/admin/notes/edit/<int:note_id>', methods=['GET', 'POST'])
 @login_required
 def admin_edit_note(note_id):
     note = Note.query.get_or_404(note_id)
@@ -366,39 +602,50 @@ def admin_edit_note(note_id):
         note.subject_id = form.subject_id.data
         note.tags = [Tag.query.get(tid) for tid in form.tag_ids.data if Tag.query.get(tid)]
         
-        if form.file.data:
-            delete_file(note.filename)
-            filename, original_filename, file_size = save_file(form.file.data)
+        file_replaced = False
+        if form.file.data or form.upload_id.data:
+            filename, original_filename, file_size = save_form_file(form)
             if filename:
+                delete_file(note.filename)
                 note.filename = filename
                 note.original_filename = original_filename
                 note.file_size = file_size
+                file_replaced = True
         
+        db.session.flush()
+        search_index.index_note(note)
+        if file_replaced:
+            extraction.schedule_extraction('note', note.id)
         db.session.commit()
         flash('Note updated successfully!', 'success')
-        return redirect(url_for('admin_notes'))
+        return redirect(url_for('main.admin_notes'))
     return render_template('admin/note_form.html', form=form, title='Edit Note', note=note)
 
 
-@app.route('/admin/notes/delete/<int:note_id>', methods=['POST'])
+@bp.route('/admin/notes/delete/<int:note_id>', methods=['POST'])
 @login_required
 def admin_delete_note(note_id):
     note = Note.query.get_or_404(note_id)
     delete_file(note.filename)
+    search_index.remove_note(note.id)
     db.session.delete(note)
     db.session.commit()
     flash('Note deleted successfully!', 'success')
-    return redirect(url_for('admin_notes'))
+    return redirect(url_for('main.admin_notes'))
 
 
-@app.route('/admin/question-papers')
+@bp.route('/admin/question-papers')
 @login_required
+@conditional
 def admin_question_papers():
-    papers = QuestionPaper.query.join(Subject).order_by(QuestionPaper.uploaded_at.desc()).all()
+    papers = paginate(QuestionPaper.query.options(with_subject(QuestionPaper)), PAPER_RECENT_KEYS,
+                      request.args.get('cursor'))
+    if wants_json():
+        return page_json(papers, paper_json)
     return render_template('admin/question_papers.html', papers=papers)
 
 
-@app.route('/admin/question-papers/add', methods=['GET', 'POST'])
+@bp.route('/admin/question-papers/add', methods=['GET', 'POST'])
 @login_required
 def admin_add_question_paper():
     form = QuestionPaperForm()
@@ -407,7 +654,7 @@ def admin_add_question_paper():
     form.tag_ids.choices = [(t.id, t.name) for t in Tag.query.order_by(Tag.name).all()]
     
     if form.validate_on_submit():
-        filename, original_filename, file_size = save_file(form.file.data)
+        filename, original_filename, file_size = save_form_file(form)
         if filename:
             paper = QuestionPaper(
                 title=form.title.data,
@@ -424,14 +671,17 @@ def admin_add_question_paper():
                 if tag:
                     paper.tags.append(tag)
             db.session.add(paper)
+            db.session.flush()
+            search_index.index_paper(paper)
+            extraction.schedule_extraction('paper', paper.id)
             db.session.commit()
             flash('Question paper added successfully!', 'success')
-            return redirect(url_for('admin_question_papers'))
+            return redirect(url_for('main.admin_question_papers'))
         flash('Error uploading file', 'danger')
     return render_template('admin/question_paper_form.html', form=form, title='Add Question Paper')
 
 
-@app.route('/admin/question-papers/edit/<int:paper_id>', methods=['GET', 'POST'])
+@bp.route('/admin/question-papers/edit/<int:paper_id>', methods=['GET', 'POST'])
 @login_required
 def admin_edit_question_paper(paper_id):
     paper = QuestionPaper.query.get_or_404(paper_id)
@@ -451,61 +701,75 @@ def admin_edit_question_paper(paper_id):
         paper.subject_id = form.subject_id.data
         paper.tags = [Tag.query.get(tid) for tid in form.tag_ids.data if Tag.query.get(tid)]
         
-        if form.file.data:
-            delete_file(paper.filename)
-            filename, original_filename, file_size = save_file(form.file.data)
+        file_replaced = False
+        if form.file.data or form.upload_id.data:
+            filename, original_filename, file_size = save_form_file(form)
             if filename:
+                delete_file(paper.filename)
                 paper.filename = filename
                 paper.original_filename = original_filename
                 paper.file_size = file_size
+                file_replaced = True
         
+        db.session.flush()
+        search_index.index_paper(paper)
+        if file_replaced:
+            extraction.schedule_extraction('paper', paper.id)
         db.session.commit()
         flash('Question paper updated successfully!', 'success')
-        return redirect(url_for('admin_question_papers'))
+        return redirect(url_for('main.admin_question_papers'))
     return render_template('admin/question_paper_form.html', form=form, title='Edit Question Paper', paper=paper)
 
 
-@app.route('/admin/question-papers/delete/<int:paper_id>', methods=['POST'])
+@bp.route('/admin/question-papers/delete/<int:paper_id>', methods=['POST'])
 @login_required
 def admin_delete_question_paper(paper_id):
     paper = QuestionPaper.query.get_or_404(paper_id)
     delete_file(paper.filename)
+    search_index.remove_paper(paper.id)
     db.session.delete(paper)
     db.session.commit()
     flash('Question paper deleted successfully!', 'success')
-    return redirect(url_for('admin_question_papers'))
+    return redirect(url_for('main.admin_question_papers'))
 
 
-@app.route('/admin/analytics')
+@bp.route('/admin/analytics')
 @login_required
 def admin_analytics():
-    total_downloads = db.session.query(db.func.coalesce(db.func.sum(Note.download_count), 0)).scalar() + \
-                      db.session.query(db.func.coalesce(db.func.sum(QuestionPaper.download_count), 0)).scalar()
+    # Counts buffered by this worker go to the database first; other workers flush
+    # theirs within DOWNLOAD_FLUSH_INTERVAL seconds. Rolling up here only folds the
+    # events logged since the last rollup, so the page is current.
+    download_counter.flush()
+    analytics.roll_up()
     
-    top_notes = Note.query.order_by(Note.download_count.desc().nullslast()).limit(10).all()
-    top_papers = QuestionPaper.query.order_by(QuestionPaper.download_count.desc().nullslast()).limit(10).all()
+    window = request.args.get('window', '7d')
+    if window not in analytics.WINDOWS:
+        window = '7d'
+    trend = analytics.trend(window)
     
-    course_stats = db.session.query(
-        Course.name,
-        db.func.count(db.distinct(Subject.id)).label('subject_count'),
-        db.func.count(Note.id).label('note_count')
-    ).outerjoin(Subject).outerjoin(Note).group_by(Course.id).all()
-    
-    return render_template('admin/analytics.html', 
-                           total_downloads=total_downloads,
-                           top_notes=top_notes, 
-                           top_papers=top_papers,
-                           course_stats=course_stats)
-
-
-@app.route('/admin/tags')
+    return render_template('admin/analytics.html',
+                           window=window,
+                           windows=analytics.WINDOWS,
+                           total_downloads=analytics.total(),
+                           window_downloads=sum(point.downloads for point in trend),
+                           trend=trend,
+                           trend_max=max([point.downloads for point in trend] + [1]),
+                           top_notes=analytics.top('note', window),
+                           top_papers=analytics.top('paper', window),
+                           top_subjects=analytics.top('subject', window),
+                           top_courses=analytics.top('course', window),
+                           course_stats=analytics.course_stats())
+
+
+@bp.route('/admin/tags')
 @login_required
+@conditional
 def admin_tags():
     tags = Tag.query.order_by(Tag.name).all()
     return render_template('admin/tags.html', tags=tags)
 
 
-@app.route('/admin/tags/add', methods=['GET', 'POST'])
+@bp.route('/admin/tags/add', methods=['GET', 'POST'])
 @login_required
 def admin_add_tag():
     form = TagForm()
@@ -518,11 +782,11 @@ def admin_add_tag():
             db.session.add(tag)
             db.session.commit()
             flash('Tag added successfully!', 'success')
-            return redirect(url_for('admin_tags'))
+            return redirect(url_for('main.admin_tags'))
     return render_template('admin/tag_form.html', form=form, title='Add Tag')
 
 
-@app.route('/admin/tags/edit/<int:tag_id>', methods=['GET', 'POST'])
+@bp.route('/admin/tags/edit/<int:tag_id>', methods=['GET', 'POST'])
 @login_required
 def admin_edit_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
@@ -535,21 +799,21 @@ def admin_edit_tag(tag_id):
             tag.name = form.name.data.strip()
             db.session.commit()
             flash('Tag updated successfully!', 'success')
-            return redirect(url_for('admin_tags'))
+            return redirect(url_for('main.admin_tags'))
     return render_template('admin/tag_form.html', form=form, title='Edit Tag')
 
 
-@app.route('/admin/tags/delete/<int:tag_id>', methods=['POST'])
+@bp.route('/admin/tags/delete/<int:tag_id>', methods=['POST'])
 @login_required
 def admin_delete_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
     db.session.delete(tag)
     db.session.commit()
     flash('Tag deleted successfully!', 'success')
-    return redirect(url_for('admin_tags'))
+    return redirect(url_for('main.admin_tags'))
 
 
-@app.route('/admin/bulk-upload', methods=['GET', 'POST'])
+@bp.route('/admin/bulk-upload', methods=['GET', 'POST'])
 @login_required
 def admin_bulk_upload():
     subjects = Subject.query.join(Course).order_by(Course.name, Subject.name).all()
@@ -558,47 +822,147 @@ def admin_bulk_upload():
     if request.method == 'POST':
         resource_type = request.form.get('resource_type')
         subject_id = request.form.get('subject_id', type=int)
-        files = request.files.getlist('files')
+        files = [f for f in request.files.getlist('files') if f.filename]
+        upload_ids = request.form.getlist('upload_ids')
         
         if not subject_id:
             flash('Please select a subject', 'danger')
-            return redirect(url_for('admin_bulk_upload'))
+            return redirect(url_for('main.admin_bulk_upload'))
         
-        if not files or files[0].filename == '':
+        if not files and not upload_ids:
             flash('Please select at least one file', 'danger')
-            return redirect(url_for('admin_bulk_upload'))
+            return redirect(url_for('main.admin_bulk_upload'))
+        
+        if Subject.query.get(subject_id) is None:
+            abort(404)
         
-        success_count = 0
+        # The request only parks the files; storing and indexing them runs as a job.
+        skipped = [f.filename for f in files if not allowed_file(f.filename)]
         for file in files:
-            if file and allowed_file(file.filename):
-                filename, original_filename, file_size = save_file(file)
-                if filename:
-                    if resource_type == 'notes':
-                        title = original_filename.rsplit('.', 1)[0]
-                        note = Note(
-                            title=title,
-                            subject_id=subject_id,
-                            filename=filename,
-                            original_filename=original_filename,
-                            file_size=file_size
-                        )
-                        db.session.add(note)
-                    else:
-                        title = original_filename.rsplit('.', 1)[0]
-                        paper = QuestionPaper(
-                            title=title,
-                            year=2024,
-                            semester=1,
-                            subject_id=subject_id,
-                            filename=filename,
-                            original_filename=original_filename,
-                            file_size=file_size
-                        )
-                        db.session.add(paper)
-                    success_count += 1
+            if allowed_file(file.filename):
+                extension, original_filename = upload_names(file.filename)
+                upload_ids.append(storage.stash(file.stream, original_filename, extension).id)
+        if skipped:
+            flash(f"Skipped unsupported files: {', '.join(skipped)}", 'warning')
+        if not upload_ids:
+            return redirect(url_for('main.admin_bulk_upload'))
         
+        kind = 'note' if resource_type == 'notes' else 'paper'
+        job = jobs.enqueue('ingest', kind=kind, subject_id=subject_id, upload_ids=upload_ids)
         db.session.commit()
-        flash(f'Successfully uploaded {success_count} files!', 'success')
-        return redirect(url_for('admin_bulk_upload'))
+        if wants_json():
+            return jsonify(job_json(job)), 202
+        flash(f'Uploading {len(upload_ids)} files in the background.', 'info')
+        return redirect(url_for('main.admin_job', job_id=job.id))
     
     return render_template('admin/bulk_upload.html', subjects=subject_choices)
+
+
+def check_upload_csrf():
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            abort(400, 'Invalid CSRF token')
+
+
+def upload_json(upload, status=200):
+    return jsonify({
+        'upload_id': upload.id,
+        'offset': upload.offset,
+        'size': upload.size,
+        'complete': upload.offset == upload.size,
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE'],
+    }), status
+
+
+@bp.route('/admin/uploads', methods=['POST'])
+@login_required
+def admin_start_upload():
+    check_upload_csrf()
+    data = request.get_json(silent=True) or {}
+    name = str(data.get('filename', ''))
+    size = data.get('size')
+    if not allowed_file(name):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'Invalid size'}), 400
+    if size > current_app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'File too large'}), 413
+    extension, original_filename = upload_names(name)
+    return upload_json(storage.start_upload(original_filename, extension, size), 201)
+
+
+@bp.route('/admin/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+@login_required
+def admin_upload_chunk(upload_id):
+    try:
+        if request.method == 'GET':
+            return upload_json(storage.get_upload(upload_id))
+        check_upload_csrf()
+        if request.method == 'DELETE':
+            storage.cancel_upload(upload_id)
+            return '', 204
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'Missing Upload-Offset header'}), 400
+        return upload_json(storage.append_upload(upload_id, offset, request.stream))
+    except UploadNotFound:
+        abort(404)
+    except UploadError:
+        # The client lost track of what arrived; it resumes from the offset we report.
+        response, _ = upload_json(storage.get_upload(upload_id))
+        return response, 409
+
+
+@bp.app_errorhandler(413)
+def request_too_large(error):
+    limit = format_file_size(current_app.config['MAX_CONTENT_LENGTH'])
+    if request.path.startswith('/admin/uploads') or wants_json():
+        return jsonify({'error': f'File too large (max {limit})'}), 413
+    flash(f'File too large. The maximum upload size is {limit}.', 'danger')
+    return redirect(request.url)
+
+
+JOB_KEYS = ((Job.id, True),)
+
+
+def job_json(job):
+    data = job.to_dict()
+    data['percent'] = job.percent
+    data['result'] = json.loads(job.result) if job.result else None
+    data['url'] = url_for('main.admin_job', job_id=job.id)
+    return data
+
+
+@bp.route('/admin/jobs')
+@login_required
+def admin_jobs():
+    page = paginate(Job.query, JOB_KEYS, request.args.get('cursor'))
+    if wants_json():
+        return page_json(page, job_json)
+    return render_template('admin/jobs.html', jobs=page)
+
+
+@bp.route('/admin/jobs/<int:job_id>')
+@login_required
+def admin_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if wants_json():
+        return jsonify(job_json(job))
+    return render_template('admin/job.html', job=job, result=json.loads(job.result) if job.result else None)
+
+
+@bp.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+def admin_retry_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status == 'failed':
+        job.status = 'queued'
+        job.attempts = 0
+        job.run_at = datetime.utcnow()
+        job.finished_at = None
+        job.message = 'Retry requested'
+        db.session.commit()
+        jobs.embedded_worker.wake()
+    return redirect(url_for('main.admin_job', job_id=job.id))
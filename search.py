@@ -0,0 +1,273 @@
+import re
+from collections import namedtuple
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from app import db
+from models import Subject, Note, QuestionPaper, ExtractedText
+
+
+# Snippets come back from the database wrapped in these control characters so the
+# template can escape the text first and only then turn the markers into <mark> tags.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+SearchHit = namedtuple('SearchHit', ['id', 'rank', 'title', 'snippet'])
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Search columns in index order. Weights favour the title, then the subject and
+# course names, then free text, and last the text extracted from the file itself.
+NOTE_COLUMNS = ('title', 'description', 'subject', 'course', 'body')
+NOTE_WEIGHTS = (10.0, 2.0, 4.0, 3.0, 1.0)
+PAPER_COLUMNS = ('title', 'exam_type', 'subject', 'course', 'body')
+PAPER_WEIGHTS = (10.0, 1.0, 4.0, 3.0, 1.0)
+POSTGRES_WEIGHTS = 'ABBCD'
+
+INDEXES = {
+    'note': ('note_search', 'note_id', NOTE_COLUMNS, NOTE_WEIGHTS),
+    'paper': ('paper_search', 'paper_id', PAPER_COLUMNS, PAPER_WEIGHTS),
+}
+
+
+def dialect_name():
+    return db.engine.dialect.name
+
+
+def is_supported():
+    return dialect_name() in ('sqlite', 'postgresql')
+
+
+def _sqlite_columns(table):
+    return tuple(row[1] for row in db.session.execute(text(f"PRAGMA table_info({table})")))
+
+
+def init_search_index():
+    dialect = dialect_name()
+    stale = False
+    for table, key, columns, _ in INDEXES.values():
+        if dialect == 'sqlite':
+            existing = _sqlite_columns(table)
+            if existing and existing != columns:
+                db.session.execute(text(f"DROP TABLE {table}"))
+                stale = True
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{', '.join(columns)}, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            ))
+        elif dialect == 'postgresql':
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f"{key} INTEGER PRIMARY KEY, "
+                f"{', '.join(f'{c} TEXT' for c in columns)}, "
+                "document TSVECTOR NOT NULL)"
+            ))
+            for column in columns:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} TEXT"))
+            db.session.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_document ON {table} USING GIN (document)"
+            ))
+    db.session.commit()
+    if stale:
+        rebuild_search_index()
+
+
+def _body(filename, bodies=None):
+    if bodies is not None:
+        return bodies.get(filename, '')
+    record = ExtractedText.query.filter_by(filename=filename).first()
+    return record.text if record else ''
+
+
+def _note_values(note, bodies=None):
+    subject = Subject.query.get(note.subject_id)
+    return (note.title, note.description or '', subject.name, subject.course.name,
+            _body(note.filename, bodies))
+
+
+def _paper_values(paper, bodies=None):
+    subject = Subject.query.get(paper.subject_id)
+    return (paper.title, paper.exam_type or '', subject.name, subject.course.name,
+            _body(paper.filename, bodies))
+
+
+def _upsert_sql(kind):
+    table, key, columns, _ = INDEXES[kind]
+    values = ', '.join(':' + c for c in columns)
+    if dialect_name() == 'sqlite':
+        return text(f"INSERT OR REPLACE INTO {table} (rowid, {', '.join(columns)}) VALUES (:ref_id, {values})")
+    document = ' || '.join(
+        f"setweight(to_tsvector('simple', coalesce(:{c}, '')), '{w}')"
+        for c, w in zip(columns, POSTGRES_WEIGHTS)
+    )
+    return text(
+        f"INSERT INTO {table} ({key}, {', '.join(columns)}, document) "
+        f"VALUES (:ref_id, {values}, {document}) "
+        f"ON CONFLICT ({key}) DO UPDATE SET "
+        f"{', '.join(f'{c} = EXCLUDED.{c}' for c in columns)}, document = EXCLUDED.document"
+    )
+
+
+def _upsert(kind, rows):
+    columns = INDEXES[kind][2]
+    params = [dict(zip(columns, values), ref_id=ref_id) for ref_id, values in rows]
+    if params:
+        db.session.execute(_upsert_sql(kind), params)
+
+
+def _delete(kind, ref_id):
+    table, key, _, _ = INDEXES[kind]
+    dialect = dialect_name()
+    if dialect == 'sqlite':
+        db.session.execute(text(f"DELETE FROM {table} WHERE rowid = :ref_id"), {'ref_id': ref_id})
+    elif dialect == 'postgresql':
+        db.session.execute(text(f"DELETE FROM {table} WHERE {key} = :ref_id"), {'ref_id': ref_id})
+
+
+def index_note(note):
+    if is_supported():
+        _upsert('note', [(note.id, _note_values(note))])
+
+
+def index_paper(paper):
+    if is_supported():
+        _upsert('paper', [(paper.id, _paper_values(paper))])
+
+
+def _index_many(kind, rows):
+    if not is_supported() or not rows:
+        return
+    values = _note_values if kind == 'note' else _paper_values
+    records = ExtractedText.query.filter(ExtractedText.filename.in_({r.filename for r in rows})).all()
+    bodies = {r.filename: r.text for r in records}
+    _upsert(kind, [(row.id, values(row, bodies)) for row in rows])
+
+
+def index_notes(notes):
+    _index_many('note', notes)
+
+
+def index_papers(papers):
+    _index_many('paper', papers)
+
+
+def remove_note(note_id):
+    if is_supported():
+        _delete('note', note_id)
+
+
+def remove_paper(paper_id):
+    if is_supported():
+        _delete('paper', paper_id)
+
+
+def reindex_subject(subject):
+    for note in subject.notes:
+        index_note(note)
+    for paper in subject.question_papers:
+        index_paper(paper)
+
+
+def reindex_course(course):
+    for subject in course.subjects:
+        reindex_subject(subject)
+
+
+def remove_subject(subject):
+    for note in subject.notes:
+        remove_note(note.id)
+    for paper in subject.question_papers:
+        remove_paper(paper.id)
+
+
+def remove_course(course):
+    for subject in course.subjects:
+        remove_subject(subject)
+
+
+def rebuild_search_index(batch_size=1000):
+    if not is_supported():
+        return 0
+    for table, _, _, _ in INDEXES.values():
+        db.session.execute(text(f"DELETE FROM {table}"))
+    count = 0
+    for model, kind in ((Note, 'note'), (QuestionPaper, 'paper')):
+        last_id = 0
+        while True:
+            rows = (model.query.options(db.joinedload(model.subject).joinedload(Subject.course))
+                    .filter(model.id > last_id).order_by(model.id).limit(batch_size).all())
+            if not rows:
+                break
+            _index_many(kind, rows)
+            last_id = rows[-1].id
+            count += len(rows)
+        db.session.commit()
+    return count
+
+
+def _tokens(query):
+    return [t.lower() for t in TOKEN_RE.findall(query)]
+
+
+def _search(kind, query, limit, after=None):
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    table, key, columns, weights = INDEXES[kind]
+    dialect = dialect_name()
+    params = {'limit': limit}
+    # Results are ordered by (score, id); ``after`` is the last pair of the previous page.
+    if after is not None:
+        params['after_score'], params['after_id'] = after
+    if dialect == 'sqlite':
+        # Every token is quoted and prefix-matched; FTS5 ANDs adjacent terms.
+        params['match'] = ' '.join(f'"{t}"*' for t in tokens)
+        score = f"bm25({table}, {', '.join(map(str, weights))})"
+        seek = (f"AND ({score} > :after_score OR ({score} = :after_score AND rowid > :after_id)) "
+                if after is not None else '')
+        sql = (
+            f"SELECT rowid, {score} AS score, "
+            f"highlight({table}, 0, char(2), char(3)), "
+            f"snippet({table}, -1, char(2), char(3), '…', 16) "
+            f"FROM {table} WHERE {table} MATCH :match {seek}ORDER BY score, rowid LIMIT :limit"
+        )
+        rows = db.session.execute(text(sql), params)
+    elif dialect == 'postgresql':
+        params['match'] = ' & '.join(f'{t}:*' for t in tokens)
+        options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}'
+        score = "-ts_rank(document, q)"
+        seek = (f"AND ({score} > :after_score OR ({score} = :after_score AND {key} > :after_id)) "
+                if after is not None else '')
+        sql = (
+            f"SELECT {key}, {score} AS score, "
+            f"ts_headline('simple', title, q, :title_options), "
+            f"ts_headline('simple', concat_ws(' ', {', '.join(columns[1:])}), q, :options) "
+            f"FROM {table}, to_tsquery('simple', :match) AS q "
+            f"WHERE document @@ q {seek}ORDER BY score, {key} LIMIT :limit"
+        )
+        rows = db.session.execute(text(sql), {
+            **params,
+            'title_options': options + ', HighlightAll=true',
+            'options': options + ', MaxFragments=2, MaxWords=20, MinWords=8',
+        })
+    else:
+        return None
+    return [SearchHit(*row) for row in rows]
+
+
+def search_notes(query, limit=50, after=None):
+    return _search('note', query, limit, after)
+
+
+def search_papers(query, limit=50, after=None):
+    return _search('paper', query, limit, after)
+
+
+def highlight(value):
+    if not value:
+        return ''
+    return Markup(str(escape(value))
+                  .replace(HIGHLIGHT_START, '<mark>')
+                  .replace(HIGHLIGHT_END, '</mark>'))
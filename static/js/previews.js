@@ -0,0 +1,27 @@
+// Loads a file's first-page thumbnail and opening text the first time its
+// "Quick look" is opened, so students can check a file before downloading it.
+(function () {
+    'use strict';
+
+    var UNAVAILABLE = 'No preview available yet.';
+
+    // toggle does not bubble, so listen in the capture phase.
+    document.addEventListener('toggle', function (event) {
+        var details = event.target;
+        if (!details.classList || !details.classList.contains('file-preview') || !details.open
+                || details.dataset.loaded) {
+            return;
+        }
+        details.dataset.loaded = '1';
+        var thumb = details.querySelector('.file-preview-thumb');
+        if (thumb) {
+            thumb.onerror = function () { thumb.remove(); };
+            thumb.src = thumb.dataset.src;
+        }
+        var text = details.querySelector('.file-preview-text');
+        fetch(details.dataset.textUrl)
+            .then(function (response) { return response.ok ? response.text() : ''; })
+            .then(function (body) { text.textContent = body || UNAVAILABLE; })
+            .catch(function () { text.textContent = UNAVAILABLE; });
+    }, true);
+})();
@@ -0,0 +1,154 @@
+// Sends files larger than one chunk to /admin/uploads in pieces before the form is
+// submitted, so a dropped connection only costs the chunk that was in flight.
+// The upload id is kept in localStorage, which lets a reloaded page pick up where
+// the previous attempt stopped when the same file is selected again.
+(function () {
+    'use strict';
+
+    var STORAGE_PREFIX = 'resumable-upload:';
+    var MAX_RETRIES = 8;
+
+    function fileKey(file) {
+        return STORAGE_PREFIX + [file.name, file.size, file.lastModified].join(':');
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function call(form, method, url, body, headers) {
+        var response = await fetch(url, {
+            method: method,
+            credentials: 'same-origin',
+            headers: Object.assign({'Accept': 'application/json', 'X-CSRFToken': form.dataset.csrf}, headers || {}),
+            body: body
+        });
+        var data = await response.json().catch(function () { return {}; });
+        // 409 carries the offset the server actually has; the caller resumes from it.
+        if (!response.ok && response.status !== 409) {
+            var error = new Error(data.error || ('Upload failed (' + response.status + ')'));
+            error.fatal = response.status !== 408 && response.status < 500;
+            throw error;
+        }
+        return data;
+    }
+
+    async function openUpload(form, file) {
+        var base = form.dataset.uploadUrl;
+        var saved = localStorage.getItem(fileKey(file));
+        if (saved) {
+            try {
+                return await call(form, 'GET', base + '/' + saved);
+            } catch (e) {
+                localStorage.removeItem(fileKey(file));
+            }
+        }
+        var upload = await call(form, 'POST', base, JSON.stringify({filename: file.name, size: file.size}),
+                                {'Content-Type': 'application/json'});
+        localStorage.setItem(fileKey(file), upload.upload_id);
+        return upload;
+    }
+
+    async function sendFile(form, file, onProgress) {
+        var url = form.dataset.uploadUrl;
+        var upload = await openUpload(form, file);
+        var failures = 0;
+        while (!upload.complete) {
+            var end = Math.min(upload.offset + upload.chunk_size, file.size);
+            try {
+                upload = await call(form, 'PATCH', url + '/' + upload.upload_id, file.slice(upload.offset, end),
+                                    {'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': upload.offset});
+                failures = 0;
+            } catch (e) {
+                if (e.fatal || ++failures > MAX_RETRIES) {
+                    throw e;
+                }
+                await sleep(Math.min(30000, 500 * Math.pow(2, failures)));
+                upload = await call(form, 'GET', url + '/' + upload.upload_id);
+            }
+            onProgress(upload.offset / upload.size);
+        }
+        return upload.upload_id;
+    }
+
+    function addHidden(form, name, value) {
+        var input = form.querySelector('input[type=hidden][name="' + name + '"]');
+        if (!input || name === 'upload_ids') {
+            input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = name;
+            form.appendChild(input);
+        }
+        input.value = value;
+    }
+
+    function keepOnly(input, files) {
+        var transfer = new DataTransfer();
+        files.forEach(function (file) { transfer.items.add(file); });
+        input.files = transfer.files;
+    }
+
+    function showProgress(form, text, fraction) {
+        var box = form.querySelector('.upload-progress');
+        if (!box) {
+            return;
+        }
+        box.innerHTML = '<div class="small text-muted mb-1"></div>' +
+            '<div class="progress"><div class="progress-bar" role="progressbar"></div></div>';
+        box.querySelector('.small').textContent = text;
+        box.querySelector('.progress-bar').style.width = Math.round(fraction * 100) + '%';
+    }
+
+    function showError(form, message) {
+        var box = form.querySelector('.upload-progress');
+        if (box) {
+            box.innerHTML = '<div class="alert alert-danger mb-0"></div>';
+            box.firstChild.textContent = message + ' Submit again to resume.';
+        }
+    }
+
+    async function submitResumable(form, inputs, threshold) {
+        var buttons = form.querySelectorAll('[type=submit]');
+        var sent = [];
+        buttons.forEach(function (b) { b.disabled = true; });
+        form.querySelectorAll('input[name="upload_ids"]').forEach(function (el) { el.remove(); });
+        try {
+            for (var input of inputs) {
+                var files = Array.from(input.files);
+                var large = files.filter(function (f) { return f.size > threshold; });
+                for (var i = 0; i < large.length; i++) {
+                    var file = large[i];
+                    var label = 'Uploading ' + file.name + (large.length > 1 ? ' (' + (i + 1) + ' of ' + large.length + ')' : '');
+                    var uploadId = await sendFile(form, file, function (fraction) { showProgress(form, label, fraction); });
+                    addHidden(form, input.multiple ? 'upload_ids' : 'upload_id', uploadId);
+                    sent.push(file);
+                }
+                keepOnly(input, files.filter(function (f) { return f.size <= threshold; }));
+            }
+            // Finished uploads stay resumable until now, so a retry after a failure
+            // does not send them again; the server consumes them on submit.
+            sent.forEach(function (file) { localStorage.removeItem(fileKey(file)); });
+            showProgress(form, 'Saving…', 1);
+            form.submit();
+        } catch (e) {
+            showError(form, e.message);
+            buttons.forEach(function (b) { b.disabled = false; });
+        }
+    }
+
+    document.querySelectorAll('form[data-resumable-upload]').forEach(function (form) {
+        var threshold = parseInt(form.dataset.chunkThreshold, 10);
+        form.addEventListener('submit', function (event) {
+            if (!window.fetch || !window.DataTransfer) {
+                return;
+            }
+            var inputs = Array.from(form.querySelectorAll('input[type=file]')).filter(function (input) {
+                return Array.from(input.files).some(function (f) { return f.size > threshold; });
+            });
+            if (inputs.length) {
+                event.preventDefault();
+                submitResumable(form, inputs, threshold);
+            }
+        });
+    });
+})();
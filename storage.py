@@ -0,0 +1,633 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter, namedtuple, defaultdict
+from datetime import datetime
+from contextlib import contextmanager
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import FileWrapper
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from app import db
+from database import upsert
+from jobs import ACTIVE
+from models import Blob, Note, QuestionPaper, ExtractedText, Job
+
+CHUNK_SIZE = 1024 * 1024
+
+# Suffix of the file on disk for each storage encoding; the names double as the
+# HTTP content codings they are served with.
+ENCODINGS = {'gzip': '.gz', 'zstd': '.zst'}
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+StoredFile = namedtuple('StoredFile', ['filename', 'sha256', 'size', 'created'])
+PartialUpload = namedtuple('PartialUpload', ['id', 'original_filename', 'extension', 'size', 'offset'])
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadNotFound(UploadError):
+    pass
+
+
+class LocalStorage:
+    """Content-addressed files under UPLOAD_FOLDER.
+
+    A file is stored once per (content, extension) as ``ab/cd/<sha256>.<ext>``;
+    the ``blob`` table counts how many notes and papers point at it. With
+    STORAGE_COMPRESSION set, blobs that compress well are kept as
+    ``<sha256>.<ext>.gz`` (or ``.zst``) instead; the filename the rest of the app
+    uses stays the same, and `open`, `local_copy` and `iter_content` hand back the
+    original bytes.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.compression = None
+
+    def init_app(self, app):
+        self.root = app.config['UPLOAD_FOLDER']
+        self.partial_max_age = app.config.get('UPLOAD_PARTIAL_MAX_AGE', 86400)
+        self.compression = app.config.get('STORAGE_COMPRESSION')
+        self.compression_level = app.config.get('STORAGE_COMPRESSION_LEVEL')
+        self.compression_min_saving = app.config.get('STORAGE_COMPRESSION_MIN_SAVING', 0.1)
+        if self.compression is not None and self.compression not in ENCODINGS:
+            raise ValueError(f'Unknown STORAGE_COMPRESSION {self.compression!r}')
+
+    @property
+    def tmp_dir(self):
+        return os.path.join(self.root, '.tmp')
+
+    @property
+    def partial_dir(self):
+        return os.path.join(self.root, '.partial')
+
+    @staticmethod
+    def blob_filename(sha256, extension):
+        return f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}'
+
+    def path(self, filename):
+        return os.path.join(self.root, *filename.split('/'))
+
+    def locate(self, filename):
+        """Return ``(path, encoding)`` of the file on disk, or None if it is not stored.
+
+        ``encoding`` is None for a plain file, otherwise a key of ENCODINGS.
+        """
+        path = self.path(filename)
+        if os.path.isfile(path):
+            return path, None
+        for encoding, suffix in ENCODINGS.items():
+            if os.path.isfile(path + suffix):
+                return path + suffix, encoding
+        return None
+
+    def exists(self, filename):
+        return self.locate(filename) is not None
+
+    def open(self, filename):
+        """Open a stored file for reading its original bytes, decompressing as it is read."""
+        located = self.locate(filename)
+        if located is None:
+            raise FileNotFoundError(filename)
+        path, encoding = located
+        if encoding == 'gzip':
+            return gzip.open(path, 'rb')
+        if encoding == 'zstd':
+            return _zstd().ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return open(path, 'rb')
+
+    def iter_content(self, filename, chunk_size=64 * 1024):
+        """A WSGI response body with the original bytes of ``filename``.
+
+        Werkzeug's own FileWrapper rather than the server's: gunicorn would sendfile()
+        the descriptor underneath, which holds the compressed bytes.
+        """
+        return FileWrapper(self.open(filename), chunk_size)
+
+    @contextmanager
+    def local_copy(self, filename):
+        """Yield a path to the original bytes of ``filename``, for code that needs a
+        real file: the stored path itself, or a decompressed temporary copy."""
+        located = self.locate(filename)
+        if located is None:
+            raise FileNotFoundError(filename)
+        if located[1] is None:
+            yield located[0]
+            return
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        # Keep the extension, which is what the text extractors go by.
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix='.' + filename.rsplit('.', 1)[-1])
+        try:
+            with os.fdopen(fd, 'wb') as out, self.open(filename) as src:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            yield tmp_path
+        finally:
+            os.remove(tmp_path)
+
+    def hash(self, filename):
+        """SHA-256 of the original bytes of ``filename``."""
+        digest = hashlib.sha256()
+        with self.open(filename) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def compress(self, filename, encoding=None, dry_run=False):
+        """Replace a plain stored file with a compressed copy, if that saves at least
+        STORAGE_COMPRESSION_MIN_SAVING of its size.
+
+        Returns the number of bytes the file takes on disk afterwards (or would, with
+        ``dry_run``). Files that are already compressed are left as they are, and so
+        are flat legacy uploads, which `flask dedupe-uploads` expects to find as
+        plain files.
+        """
+        encoding = encoding or self.compression
+        located = self.locate(filename)
+        if located is None:
+            raise FileNotFoundError(filename)
+        path, current = located
+        size = os.path.getsize(path)
+        if current is not None or encoding is None or '/' not in filename:
+            return size
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as raw:
+                with _compressed_writer(encoding, raw, self.compression_level) as out:
+                    shutil.copyfileobj(src, out, CHUNK_SIZE)
+            stored_size = os.path.getsize(tmp_path)
+            if stored_size > size * (1 - self.compression_min_saving):
+                return size
+            if not dry_run:
+                # Both copies exist for a moment; locate() prefers the plain one until
+                # it is gone, and readers that already opened it keep reading it.
+                os.replace(tmp_path, path + ENCODINGS[encoding])
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return stored_size
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def write(self, stream, extension):
+        """Copy ``stream`` into the store, hashing it on the way, and return a StoredFile."""
+        digest = hashlib.sha256()
+        size = 0
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            return self._commit_tmp(tmp_path, digest.hexdigest(), size, extension)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit_tmp(self, tmp_path, sha256, size, extension):
+        filename = self.blob_filename(sha256, extension)
+        path = self.path(filename)
+        if self.exists(filename):
+            return StoredFile(filename, sha256, size, False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return StoredFile(filename, sha256, size, True)
+
+    # Resumable uploads: the client creates an upload, sends the file in chunks at
+    # increasing offsets (asking for the current offset after a dropped connection)
+    # and then submits the upload id with the form instead of the file itself.
+
+    def _partial_paths(self, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise UploadNotFound(upload_id)
+        base = os.path.join(self.partial_dir, upload_id)
+        return base + '.json', base + '.part'
+
+    def start_upload(self, original_filename, extension, size):
+        self.expire_uploads()
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._partial_paths(upload_id)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w') as f:
+            json.dump({'original_filename': original_filename, 'extension': extension, 'size': size}, f)
+        return self.get_upload(upload_id)
+
+    def stash(self, stream, original_filename, extension):
+        """Save a whole file as a finished resumable upload, for a job to pick up later."""
+        upload = self.start_upload(original_filename, extension, 0)
+        meta_path, part_path = self._partial_paths(upload.id)
+        with open(part_path, 'wb') as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                out.write(chunk)
+        with open(meta_path, 'w') as f:
+            json.dump({'original_filename': original_filename, 'extension': extension,
+                       'size': os.path.getsize(part_path)}, f)
+        return self.get_upload(upload.id)
+
+    def get_upload(self, upload_id):
+        meta_path, part_path = self._partial_paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(part_path)
+        except OSError:
+            raise UploadNotFound(upload_id)
+        return PartialUpload(upload_id, meta['original_filename'], meta['extension'], meta['size'], offset)
+
+    def append_upload(self, upload_id, offset, stream):
+        upload = self.get_upload(upload_id)
+        if offset != upload.offset:
+            raise UploadError(f'Expected offset {upload.offset}')
+        _, part_path = self._partial_paths(upload_id)
+        remaining = upload.size - offset
+        with open(part_path, 'ab') as out:
+            while remaining > 0:
+                chunk = stream.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                out.write(chunk)
+                remaining -= len(chunk)
+        return self.get_upload(upload_id)
+
+    def finish_upload(self, upload_id, keep=False):
+        """Move a fully received upload into the store and return (PartialUpload, StoredFile).
+
+        With ``keep`` the upload is copied instead and stays until `cancel_upload`,
+        so it can be finished again if the rows for it are rolled back.
+        """
+        upload = self.get_upload(upload_id)
+        if upload.offset != upload.size:
+            raise UploadError('Upload is incomplete')
+        meta_path, part_path = self._partial_paths(upload_id)
+        if keep:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+            try:
+                with open(part_path, 'rb') as src, os.fdopen(fd, 'wb') as out:
+                    shutil.copyfileobj(src, out, CHUNK_SIZE)
+                return upload, self._commit_tmp(tmp_path, _hash_file(tmp_path), upload.size, upload.extension)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        try:
+            stored = self._commit_tmp(part_path, _hash_file(part_path), upload.size, upload.extension)
+        finally:
+            for path in (meta_path, part_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return upload, stored
+
+    def cancel_upload(self, upload_id):
+        for path in self._partial_paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def expire_uploads(self):
+        """Remove uploads older than UPLOAD_PARTIAL_MAX_AGE, except those a queued
+        or running ingest job still has to store, however long it has waited."""
+        cutoff = time.time() - self.partial_max_age
+        if not os.path.isdir(self.partial_dir):
+            return
+        expired = [entry.name[:-len('.part')] for entry in os.scandir(self.partial_dir)
+                   if entry.name.endswith('.part') and entry.stat().st_mtime < cutoff]
+        if expired:
+            owned = _job_uploads()
+            for upload_id in expired:
+                if upload_id not in owned:
+                    self.cancel_upload(upload_id)
+
+    def remove(self, filename):
+        path = self.path(filename)
+        for suffix in ('', *ENCODINGS.values()):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def save(self, stream, extension):
+        return self.acquire(self.write(stream, extension.lower()))
+
+    def save_upload(self, upload_id):
+        upload, stored = self.finish_upload(upload_id)
+        return upload, self.acquire(stored)
+
+    def acquire(self, stored):
+        return self.acquire_many([stored])[stored.filename]
+
+    def acquire_many(self, stored_files):
+        """Add one reference per entry in ``stored_files`` and return them by filename.
+
+        Counts are added in SQL (creating the blob row if there is none), so
+        concurrent uploads of the same content cannot lose a reference.
+        """
+        self.track_created(stored_files)
+        stored = {s.filename: s for s in stored_files}
+        counts = Counter(s.filename for s in stored_files)
+        connection = db.session.connection()
+        _lock_blobs(connection, counts)
+        now = datetime.utcnow()
+        upsert(connection, Blob, [{'filename': filename, 'sha256': stored[filename].sha256,
+                                   'size': stored[filename].size, 'ref_count': n, 'created_at': now}
+                                  for filename, n in sorted(counts.items())], ['filename'], 'ref_count')
+        # A file that was already there may have been unlinked after its last
+        # reference went, between writing and claiming it; it cannot be claimed now.
+        missing = [filename for filename in counts if not self.exists(filename)]
+        if missing:
+            raise UploadError(f"Stored file {missing[0]} was removed while saving; upload it again")
+        return stored
+
+    def track_created(self, stored_files):
+        # Newly written files are removed again if the transaction rolls back.
+        _pending(db.session, 'storage_created').update(s.filename for s in stored_files if s.created)
+
+    def release(self, filename):
+        remaining = db.session.execute(
+            update(Blob).where(Blob.filename == filename).values(ref_count=Blob.ref_count - 1)
+            .returning(Blob.ref_count)
+        ).scalar()
+        if remaining is None or remaining <= 0:
+            self._drop(filename)
+
+    def _drop(self, filename, blob=None):
+        if blob is not None:
+            db.session.delete(blob)
+        else:
+            # Only if nothing claimed it again since it was counted down.
+            db.session.execute(delete(Blob).where(Blob.filename == filename, Blob.ref_count <= 0))
+        ExtractedText.query.filter_by(filename=filename).delete()
+        _pending(db.session, 'storage_released').add(filename)
+
+
+storage = LocalStorage()
+
+
+def upload_names(filename):
+    """Return the lowercased extension and a filesystem-safe display name for an upload."""
+    extension = filename.rsplit('.', 1)[1].lower()
+    # secure_filename drops non-ASCII names entirely, so keep at least the extension.
+    original_filename = secure_filename(filename)
+    if not original_filename.lower().endswith('.' + extension):
+        original_filename = f"{original_filename or 'file'}.{extension}"
+    return extension, original_filename
+
+
+def _job_uploads():
+    """Ids of the stashed uploads that queued or running ingest jobs refer to."""
+    owned = set()
+    for (payload,) in db.session.query(Job.payload).filter(Job.kind == 'ingest', Job.status.in_(ACTIVE)):
+        owned.update(json.loads(payload).get('upload_ids', ()))
+    return owned
+
+
+def _pending(session, key):
+    return session.info.setdefault(key, set())
+
+
+def _lock_blobs(connection, filenames):
+    """Serialize claiming blob files with unlinking them, until the transaction ends.
+
+    PostgreSQL takes an advisory lock per file. SQLite needs nothing more: both
+    sides write to the blob table first, and SQLite has one writer at a time.
+    """
+    if connection.dialect.name == 'postgresql':
+        for filename in sorted(filenames):
+            connection.execute(select(func.pg_advisory_xact_lock(func.hashtext(filename))))
+
+
+def _remove_unreferenced(filenames):
+    """Unlink the files among ``filenames`` that no blob row refers to.
+
+    The check and the unlink happen in one transaction holding the locks
+    `acquire_many` takes, so a concurrent upload either claims the file first
+    and keeps it, or finds it gone and fails instead of referencing nothing.
+    """
+    with db.engine.begin() as connection:
+        _lock_blobs(connection, filenames)
+        connection.execute(delete(Blob).where(Blob.filename.in_(filenames), Blob.ref_count <= 0))
+        referenced = set(connection.execute(
+            select(Blob.filename).where(Blob.filename.in_(filenames))
+        ).scalars())
+        for filename in filenames:
+            if filename not in referenced:
+                storage.remove(filename)
+
+
+# Files are only unlinked once the transaction that dropped their last reference has
+# committed, and files written for a transaction that rolled back (or that ended up
+# unused) are cleaned up. Both re-check the blob table, since the same content may
+# have been claimed again in the meantime.
+@event.listens_for(Session, 'after_commit')
+def _remove_released_files(session):
+    filenames = session.info.pop('storage_released', set()) | session.info.pop('storage_created', set())
+    if filenames and storage.root:
+        _remove_unreferenced(sorted(filenames))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _remove_orphaned_files(session):
+    session.info.pop('storage_released', None)
+    created = session.info.pop('storage_created', None)
+    if created and storage.root:
+        _remove_unreferenced(sorted(created))
+
+
+def _zstd():
+    if zstandard is None:
+        raise RuntimeError('zstandard is not installed')
+    return zstandard
+
+
+def _compressed_writer(encoding, out, level=None):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical content.
+        return gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level or 6, mtime=0)
+    return _zstd().ZstdCompressor(level=level or 3).stream_writer(out, closefd=False)
+
+
+def compression_report(encoding=None, dry_run=False, progress=None):
+    """Compress every stored blob that is worth it and total the disk use per extension.
+
+    Returns ``{extension: {'files', 'compressed', 'size', 'stored'}}`` where ``size``
+    is the original bytes and ``stored`` what they take on disk afterwards (or would,
+    with ``dry_run``, in which case nothing is written).
+    """
+    report = defaultdict(lambda: {'files': 0, 'compressed': 0, 'size': 0, 'stored': 0})
+    blobs = db.session.query(Blob.filename, Blob.size).order_by(Blob.filename).all()
+    for i, (filename, size) in enumerate(blobs, 1):
+        try:
+            stored = storage.compress(filename, encoding, dry_run=dry_run)
+        except FileNotFoundError:
+            continue
+        entry = report[filename.rsplit('.', 1)[-1]]
+        entry['files'] += 1
+        entry['size'] += size
+        entry['stored'] += stored
+        if stored < size:
+            entry['compressed'] += 1
+        if progress is not None:
+            progress(i, len(blobs))
+    return dict(report)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _place(path, target):
+    """Put a copy of ``path`` at ``target``, leaving ``path`` where it is."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+    try:
+        # A hard link costs no copying when both are on the same filesystem.
+        os.link(path, tmp)
+    except OSError:
+        shutil.copyfile(path, tmp)
+    os.replace(tmp, target)
+
+
+def _stray_blobs():
+    """Blob-layout files no blob row knows about, by (extension, size), for files an
+    interrupted migration moved before it could record them."""
+    known = {f for (f,) in db.session.query(Blob.filename)}
+    strays = defaultdict(list)
+    for directory, dirs, files in os.walk(storage.root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            filename = os.path.relpath(os.path.join(directory, name), storage.root).replace(os.sep, '/')
+            if filename.count('/') != 2 or filename in known or name.endswith(tuple(ENCODINGS.values())):
+                continue
+            sha256, _, extension = name.partition('.')
+            strays[(extension, os.path.getsize(os.path.join(directory, name)))].append((filename, sha256))
+    return strays
+
+
+def _recover_moved(legacy, rows, strays):
+    """The blob an earlier, interrupted run moved ``legacy`` to, if exactly one
+    unrecorded file of that extension and size exists and its content still
+    matches the hash in its name."""
+    sizes = {row.file_size for row in rows}
+    if len(sizes) != 1 or None in sizes:
+        return None
+    candidates = strays.get((legacy.rsplit('.', 1)[-1].lower(), sizes.pop()), [])
+    if len(candidates) != 1:
+        return None
+    filename, sha256 = candidates[0]
+    if _hash_file(storage.path(filename)) != sha256:
+        return None
+    return filename, sha256
+
+
+def _repoint(legacy, rows, filename, sha256, size):
+    for row in rows:
+        row.filename = filename
+    text = ExtractedText.query.filter_by(filename=legacy).first()
+    if text is not None:
+        if ExtractedText.query.filter_by(filename=filename).first() is None:
+            text.filename = filename
+        else:
+            db.session.delete(text)
+    upsert(db.session.connection(), Blob, [{'filename': filename, 'sha256': sha256, 'size': size,
+                                            'ref_count': len(rows), 'created_at': datetime.utcnow()}],
+           ['filename'], 'ref_count')
+
+
+def migrate_legacy_uploads(dry_run=False, delete_orphans=False):
+    """Move flat ``<uuid>.<ext>`` uploads into the content-addressed layout.
+
+    Identical files collapse into one blob, rows are repointed, and blob reference
+    counts are recomputed from the notes and papers tables. Each file is placed
+    in the new layout, its rows are repointed and committed, and only then is the
+    legacy file removed, so an interrupted run loses nothing and can be rerun.
+    Rows whose legacy file an older, interrupted run had already moved are
+    matched to the moved blob.
+    """
+    report = {'files': 0, 'duplicates': 0, 'bytes_reclaimed': 0, 'missing': [], 'orphans': []}
+    references = defaultdict(list)
+    seen = set()
+    strays = None
+    for model in (Note, QuestionPaper):
+        for row in model.query.filter(~model.filename.contains('/')).all():
+            references[row.filename].append(row)
+
+    for legacy, rows in sorted(references.items()):
+        path = storage.path(legacy)
+        if not os.path.isfile(path):
+            if strays is None:
+                strays = _stray_blobs()
+            recovered = _recover_moved(legacy, rows, strays)
+            if recovered is None:
+                report['missing'].append(legacy)
+                continue
+            filename, sha256 = recovered
+            report['files'] += 1
+            if not dry_run:
+                _repoint(legacy, rows, filename, sha256, os.path.getsize(storage.path(filename)))
+                db.session.commit()
+            continue
+        report['files'] += 1
+        size = os.path.getsize(path)
+        sha256 = _hash_file(path)
+        filename = storage.blob_filename(sha256, legacy.rsplit('.', 1)[-1].lower())
+        if filename in seen or storage.exists(filename):
+            report['duplicates'] += 1
+            report['bytes_reclaimed'] += size
+        elif not dry_run:
+            _place(path, storage.path(filename))
+        seen.add(filename)
+        if dry_run:
+            continue
+        _repoint(legacy, rows, filename, sha256, size)
+        db.session.commit()
+        os.remove(path)
+
+    referenced = {f for f in references} | {f for (f,) in db.session.query(Blob.filename)}
+    for entry in os.scandir(storage.root):
+        if entry.is_file() and entry.name not in referenced:
+            report['orphans'].append(entry.name)
+            if delete_orphans:
+                report['bytes_reclaimed'] += entry.stat().st_size
+                if not dry_run:
+                    os.remove(entry.path)
+
+    if not dry_run:
+        recount_references()
+        db.session.commit()
+    return report
+
+
+def recount_references():
+    counts = defaultdict(int)
+    for model in (Note, QuestionPaper):
+        for filename, count in db.session.query(model.filename, db.func.count(model.id)).group_by(model.filename):
+            counts[filename] += count
+    for blob in Blob.query.all():
+        blob.ref_count = counts.get(blob.filename, 0)
+        if blob.ref_count == 0:
+            storage._drop(blob.filename, blob)
@@ -0,0 +1,112 @@
+"""Handlers for background jobs; see jobs.py for the queue itself.
+
+Jobs can be retried after a partial run, so every handler has to be safe to
+run again from the start.
+"""
+import extraction
+import search
+from app import db
+from ingest import ingest
+from jobs import task
+from models import Course, Subject, Note, QuestionPaper
+from previews import previews
+from storage import storage, UploadNotFound
+
+DELETE_BATCH_SIZE = 200
+
+
+@task('extract_text')
+def extract_text(ctx, kind, ref_ids):
+    ctx.progress(0, len(ref_ids))
+    extracted = failed = 0
+    for i, ref_id in enumerate(ref_ids, 1):
+        record = extraction.extract_and_index(kind, ref_id)
+        if record is not None and record.error:
+            failed += 1
+        elif record is not None:
+            extracted += 1
+        if record is not None:
+            previews.generate(record.filename)
+            # Compressed last, once extraction and previews have read the plain file.
+            if storage.compression:
+                storage.compress(record.filename)
+        ctx.progress(i)
+    previews.evict()
+    return {'extracted': extracted, 'no_text': failed}
+
+
+@task('generate_previews')
+def generate_previews(ctx, filenames):
+    ctx.progress(0, len(filenames))
+    written = 0
+    for i, filename in enumerate(filenames, 1):
+        written += previews.generate(filename)
+        ctx.progress(i)
+    return {'written': written, 'evicted': previews.evict()}
+
+
+@task('ingest')
+def ingest_files(ctx, kind, subject_id, upload_ids):
+    # A failed batch raises, and run_job retries it with the stashed uploads still
+    # there; they are only removed once everything else has succeeded.
+    ctx.progress(0, len(upload_ids), 'Storing files')
+    results = ingest(kind, subject_id, upload_ids=upload_ids, progress=ctx.progress, discard_uploads=False)
+    results = [r._asdict() for r in results]
+    for upload_id in upload_ids:
+        try:
+            storage.cancel_upload(upload_id)
+        except UploadNotFound:
+            pass
+    return results
+
+
+def _delete_subject_contents(ctx, subject_id, done):
+    for model, remove in ((Note, search.remove_note), (QuestionPaper, search.remove_paper)):
+        while True:
+            rows = model.query.filter_by(subject_id=subject_id).order_by(model.id).limit(DELETE_BATCH_SIZE).all()
+            if not rows:
+                break
+            for row in rows:
+                storage.release(row.filename)
+                remove(row.id)
+                db.session.delete(row)
+            db.session.commit()
+            done += len(rows)
+            ctx.progress(done)
+    return done
+
+
+def _resource_count(subject_ids):
+    return (Note.query.filter(Note.subject_id.in_(subject_ids)).count()
+            + QuestionPaper.query.filter(QuestionPaper.subject_id.in_(subject_ids)).count())
+
+
+@task('delete_subject')
+def delete_subject(ctx, subject_id):
+    subject = Subject.query.get(subject_id)
+    if subject is None:
+        return {'deleted': 0}
+    total = _resource_count([subject_id])
+    ctx.progress(0, total, f'Deleting subject {subject.name}')
+    done = _delete_subject_contents(ctx, subject_id, 0)
+    db.session.delete(Subject.query.get(subject_id))
+    db.session.commit()
+    return {'deleted': done}
+
+
+@task('delete_course')
+def delete_course(ctx, course_id):
+    course = Course.query.get(course_id)
+    if course is None:
+        return {'deleted': 0}
+    subject_ids = [s.id for s in course.subjects]
+    total = _resource_count(subject_ids)
+    ctx.progress(0, total, f'Deleting course {course.name}')
+    done = 0
+    for subject_id in subject_ids:
+        done = _delete_subject_contents(ctx, subject_id, done)
+        db.session.delete(Subject.query.get(subject_id))
+        db.session.commit()
+    db.session.delete(Course.query.get(course_id))
+    db.session.commit()
+    return {'deleted': done}
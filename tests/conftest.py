@@ -0,0 +1,54 @@
+import pytest
+
+import search
+from app import create_app, db
+from models import Course, Subject, Note, QuestionPaper, Tag
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    """An app on a throwaway SQLite database with the schema and search index, but no rows."""
+    tmp = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv('FLASK_SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp / 'archive.db'}")
+        env.setenv('FLASK_UPLOAD_FOLDER', str(tmp / 'uploads'))
+        env.setenv('SESSION_SECRET', 'test')
+        # Only count the page's own queries, not those of a background job thread.
+        env.setenv('FLASK_JOB_WORKER', 'external')
+        # Measure rendering itself rather than cache hits or conditional GETs.
+        env.setenv('FLASK_PAGE_CACHE', 'null')
+        env.setenv('FLASK_ETAG_WINDOW', '0')
+        app = create_app()
+    with app.app_context():
+        db.create_all()
+        search.init_search_index()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def seed(app):
+    return seed_archive
+
+
+def seed_archive(scale):
+    """Add ``scale`` courses of ``scale`` subjects, each with ``scale`` notes and papers."""
+    tags = Tag.query.order_by(Tag.id).all() or [Tag(name=f'tag{i}') for i in range(3)]
+    offset = Course.query.count()
+    for c in range(offset, offset + scale):
+        course = Course(name=f'Course {c}', description='Synthetic course')
+        db.session.add(course)
+        for s in range(scale):
+            subject = Subject(name=f'Subject {s} topic', course=course, semester=s % 8 + 1)
+            db.session.add(subject)
+            for n in range(scale):
+                db.session.add(Note(title=f'Note {n} topic', description='topic notes', subject=subject,
+                                    filename=f'{c}-{s}-{n}.pdf', original_filename='note.pdf',
+                                    file_size=1024, tags=tags[:1 + n % 3]))
+                db.session.add(QuestionPaper(title=f'Paper {n} topic', year=2020 + n % 3, semester=n % 2 + 1,
+                                             exam_type='endterm', subject=subject,
+                                             filename=f'{c}-{s}-{n}-p.pdf', original_filename='paper.pdf',
+                                             file_size=2048, tags=tags[:1 + n % 3]))
+    db.session.commit()
+    search.rebuild_search_index()
@@ -0,0 +1,54 @@
+import pytest
+from flask import g
+
+from app import db
+from querycount import count_queries
+
+# Maximum number of SQL statements each public page may issue. The same page is
+# rendered against a small and a larger archive; the count must not grow with
+# the data, so any lazy load inside a loop fails the check.
+PAGE_BUDGETS = {
+    '/': 4,
+    '/notes': 4,
+    '/notes?tag=tag0': 5,
+    '/notes/course/1': 3,
+    '/notes/subject/1': 2,
+    '/question-papers': 2,
+    '/question-papers?year=2020&semester=1&tag=tag0': 2,
+    '/question-papers?year=2020&year=2021&exam_type=endterm&tag=tag0&tag=tag1': 2,
+    '/search?q=topic': 4,
+    '/api/v1/courses': 2,
+    '/api/v1/notes?cursor=WzFd': 2,
+    '/api/v1/notes?updated_since=2000-01-01': 2,
+    '/api/v1/papers?ids=1,2,3&fields=title,tag_ids': 3,
+    '/api/v1/subjects/2?fields=name': 2,
+}
+
+
+def measure(client):
+    counts = {}
+    for url in PAGE_BUDGETS:
+        # Requests share the fixture's app context, and with it anything kept in g.
+        g.pop('content_version', None)
+        with count_queries(db.engine) as counter:
+            response = client.get(url)
+        assert response.status_code == 200, url
+        counts[url] = counter.count
+    return counts
+
+
+@pytest.fixture(scope='module')
+def counts(app, seed):
+    client = app.test_client()
+    seed(2)
+    small = measure(client)
+    seed(4)
+    large = measure(client)
+    return small, large
+
+
+@pytest.mark.parametrize('url', PAGE_BUDGETS)
+def test_page_within_query_budget(counts, url):
+    small, large = counts
+    assert large[url] <= PAGE_BUDGETS[url]
+    assert small[url] == large[url], 'the number of queries grows with the archive'
@@ -0,0 +1,46 @@
+import re
+
+import pytest
+
+from app import db
+from querycount import count_queries
+from test_query_budget import PAGE_BUDGETS
+
+# Tables that grow with the archive. Reading every course or tag is expected.
+LARGE_TABLES = {'subject', 'note', 'question_paper', 'note_tags', 'paper_tags', 'extracted_text'}
+# A scan without "USING INDEX" / "USING COVERING INDEX" reads the whole table.
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+
+
+def table_name(alias):
+    # Eager loads alias tables as subject_1, course_2 and so on.
+    return re.sub(r'_\d+$', '', alias)
+
+
+def full_scans(statement, parameters):
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).all()
+    scans = []
+    for row in rows:
+        match = FULL_SCAN_RE.match(row[-1])
+        if match and table_name(match.group(1)) in LARGE_TABLES:
+            scans.append(match.group(1))
+    return scans
+
+
+@pytest.fixture(scope='module')
+def client(app, seed):
+    seed(4)
+    return app.test_client()
+
+
+@pytest.mark.parametrize('url', PAGE_BUDGETS)
+def test_page_queries_use_indexes(client, url):
+    with count_queries(db.engine) as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    problems = []
+    for statement, parameters in zip(counter.statements, counter.parameters):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            problems += [f'full scan of {scan}: {" ".join(statement.split())[:200]}'
+                         for scan in full_scans(statement, parameters)]
+    assert not problems
@@ -0,0 +1,216 @@
+"""Copy an existing SQLite archive, and its uploads, into the configured database.
+
+Rows are read in primary-key order in batches and each batch is committed on its
+own, so an interrupted run continues from the highest key already in the target.
+Postgres targets are loaded with COPY; other databases with executemany.
+"""
+import io
+import logging
+import os
+import shutil
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, func, inspect, null, select, text, tuple_
+
+import analytics
+import facets
+import search
+from app import db
+from storage import ENCODINGS, storage, _hash_file
+
+logger = logging.getLogger(__name__)
+
+# Derived tables are rebuilt from the copied rows instead of being copied.
+DERIVED_TABLES = {'paper_facet'}
+
+
+class TransferError(Exception):
+    pass
+
+
+def copied_tables():
+    return [t for t in db.metadata.sorted_tables if t.name not in DERIVED_TABLES]
+
+
+def _key(table):
+    return list(table.primary_key.columns)
+
+
+def _count(connection, table):
+    return connection.execute(select(func.count()).select_from(table)).scalar()
+
+
+def _last_key(connection, table):
+    key = _key(table)
+    return connection.execute(select(*key).order_by(*[c.desc() for c in key]).limit(1)).first()
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, (bytes, memoryview)):
+        value = '\\x' + bytes(value).hex()
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_rows(connection, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(v) for v in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    names = ', '.join(f'"{c.name}"' for c in columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({names}) FROM STDIN', buffer)
+    finally:
+        cursor.close()
+
+
+def _insert_rows(connection, table, columns, rows):
+    if connection.dialect.name == 'postgresql':
+        _copy_rows(connection, table, columns, rows)
+    else:
+        connection.execute(table.insert(), [dict(row._mapping) for row in rows])
+
+
+def _backfill_updated_at(connection):
+    # Archives from before the API change feed have no updated_at; date their rows
+    # from when they were added, as migration 0004 does.
+    for table in copied_tables():
+        if 'updated_at' not in table.c:
+            continue
+        since = next((table.c[name] for name in ('created_at', 'uploaded_at') if name in table.c), None)
+        value = func.coalesce(since, func.current_timestamp()) if since is not None else func.current_timestamp()
+        connection.execute(table.update().where(table.c.updated_at.is_(None)).values(updated_at=value))
+
+
+def _reset_sequences(connection):
+    for table in copied_tables():
+        key = _key(table)
+        if len(key) != 1 or not key[0].autoincrement or not isinstance(key[0].type, db.Integer):
+            continue
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key[0].name}'), "
+            f"coalesce(max({key[0].name}), 1), max({key[0].name}) IS NOT NULL) FROM \"{table.name}\""
+        ))
+
+
+def copy_database(source_url, batch_size=10000, resume=False, progress=None):
+    """Copy every application table from ``source_url`` into the app's database.
+
+    Returns ``{table: (source_rows, target_rows)}``. Refuses to write into a
+    target that already has rows unless ``resume`` is set.
+    """
+    source = create_engine(source_url)
+    target = db.engine
+    if source.url == target.url:
+        raise TransferError('The source is the configured database.')
+    counts = {}
+    try:
+        with source.connect() as src, target.connect() as dst:
+            if not resume:
+                filled = [t.name for t in copied_tables() if _count(dst, t)]
+                if filled:
+                    raise TransferError(f"Target already has rows in {', '.join(filled)}; use --resume to continue.")
+            # Archives from before a migration may lack newer tables and columns.
+            inspector = inspect(src)
+            present = {name: {c['name'] for c in inspector.get_columns(name)} for name in inspector.get_table_names()}
+            for table in copied_tables():
+                columns = [c for c in table.columns if c.name in present.get(table.name, ())]
+                selected = list(columns)
+                if 'updated_at' in table.c and table.c.updated_at not in columns:
+                    # Copied as NULL rather than stamped with the column default, the
+                    # time of the copy, so _backfill_updated_at can date the rows.
+                    columns.append(table.c.updated_at)
+                    selected.append(null().label('updated_at'))
+                key = _key(table)
+                if not all(c.name in present.get(table.name, ()) for c in key):
+                    logger.info('Skipping %s, which the source does not have', table.name)
+                    counts[table.name] = (0, _count(dst, table))
+                    continue
+                total = _count(src, table)
+                last = _last_key(dst, table)
+                done = _count(dst, table)
+                while True:
+                    query = select(*selected).order_by(*key).limit(batch_size)
+                    if last is not None:
+                        query = query.where(tuple_(*key) > tuple_(*last))
+                    rows = src.execute(query).all()
+                    if not rows:
+                        break
+                    _insert_rows(dst, table, columns, rows)
+                    dst.commit()
+                    last = tuple(getattr(rows[-1], c.name) for c in key)
+                    done += len(rows)
+                    if progress is not None:
+                        progress(table.name, done, total)
+                counts[table.name] = (total, _count(dst, table))
+            _backfill_updated_at(dst)
+            dst.commit()
+            if dst.dialect.name == 'postgresql':
+                _reset_sequences(dst)
+                dst.commit()
+    finally:
+        source.dispose()
+
+    facets.rebuild_facets()
+    # init_database ran against the empty target; seed the all-time download
+    # totals from the copied counts unless the source already had rollups.
+    analytics.init_rollups()
+    search.init_search_index()
+    search.rebuild_search_index()
+    return counts
+
+
+def _source_file(source_dir, filename):
+    """Path of ``filename`` under ``source_dir``, plain or compressed, and its suffix."""
+    path = os.path.join(source_dir, filename)
+    for suffix in ('', *ENCODINGS.values()):
+        if os.path.isfile(path + suffix):
+            return path + suffix, suffix
+    return None, None
+
+
+def copy_uploads(source_dir, progress=None):
+    """Copy referenced upload files into storage and check every file's SHA-256.
+
+    Compressed files are copied as they are. Files already present in storage are
+    kept and only verified, so the copy can be repeated after an interruption.
+    Returns ``(copied, verified, problems)``.
+    """
+    from models import Blob, Note, QuestionPaper
+
+    filenames = {f for (f,) in db.session.query(Blob.filename)}
+    for model in (Note, QuestionPaper):
+        filenames.update(f for (f,) in db.session.query(model.filename).distinct())
+    expected = dict(db.session.query(Blob.filename, Blob.sha256))
+
+    copied = verified = 0
+    problems = []
+    for i, filename in enumerate(sorted(filenames), 1):
+        source, suffix = _source_file(source_dir, filename) if source_dir else (None, None)
+        if not storage.exists(filename):
+            if source is None:
+                problems.append(f'missing: {filename}')
+                continue
+            destination = storage.path(filename) + suffix
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            partial = destination + '.part'
+            shutil.copyfile(source, partial)
+            os.replace(partial, destination)
+            copied += 1
+        digest = storage.hash(filename)
+        # Legacy files have no recorded hash; compare them with the original instead.
+        wanted = expected.get(filename) or (_hash_file(source) if source and not suffix else None)
+        if wanted is not None and digest != wanted:
+            problems.append(f'checksum mismatch: {filename}')
+        else:
+            verified += 1
+        if progress is not None:
+            progress(i, len(filenames))
+    return copied, verified, problems